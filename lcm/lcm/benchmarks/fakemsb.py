@@ -0,0 +1,374 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-in for MSB and the services the LCM calls through it: multivim,
+catalog and gvnfmdriver, to run the LCM end to end without them.
+
+Each call waits for a latency drawn from a distribution set per operation,
+may fail with an injected error, and the servers and volumes it creates
+become ACTIVE and available after a transition delay, as they would on a
+real vim. Operations are named "<METHOD> <resource>", such as "POST servers"
+or "PUT grant", and "*" sets the default of all of them. Distributions are
+("fixed", seconds), ("uniform", low, high), ("lognormal", median, sigma) or
+("exponential", mean).
+
+Usage: python -m lcm.benchmarks.fakemsb [--port 8080] [--latency OP=DIST] [--error OP=RATE:CODE]
+       [--transition KIND=DIST] [--seed N]
+
+GET /fake/stats returns the calls and resources counted so far, and
+POST /fake/reset drops all the resources.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import math
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+import uuid
+
+from lcm.benchmarks.tosca_bench import make_vnfd
+
+MULTIVIM_PATH = "openoapi/multivim/v1/"
+CATALOG_PATH = "openoapi/catalog/v1/"
+GVNFMDRIVER_PATH = "openoapi/gvnfmdriver/v1/"
+DEFAULT_OP = "*"
+# http code of an injected error which closes the connection without answering
+DROP_CODE = "drop"
+# status of the resources which change state asynchronously, while
+# pending, once ready and while deleted
+RES_STATUS = {"servers": ("BUILD", "ACTIVE", "DELETING"),
+              "volumes": ("creating", "available", "deleting")}
+RES_KINDS = ["networks", "subnets", "ports", "flavors", "servers", "volumes"]
+# fields multivim returns with their defaults when the create leaves them out
+RES_DEFAULTS = {"networks": {"shared": False, "routerExternal": False, "vlanTransparent": False},
+                "subnets": {"enableDhcp": 1}}
+
+
+def sample(dist):
+    """
+    Return a number of seconds drawn from the distribution dist.
+    """
+    if not dist:
+        return 0
+    kind, args = dist[0], dist[1:]
+    if kind == "fixed":
+        return args[0]
+    if kind == "uniform":
+        return random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return random.lognormvariate(math.log(args[0]), args[1])
+    if kind == "exponential":
+        return random.expovariate(1.0 / args[0])
+    raise ValueError("Unknown distribution(%s)" % kind)
+
+
+def parse_dist(text):
+    """
+    Parse a distribution written as "uniform:0.01:0.05".
+    """
+    fields = text.split(":")
+    return tuple([fields[0]] + [float(f) for f in fields[1:]])
+
+
+def get_image_names(vnfd):
+    return [node["properties"]["name"]["value"] for node in vnfd["instance"]["nodes"]
+            if node["type_name"].endswith("ImageFile") and "name" in node["properties"]]
+
+
+class FakeError(Exception):
+    def __init__(self, http_code, message=""):
+        super(FakeError, self).__init__(message)
+        self.http_code = http_code
+
+
+class FakeMsb(object):
+    """
+    State and behavior of the stand-in services, shared by the threads of
+    FakeMsbServer.
+
+    latency and transition map operations and resource kinds to
+    distributions, errors maps operations to (rate, http code) or to
+    (rate, http code, applied): an applied error is returned after the
+    call took effect, as when the answer of the vim is lost.
+    """
+    def __init__(self, latency=None, errors=None, transition=None, tenants=None, images=None,
+                 grant=None, vnfd_id="bench_vnfd", csar_id="bench_csar", vnfd=None):
+        self.latency = latency or {}
+        self.errors = errors or {}
+        self.transition = transition or {}
+        self.vnfd = vnfd or make_vnfd(5)
+        self.tenants = tenants or ["vnfm"]
+        self.images = images or get_image_names(self.vnfd)
+        self.grant = grant or {"vimid": "fake_vim", "tenant": self.tenants[0]}
+        self.vnfd_id = vnfd_id
+        self.csar_id = csar_id
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.resources = {}
+            self.calls = {}
+            self.injected = {}
+            self.notifications = 0
+
+    def get_option(self, options, op):
+        return options.get(op, options.get(DEFAULT_OP))
+
+    def handle(self, method, path, body):
+        """
+        Return the (http code, response) of a call, after its latency.
+        """
+        url = urlparse.urlparse(path)
+        path, query = url.path.strip("/"), urlparse.parse_qs(url.query)
+        route, op = self.route(method, path)
+        if route == self.handle_fake:
+            return route(method, path, query, {})
+        with self.lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        time.sleep(sample(self.get_option(self.latency, op)))
+        error = self.get_option(self.errors, op)
+        applied = False
+        if error and random.random() < error[0]:
+            if len(error) < 3 or not error[2]:
+                self.count_injected(op)
+                raise FakeError(str(error[1]), "Injected error of %s" % op)
+            applied = True
+        data = json.loads(body) if body else {}
+        ret = route(method, path, query, data)
+        if applied:
+            self.count_injected(op)
+            raise FakeError(str(error[1]), "Injected error of %s" % op)
+        return ret
+
+    def count_injected(self, op):
+        with self.lock:
+            self.injected[op] = self.injected.get(op, 0) + 1
+
+    def route(self, method, path):
+        if path.startswith(MULTIVIM_PATH):
+            fields = path[len(MULTIVIM_PATH):].split("/")
+            kind = "tenants" if len(fields) == 2 else fields[2] if len(fields) > 2 else ""
+            return self.handle_vim, "%s %s" % (method, kind)
+        if path.startswith(CATALOG_PATH):
+            kind = "rawdata" if path.endswith("queryingrawdata") else path[len(CATALOG_PATH):].split("/")[0]
+            return self.handle_catalog, "%s %s" % (method, kind)
+        if path.startswith(GVNFMDRIVER_PATH):
+            return self.handle_gvnfmdriver, "%s %s" % (method, path.split("/")[-1])
+        if path.startswith("fake/"):
+            return self.handle_fake, "%s %s" % (method, path)
+        return self.handle_missing, "%s %s" % (method, path)
+
+    def handle_missing(self, method, path, query, data):
+        raise FakeError("404", "No route to %s %s" % (method, path))
+
+    def handle_fake(self, method, path, query, data):
+        if path == "fake/stats" and method == "GET":
+            return "200", self.get_stats()
+        if path == "fake/reset" and method == "POST":
+            self.reset()
+            return "200", {}
+        return self.handle_missing(method, path, query, data)
+
+    def handle_catalog(self, method, path, query, data):
+        if path.endswith("queryingrawdata") and method == "POST":
+            return "200", {"csarId": data.get("csarId"), "rawData": json.dumps(self.vnfd)}
+        if path.startswith(CATALOG_PATH + "csars/") and method == "GET":
+            return "200", {"csarId": path.split("/")[-1], "vnfdId": self.vnfd_id, "onBoardState": "onBoarded"}
+        return self.handle_missing(method, path, query, data)
+
+    def handle_gvnfmdriver(self, method, path, query, data):
+        if path.endswith("vnfpackages") and method == "GET":
+            return "200", {"csars": [{"vnfdId": self.vnfd_id, "csarId": self.csar_id}]}
+        if path.endswith("resource/grant") and method == "PUT":
+            return "201", self.grant
+        if path.endswith("lifecyclechangesnotification") and method == "POST":
+            with self.lock:
+                self.notifications += 1
+            return "200", {}
+        return self.handle_missing(method, path, query, data)
+
+    def handle_vim(self, method, path, query, data):
+        fields = path[len(MULTIVIM_PATH):].split("/")
+        vim_id = fields[0]
+        if len(fields) == 2 and fields[1] == "tenants" and method == "GET":
+            names = query.get("name") or self.tenants
+            return "200", {"tenants": [{"id": "tenant_%s" % name, "name": name}
+                                       for name in names if name in self.tenants]}
+        if len(fields) < 3:
+            return self.handle_missing(method, path, query, data)
+        tenant_id, kind = fields[1], fields[2]
+        if kind == "images" and method == "GET":
+            return "200", {"images": [{"id": "image_%s" % name, "name": name} for name in self.images]}
+        if kind not in RES_KINDS:
+            return self.handle_missing(method, path, query, data)
+        key = (vim_id, tenant_id, kind)
+        if len(fields) == 3 and method == "POST":
+            return "201", self.create(key, data)
+        if len(fields) == 3 and method == "GET":
+            return "200", {kind: self.list(key)}
+        if len(fields) == 4 and method == "GET":
+            return "200", self.get(key, fields[3])
+        if len(fields) == 4 and method == "DELETE":
+            self.delete(key, fields[3])
+            return "204", None
+        return self.handle_missing(method, path, query, data)
+
+    def create(self, key, data):
+        res = dict(RES_DEFAULTS.get(key[2], {}), **data)
+        res.update(id=str(uuid.uuid4()), vimId=key[0], tenantId=key[1], returnCode=1)
+        now = time.time()
+        with self.lock:
+            self.resources.setdefault(key, {})[res["id"]] = {
+                "res": res, "ready": now + sample(self.transition.get(key[2])), "deleted": None}
+            return self.get_info(key, res["id"], now)
+
+    def list(self, key):
+        now = time.time()
+        with self.lock:
+            self.purge(key, now)
+            return [self.get_info(key, res_id, now) for res_id in self.resources.get(key, {})]
+
+    def get(self, key, res_id):
+        now = time.time()
+        with self.lock:
+            self.purge(key, now)
+            if res_id not in self.resources.get(key, {}):
+                raise FakeError("404", "%s(%s) does not exist" % (key[2], res_id))
+            return self.get_info(key, res_id, now)
+
+    def delete(self, key, res_id):
+        now = time.time()
+        with self.lock:
+            self.purge(key, now)
+            entry = self.resources.get(key, {}).get(res_id)
+            if not entry:
+                raise FakeError("404", "%s(%s) does not exist" % (key[2], res_id))
+            if not entry["deleted"]:
+                entry["deleted"] = now + sample(self.transition.get(key[2]))
+
+    def purge(self, key, now):
+        resources = self.resources.get(key, {})
+        for res_id in [res_id for res_id, entry in resources.items() if entry["deleted"] and entry["deleted"] <= now]:
+            del resources[res_id]
+
+    def get_info(self, key, res_id, now):
+        entry = self.resources[key][res_id]
+        res = dict(entry["res"])
+        if key[2] in RES_STATUS:
+            pending, ready, deleting = RES_STATUS[key[2]]
+            res["status"] = deleting if entry["deleted"] else ready if now >= entry["ready"] else pending
+        return res
+
+    def get_stats(self):
+        with self.lock:
+            resources = {}
+            for key, entries in self.resources.items():
+                resources[key[2]] = resources.get(key[2], 0) + len(entries)
+            return {"calls": dict(self.calls), "injected": dict(self.injected), "resources": resources,
+                    "notifications": self.notifications}
+
+
+class FakeMsbHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle_call(self):
+        length = int(self.headers.getheader("Content-Length") or 0)
+        body = self.rfile.read(length) if length else ""
+        try:
+            http_code, ret = self.server.fake.handle(self.command, self.path, body)
+        except FakeError as e:
+            if e.http_code == DROP_CODE:
+                self.close_connection = 1
+                return
+            http_code, ret = e.http_code, {"error": e.message}
+        body = json.dumps(ret) if ret is not None else ""
+        self.send_response(int(http_code))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_call
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeMsbServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serve a FakeMsb on a thread per connection. Port 0 picks a free port.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, fake, host="127.0.0.1", port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FakeMsbHandler)
+        self.fake = fake
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_options(items, parse_value):
+    options = {}
+    for item in items or []:
+        name, value = item.split("=", 1)
+        options[name] = parse_value(value)
+    return options
+
+
+def parse_error(text):
+    fields = text.split(":")
+    return (float(fields[0]), fields[1]) + tuple(f == "applied" for f in fields[2:3])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stand-in for MSB, multivim, catalog and gvnfmdriver.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", action="append", help='e.g. "POST servers=lognormal:0.2:0.5"')
+    parser.add_argument("--error", action="append", help='e.g. "POST servers=0.01:503" or "*=0.001:drop:applied"')
+    parser.add_argument("--transition", action="append", help='e.g. "servers=uniform:5:20"')
+    parser.add_argument("--image", action="append", help="name of an image listed by the vims")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    server = FakeMsbServer(FakeMsb(latency=parse_options(args.latency, parse_dist),
+                                   errors=parse_options(args.error, parse_error),
+                                   transition=parse_options(args.transition, parse_dist),
+                                   images=args.image),
+                           args.host, args.port)
+    print "Serving on %s:%d" % (args.host, server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,258 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+End-to-end benchmark of the VNF lifecycle through the REST views, against
+the FakeMsb stand-in: each VNF is created, instantiated, queried,
+terminated and deleted. The phases run one after the other, each on all
+the VNFs with the given concurrency, so that the DB queries and the calls
+to MSB of a phase can be divided among its operations.
+
+Usage: python manage.py test lcm.benchmarks.lcm_bench
+with the environment variables:
+    LCM_BENCH_VNFS, LCM_BENCH_VDUS, LCM_BENCH_CONCURRENCY: the scenario, 20, 5 and 10 by default
+    LCM_BENCH_TOLERANCE: relative regression allowed against the baseline, 0.2 by default
+    LCM_BENCH_UPDATE_BASELINE=1: store the results as the baseline of the scenario
+
+The run fails if an operation fails, or if the p95 latency, DB queries or
+MSB calls per operation of a phase regress past the stored baseline.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import Client, TransactionTestCase
+
+from lcm.benchmarks.fakemsb import FakeMsb, FakeMsbServer
+from lcm.benchmarks.tosca_bench import make_vnfd, NODES_PER_VDU
+from lcm.pub.utils import restcall
+from lcm.pub.utils.cacheutil import vnfd_model_cache, vim_meta_cache
+from lcm.pub.vimapi.guard import vim_guards
+from lcm.pub.vimapi.latency import get_percentile
+from lcm.pub.vimapi.poller import poller
+
+PHASES = ["create", "instantiate", "query", "terminate", "delete"]
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+# latencies compared to the baseline, and seconds of difference always allowed
+CHECKED_LATENCIES = ["p95"]
+LATENCY_SLACK = 0.05
+JOB_TIMEOUT = 300
+# latencies of FakeMsb and of the state transitions of its resources
+FAKE_LATENCY = {"*": ("lognormal", 0.005, 0.5), "POST servers": ("lognormal", 0.05, 0.5),
+                "POST volumes": ("lognormal", 0.02, 0.5)}
+FAKE_TRANSITION = {"servers": ("uniform", 0.1, 0.3), "volumes": ("uniform", 0.05, 0.1)}
+POLL_INTERVAL, POLL_MAX_INTERVAL = 0.05, 0.5
+
+# the threads of the benchmark share the test DB, which an in-memory sqlite
+# DB cannot be on python 2: it is set before the test runner creates it
+if connection.vendor == "sqlite":
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tempfile.gettempdir(), "lcm_bench.sqlite3")
+
+VNF_URL = "/openoapi/vnflcm/v1/vnf_instances"
+JOB_URL = "/openoapi/vnflcm/v1/vnf_lc_ops/%s"
+
+
+class QueryCounter(object):
+    """
+    Count the SQL statements run by all the threads while entered.
+    """
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+        self.funs = {}
+
+    def __enter__(self):
+        for name in ("execute", "executemany"):
+            self.funs[name] = getattr(CursorWrapper, name)
+            setattr(CursorWrapper, name, self.wrap(self.funs[name]))
+        return self
+
+    def __exit__(self, *args):
+        for name, fun in self.funs.items():
+            setattr(CursorWrapper, name, fun)
+
+    def wrap(self, fun):
+        def counted(cursor, *args, **kwargs):
+            with self.lock:
+                self.count += 1
+            return fun(cursor, *args, **kwargs)
+        return counted
+
+
+class VnfLifecycle(object):
+    """
+    The REST calls of the lifecycle of one VNF, each returning whether it
+    succeeded.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.client = Client()
+        self.inst_id = None
+
+    def create(self):
+        resp = self.client.post(VNF_URL, data=json.dumps({"vnfdId": "bench_vnfd", "vnfInstanceName": self.name}),
+                                content_type="application/json")
+        self.inst_id = resp.data.get("vnfInstanceId") if resp.status_code == 201 else None
+        return bool(self.inst_id)
+
+    def instantiate(self):
+        data = {"flavourId": "default", "additionalParams": {"vimId": "fake_vim", "inputs": {}}}
+        return self.run_job("%s/%s/instantiate" % (VNF_URL, self.inst_id), data)
+
+    def query(self):
+        return self.client.get("%s/%s" % (VNF_URL, self.inst_id)).status_code == 200
+
+    def terminate(self):
+        return self.run_job("%s/%s/terminate" % (VNF_URL, self.inst_id), {"terminationType": "FORCEFUL"})
+
+    def delete(self):
+        return self.client.delete("%s/%s" % (VNF_URL, self.inst_id)).status_code == 204
+
+    def run_job(self, url, data):
+        resp = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        if resp.status_code != 202:
+            return False
+        job_id, response_id = resp.data["jobId"], 0
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            ret = self.client.get(JOB_URL % job_id, {"responseId": response_id, "timeout": 10}).data
+            descriptor = ret.get("responseDescriptor")
+            if not descriptor:
+                continue
+            if descriptor["progress"] in (100, 255):
+                return descriptor["progress"] == 100
+            response_id = descriptor["responseId"]
+        return False
+
+
+def run_phase(pool, vnfs, phase, fake):
+    calls_before = sum(fake.get_stats()["calls"].values())
+
+    def run_op(vnf):
+        begin = time.time()
+        # the VNFs which could not be created fail all the other phases
+        ok = (phase == "create" or vnf.inst_id) and getattr(vnf, phase)()
+        return ok, time.time() - begin
+
+    with QueryCounter() as counter:
+        rets = pool.map(run_op, vnfs)
+    latencies = sorted(latency for ok, latency in rets)
+    count = len(vnfs)
+    return {"count": count,
+            "errors": len([ok for ok, latency in rets if not ok]),
+            "p50": round(get_percentile(latencies, 50), 3),
+            "p95": round(get_percentile(latencies, 95), 3),
+            "p99": round(get_percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3),
+            "dbQueries": round(float(counter.count) / count, 2),
+            "httpCalls": round(float(sum(fake.get_stats()["calls"].values()) - calls_before) / count, 2)}
+
+
+def run_bench(vnf_count, vdu_count, concurrency):
+    """
+    Run the lifecycle of vnf_count VNFs of vdu_count VDUs each and return
+    the results of each phase.
+    """
+    fake = FakeMsb(latency=FAKE_LATENCY, transition=FAKE_TRANSITION, vnfd=make_vnfd(vdu_count * NODES_PER_VDU))
+    server = FakeMsbServer(fake).start()
+    saved = (restcall.MSB_SERVICE_IP, restcall.MSB_SERVICE_PORT, poller.interval, poller.max_interval)
+    restcall.MSB_SERVICE_IP, restcall.MSB_SERVICE_PORT = "127.0.0.1", server.port
+    poller.interval, poller.max_interval = POLL_INTERVAL, POLL_MAX_INTERVAL
+    for cache in (vnfd_model_cache, vim_meta_cache, vim_guards):
+        cache.clear()
+    pool = ThreadPool(concurrency)
+    try:
+        vnfs = [VnfLifecycle("bench_vnf_%d" % i) for i in range(vnf_count)]
+        return dict((phase, run_phase(pool, vnfs, phase, fake)) for phase in PHASES)
+    finally:
+        pool.terminate()
+        restcall.http_pool.clear()
+        poller.stop()
+        server.stop()
+        restcall.MSB_SERVICE_IP, restcall.MSB_SERVICE_PORT, poller.interval, poller.max_interval = saved
+
+
+def get_scenario(vnf_count, vdu_count, concurrency):
+    return "vnfs=%d,vdus=%d,concurrency=%d" % (vnf_count, vdu_count, concurrency)
+
+
+def check_baseline(report, baseline, tolerance):
+    """
+    Return the regressions of report against baseline, as messages.
+    """
+    regressions = []
+    for phase, results in sorted(report.items()):
+        base = baseline.get(phase)
+        if not base:
+            continue
+        for key in CHECKED_LATENCIES:
+            if results[key] > base[key] * (1 + tolerance) + LATENCY_SLACK:
+                regressions.append("%s %s: %.3fs > baseline %.3fs" % (phase, key, results[key], base[key]))
+        for key in ("dbQueries", "httpCalls"):
+            if results[key] > base[key] * (1 + tolerance):
+                regressions.append("%s %s: %.1f > baseline %.1f" % (phase, key, results[key], base[key]))
+    return regressions
+
+
+def format_report(scenario, report):
+    lines = ["LCM benchmark %s" % scenario,
+             "%-12s %6s %6s %8s %8s %8s %8s %10s %10s" % (
+                 "phase", "ops", "errors", "p50", "p95", "p99", "max", "queries/op", "calls/op")]
+    for phase in PHASES:
+        results = report[phase]
+        lines.append("%-12s %6d %6d %8.3f %8.3f %8.3f %8.3f %10.1f %10.1f" % (
+            phase, results["count"], results["errors"], results["p50"], results["p95"], results["p99"],
+            results["max"], results["dbQueries"], results["httpCalls"]))
+    return "\n".join(lines)
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baselines(baselines):
+    with open(BASELINE_FILE, "w") as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True, separators=(",", ": "))
+        baseline_file.write("\n")
+
+
+class LcmBench(TransactionTestCase):
+    def test_lifecycle(self):
+        vnf_count = int(os.environ.get("LCM_BENCH_VNFS", 20))
+        vdu_count = int(os.environ.get("LCM_BENCH_VDUS", 5))
+        concurrency = int(os.environ.get("LCM_BENCH_CONCURRENCY", 10))
+        tolerance = float(os.environ.get("LCM_BENCH_TOLERANCE", 0.2))
+        scenario = get_scenario(vnf_count, vdu_count, concurrency)
+        report = run_bench(vnf_count, vdu_count, concurrency)
+        # stdout is captured by the test runner
+        sys.__stderr__.write("\n%s\n" % format_report(scenario, report))
+        errors = sum(results["errors"] for results in report.values())
+        self.assertEqual(0, errors, "%d operations failed" % errors)
+        baselines = load_baselines()
+        if os.environ.get("LCM_BENCH_UPDATE_BASELINE") == "1":
+            baselines[scenario] = report
+            save_baselines(baselines)
+            return
+        regressions = check_baseline(report, baselines.get(scenario, {}), tolerance)
+        self.assertEqual([], regressions, "\n".join(regressions))
@@ -0,0 +1,72 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+import unittest
+
+import mock
+
+from lcm.benchmarks.fakemsb import FakeMsb, FakeMsbServer
+from lcm.pub.msapi import gvnfmdriver
+from lcm.pub.utils import restcall
+from lcm.pub.vimapi import api
+from lcm.pub.vimapi.exceptions import VimException
+from lcm.pub.vimapi.guard import vim_guards
+from lcm.pub.vimapi.poller import poller
+
+
+class FakeMsbTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeMsb(transition={"servers": ("fixed", 0.2)})
+        self.server = FakeMsbServer(self.fake).start()
+        self.patcher = mock.patch.multiple(restcall, MSB_SERVICE_IP="127.0.0.1", MSB_SERVICE_PORT=self.server.port)
+        self.patcher.start()
+        vim_guards.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+        restcall.http_pool.clear()
+        poller.stop()
+        self.server.stop()
+        vim_guards.clear()
+
+    def test_vm_becomes_active(self):
+        tenant_id = api.list_tenant("vim_1", "vnfm")["tenants"][0]["id"]
+        vm = api.create_vm("vim_1", tenant_id, {"name": "vm_1"})
+        self.assertEqual(("vm_1", "BUILD"), (vm["name"], vm["status"]))
+        time.sleep(0.3)
+        self.assertEqual("ACTIVE", api.list_vm("vim_1", tenant_id)["servers"][0]["status"])
+        api.delete_vm("vim_1", tenant_id, vm["id"])
+        self.assertEqual("DELETING", api.list_vm("vim_1", tenant_id)["servers"][0]["status"])
+        time.sleep(0.3)
+        self.assertEqual([], api.list_vm("vim_1", tenant_id)["servers"])
+
+    def test_injected_errors(self):
+        self.fake.errors = {"POST networks": (1.0, 503), "POST ports": (1.0, 504, True)}
+        try:
+            api.create_network("vim_1", "tenant_1", {"name": "net_1"})
+            self.fail("no error injected")
+        except VimException as e:
+            self.assertEqual("503", e.http_code)
+        self.assertRaises(VimException, api.create_port, "vim_1", "tenant_1", {"name": "port_1"})
+        self.assertEqual([], api.list_network("vim_1", "tenant_1")["networks"])
+        self.assertEqual(["port_1"], [p["name"] for p in api.list_port("vim_1", "tenant_1")["ports"]])
+        self.assertEqual({"POST networks": 1, "POST ports": 1}, self.fake.get_stats()["injected"])
+
+    def test_package_and_grant(self):
+        package_info = gvnfmdriver.get_packageinfo_by_vnfdid("bench_vnfd")
+        self.assertEqual("bench_csar", package_info["csars"][0]["csarId"])
+        grant = gvnfmdriver.apply_grant_to_nfvo(json.dumps({}))
+        self.assertEqual({"vimid": "fake_vim", "tenant": "vnfm"}, grant)
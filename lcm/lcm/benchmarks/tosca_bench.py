@@ -0,0 +1,86 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the VNFD model conversion on a synthetic descriptor.
+
+Usage: python -m lcm.benchmarks.tosca_bench [node_count] [rounds]
+"""
+
+import json
+import sys
+import time
+
+from lcm.pub.utils import toscautil
+
+NODES_PER_VDU = 5
+
+
+def make_vnfd(node_count):
+    """
+    Build the raw data of a v1 VNFD with node_count nodes. Each VDU comes
+    with its image file, local storage, CP and virtual link, so that every
+    kind of reference the converter resolves is exercised. The converted
+    model can be instantiated once located on a vim.
+    """
+    nodes, node_tpls = [], []
+    for i in range(node_count / NODES_PER_VDU):
+        vdu, image, storage, cp, vl = ["%s_%d" % (kind, i) for kind in ("vdu", "image", "storage", "cp", "vl")]
+        nodes.append({"id": vdu, "template_name": vdu, "type_name": "tosca.nodes.nfv.ext.zte.VDU",
+                      "properties": {"key_vdu": {"type_name": "boolean", "value": True},
+                                     "name": {"type_name": "string", "value": vdu}},
+                      "relationships": [{"name": "guest_os", "target_node_id": image},
+                                        {"name": "local_storage", "target_node_id": storage}],
+                      "capabilities": [{"name": "nfv_compute", "properties": {
+                          "num_cpus": {"type_name": "integer", "value": 2},
+                          "mem_size": {"type_name": "string", "value": "2 GB"}}}]})
+        nodes.append({"id": image, "template_name": image, "type_name": "tosca.nodes.nfv.ext.ImageFile",
+                      "properties": {"file_url": {"type_name": "string", "value": "/image/%s.qcow2" % image},
+                                     "name": {"type_name": "string", "value": image}}})
+        nodes.append({"id": storage, "template_name": storage, "type_name": "tosca.nodes.nfv.ext.LocalStorage",
+                      "properties": {"size": {"type_name": "string", "value": "10 GB"},
+                                     "disk_type": {"type_name": "string", "value": "root"}}})
+        nodes.append({"id": cp, "template_name": cp, "type_name": "tosca.nodes.nfv.ext.zte.CP",
+                      "properties": {"order": {"type_name": "integer", "value": 0},
+                                     "name": {"type_name": "string", "value": cp}},
+                      "relationships": [{"name": "virtualbinding", "target_node_id": vdu},
+                                        {"name": "virtualLink", "target_node_id": vl}]})
+        nodes.append({"id": vl, "template_name": vl, "type_name": "tosca.nodes.nfv.ext.zte.VL",
+                      "properties": {"vl_flavours": {"type_name": "map", "value": {"vl_id": vl}},
+                                     "name": {"type_name": "string", "value": vl},
+                                     "network_name": {"type_name": "string", "value": vl},
+                                     "network_type": {"type_name": "string", "value": "vlan"},
+                                     "cidr": {"type_name": "string", "value": "10.%d.%d.0/24" % (i / 256, i % 256)}}})
+        node_tpls.append({"name": cp, "requirement_templates": [
+            {"name": "virtualbinding", "target_node_template_name": vdu},
+            {"name": "virtualLink", "target_node_template_name": vl}]})
+    return {"instance": {"metadata": {"id": "bench_vnfd", "vendor": "ZTE"}, "nodes": nodes},
+            "model": {"node_templates": node_tpls}}
+
+
+def run(node_count=2000, rounds=3):
+    src_json = json.dumps(make_vnfd(node_count))
+    costs = []
+    for _ in range(rounds):
+        start = time.time()
+        vnfd = toscautil.convert_vnfd_dict(src_json)
+        costs.append(time.time() - start)
+    assert len(vnfd["vdus"]) == node_count / NODES_PER_VDU
+    return {"nodes": node_count, "rounds": rounds, "min": min(costs), "avg": sum(costs) / len(costs)}
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    result = run(*args)
+    print "convert_vnfd_model: %(nodes)d nodes, min %(min).3fs, avg %(avg).3fs over %(rounds)d rounds" % result
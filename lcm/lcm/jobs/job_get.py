@@ -11,20 +11,37 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import json
 import logging
+import time
 
+from lcm.pub.config.config import JOB_EVENTS_KEEPALIVE, JOB_EVENTS_MAX_DURATION, JOB_STATUS_QUERY_LIMIT
 from lcm.pub.utils.jobutil import JobUtil
 
 logger = logging.getLogger(__name__)
 
 
+def job_status_to_dict(job):
+    return {
+        "status": job.status,
+        "progress": job.progress,
+        "statusDescription": job.descp,
+        "errorCode": job.errcode,
+        "responseId": job.indexid}
+
+
 class GetJobInfoService(object):
-    def __init__(self, job_id, response_id=0):
+    def __init__(self, job_id, response_id=0, timeout=0, limit=JOB_STATUS_QUERY_LIMIT):
         self.job_id = job_id
         self.response_id = response_id if response_id else 0
+        self.timeout = timeout
+        self.limit = limit
 
     def do_biz(self):
-        jobs = JobUtil.query_job_status(self.job_id, self.response_id)
+        if self.timeout > 0:
+            jobs = JobUtil.wait_job_status(self.job_id, self.response_id, self.timeout, self.limit)
+        else:
+            jobs = JobUtil.query_job_status(self.job_id, self.response_id, self.limit)
         if not jobs:
             return {"jobId": self.job_id}
         ret = {
@@ -35,11 +52,34 @@ class GetJobInfoService(object):
                 "statusDescription": jobs[0].descp,
                 "errorCode": jobs[0].errcode,
                 "responseId": jobs[0].indexid,
-                "responseHistoryList": [
-                    {
-                        "status": job.status,
-                        "progress": job.progress,
-                        "statusDescription": job.descp,
-                        "errorCode": job.errcode,
-                        "responseId": job.indexid} for job in jobs[1:]]}}
+                "responseHistoryList": [job_status_to_dict(job) for job in jobs[1:]]}}
         return ret
+
+
+class JobEventService(object):
+    """
+    Stream the statuses of a job newer than response_id as server-sent
+    events, until the job ends or max_duration seconds have passed.
+    """
+    def __init__(self, job_id, response_id=0, keepalive=JOB_EVENTS_KEEPALIVE, max_duration=JOB_EVENTS_MAX_DURATION):
+        self.job_id = job_id
+        self.response_id = response_id if response_id else 0
+        self.keepalive = keepalive
+        self.max_duration = max_duration
+
+    def events(self):
+        deadline = time.time() + self.max_duration
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            jobs = JobUtil.wait_job_status(self.job_id, self.response_id, min(remaining, self.keepalive),
+                                           JOB_STATUS_QUERY_LIMIT, oldest=True)
+            if not jobs:
+                yield ": keep-alive\n\n"
+                continue
+            for job in reversed(jobs):
+                self.response_id = job.indexid
+                yield "id: %d\nevent: status\ndata: %s\n\n" % (job.indexid, json.dumps(job_status_to_dict(job)))
+                if job.progress >= 100:
+                    return
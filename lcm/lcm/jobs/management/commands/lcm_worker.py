@@ -0,0 +1,35 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from lcm.pub.config.config import LCM_OP_WORKERS, LCM_WORKER_POLL_INTERVAL
+from lcm.pub.utils.oputil import OpExecutor, OpJournal, run_worker
+
+
+class Command(BaseCommand):
+    help = "Run the LCM operations queued by the REST process when LCM_WORKER_MODE is 'process'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=LCM_OP_WORKERS,
+                            help='number of operations run at once by this process')
+        parser.add_argument('--poll-interval', type=float, default=LCM_WORKER_POLL_INTERVAL,
+                            help='seconds to wait before polling the queue again when it is empty')
+
+    def handle(self, *args, **options):
+        journal = OpJournal(OpExecutor(max_workers=options['workers']), mode='process')
+        try:
+            run_worker(journal, options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
@@ -11,10 +11,18 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import threading
+import time
+
+import mock
 from django.test import TestCase, Client
 from rest_framework import status
 
+from lcm.jobs import job_get
 from lcm.pub.database.models import JobModel, JobStatusModel
+from lcm.pub.utils.jobutil import JobUtil, job_status_hub
+from lcm.pub.utils.traceutil import tracer
+from lcm.pub.vimapi.guard import vim_guards
 
 
 class JobsViewTest(TestCase):
@@ -29,4 +37,81 @@ class JobsViewTest(TestCase):
         JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
         JobStatusModel(indexid=1, jobid=self.job_id, status='inst', progress=20, descp='inst').save()
         response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s?responseId=123456jhj" % self.job_id)
-        self.failUnlessEqual(status.HTTP_200_OK, response.status_code)
\ No newline at end of file
+        self.failUnlessEqual(status.HTTP_200_OK, response.status_code)
+
+    def test_job_since_response_id(self):
+        JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
+        for i in range(1, 4):
+            JobStatusModel(indexid=i, jobid=self.job_id, status='inst', progress=i * 10, descp='inst').save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s?responseId=1&timeout=5" % self.job_id)
+        self.assertEqual(3, response.data["responseDescriptor"]["responseId"])
+        self.assertEqual([2], [h["responseId"] for h in response.data["responseDescriptor"]["responseHistoryList"]])
+
+    def test_job_long_poll_timeout(self):
+        JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
+        JobStatusModel(indexid=1, jobid=self.job_id, status='inst', progress=20, descp='inst').save()
+        start = time.time()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s?responseId=1&timeout=1" % self.job_id)
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertEqual({"jobId": self.job_id}, response.data)
+
+    @mock.patch.object(JobUtil, 'query_job_status')
+    def test_job_long_poll_wakeup(self, mock_query_job_status):
+        mock_query_job_status.side_effect = [[], ["status_2"]]
+        threading.Timer(0.1, job_status_hub.publish, args=(self.job_id,)).start()
+        start = time.time()
+        self.assertEqual(["status_2"], JobUtil.wait_job_status(self.job_id, 1, 30))
+        self.assertLess(time.time() - start, 5)
+
+    def test_job_events(self):
+        JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
+        for i, progress in enumerate([0, 50, 100]):
+            JobStatusModel(indexid=i + 1, jobid=self.job_id, status='inst', progress=progress, descp='inst').save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s/events" % self.job_id, HTTP_LAST_EVENT_ID='1')
+        self.assertEqual('text/event-stream', response['Content-Type'])
+        events = ''.join(response.streaming_content).strip().split("\n\n")
+        self.assertEqual(["id: 2", "id: 3"], [event.split("\n")[0] for event in events])
+
+    def test_job_status_query_is_bounded(self):
+        JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
+        for i in range(1, 11):
+            JobStatusModel(indexid=i, jobid=self.job_id, status='inst', progress=i, descp='inst').save()
+        with self.assertNumQueries(1):
+            jobs = JobUtil.query_job_status(self.job_id, 2, limit=3)
+        self.assertEqual([10, 9, 8], [job.indexid for job in jobs])
+        jobs = JobUtil.query_job_status(self.job_id, 2, limit=3, oldest=True)
+        self.assertEqual([5, 4, 3], [job.indexid for job in jobs])
+        # the current progress is the latest, whatever the number of statuses
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s?responseId=5&limit=2" % self.job_id)
+        self.assertEqual(10, response.data["responseDescriptor"]["progress"])
+        self.assertEqual([9], [job["responseId"] for job in response.data["responseDescriptor"]["responseHistoryList"]])
+
+    @mock.patch.object(job_get, 'JOB_STATUS_QUERY_LIMIT', 2)
+    def test_job_events_catch_up_in_order(self):
+        JobModel(jobid=self.job_id, jobtype='VNF', jobaction='INST', resid='1').save()
+        for i in range(1, 6):
+            JobStatusModel(indexid=i, jobid=self.job_id, status='inst', progress=i * 25, descp='inst').save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_lc_ops/%s/events" % self.job_id)
+        events = ''.join(response.streaming_content).strip().split("\n\n")
+        self.assertEqual(["id: 1", "id: 2", "id: 3", "id: 4"], [event.split("\n")[0] for event in events])
+
+    def test_vim_stats(self):
+        vim_guards.clear()
+        vim_guards.get("vim_1").exit([1, "", "500"])
+        response = self.client.get("/openoapi/vnflcm/v1/vim_stats")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, response.data["vims"]["vim_1"]["failures"])
+        self.assertIn("hits", response.data["metaCache"])
+        self.assertIn("latencies", response.data)
+
+    def test_traces(self):
+        tracer.clear()
+        with tracer.span("instantiate", trace_id=self.job_id):
+            with tracer.span("inst_pre"):
+                pass
+        response = self.client.get("/openoapi/vnflcm/v1/traces?jobId=%s" % self.job_id)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(["inst_pre", "instantiate"], [span["name"] for span in response.data["spans"]])
+        response = self.client.get("/openoapi/vnflcm/v1/traces?jobId=%s&output=chrome" % self.job_id)
+        self.assertEqual(["instantiate", "inst_pre"],
+                         [e["name"] for e in response.data["traceEvents"] if e["ph"] == "X"])
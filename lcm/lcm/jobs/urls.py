@@ -14,10 +14,15 @@
 from django.conf.urls import patterns, url
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from lcm.jobs.views import JobView
+from lcm.jobs.views import JobView, JobEventsView, OpQueueView, VimStatsView, TraceView
 
 urlpatterns = patterns('',
                        url(r'^openoapi/vnflcm/v1/vnf_lc_ops/(?P<job_id>[0-9a-zA-Z_-]+)$', JobView.as_view()),
+                       url(r'^openoapi/vnflcm/v1/vnf_lc_ops/(?P<job_id>[0-9a-zA-Z_-]+)/events$',
+                           JobEventsView.as_view()),
+                       url(r'^openoapi/vnflcm/v1/lcm_op_queue$', OpQueueView.as_view()),
+                       url(r'^openoapi/vnflcm/v1/vim_stats$', VimStatsView.as_view()),
+                       url(r'^openoapi/vnflcm/v1/traces$', TraceView.as_view()),
                        )
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -13,16 +13,62 @@
 # limitations under the License.
 import logging
 
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from lcm.pub.config.config import JOB_WAIT_MAX_TIMEOUT, JOB_STATUS_QUERY_LIMIT
 from lcm.pub.utils.values import ignore_case_get
-from lcm.jobs.job_get import GetJobInfoService
+from lcm.pub.utils.cacheutil import vim_meta_cache
+from lcm.pub.utils.oputil import op_executor, op_journal
+from lcm.pub.utils.traceutil import tracer, to_chrome_trace
+from lcm.pub.vimapi.guard import vim_guards
+from lcm.pub.vimapi.latency import op_latencies
+from lcm.jobs.job_get import GetJobInfoService, JobEventService
 
 logger = logging.getLogger(__name__)
 
 
+def get_int_param(params, key, default=0):
+    val = ignore_case_get(params, key)
+    return int(val) if str(val).isdigit() else default
+
+
 class JobView(APIView):
     def get(self, request, job_id):
-        response_id = ignore_case_get(request.META, 'responseId')
-        ret = GetJobInfoService(job_id, response_id).do_biz()
+        response_id = get_int_param(request.query_params, 'responseId')
+        timeout = min(get_int_param(request.query_params, 'timeout'), JOB_WAIT_MAX_TIMEOUT)
+        limit = min(get_int_param(request.query_params, 'limit', JOB_STATUS_QUERY_LIMIT), JOB_STATUS_QUERY_LIMIT)
+        ret = GetJobInfoService(job_id, response_id, timeout, limit).do_biz()
         return Response(data=ret)
+
+
+class JobEventsView(APIView):
+    def get(self, request, job_id):
+        response_id = get_int_param(request.query_params, 'responseId')
+        response_id = get_int_param(request.META, 'HTTP_LAST_EVENT_ID', response_id)
+        resp = StreamingHttpResponse(JobEventService(job_id, response_id).events(), content_type='text/event-stream')
+        resp['Cache-Control'] = 'no-cache'
+        return resp
+
+
+class OpQueueView(APIView):
+    def get(self, request):
+        return Response(data=dict(op_executor.get_stats(), **op_journal.get_stats()))
+
+
+class VimStatsView(APIView):
+    def get(self, request):
+        return Response(data={"vims": vim_guards.get_stats(), "metaCache": vim_meta_cache.get_stats(),
+                              "latencies": op_latencies.get_stats()})
+
+
+class TraceView(APIView):
+    """
+    The recorded spans, of the job of jobId if given, as a list or in the
+    Chrome trace format with output=chrome.
+    """
+    def get(self, request):
+        spans = tracer.get_spans(ignore_case_get(request.query_params, 'jobId'))
+        if ignore_case_get(request.query_params, 'output') == 'chrome':
+            return Response(data=to_chrome_trace(spans))
+        return Response(data={"spans": spans})
@@ -25,6 +25,7 @@ from lcm.pub.utils import restcall
 from lcm.pub.utils.jobutil import JobUtil
 from lcm.pub.utils.timeutil import now_time
 from lcm.pub.vimapi import api
+from lcm.pub.vimapi.exceptions import VimException
 
 
 class TestNFTerminate(TestCase):
@@ -109,7 +110,7 @@ class TestNFTerminate(TestCase):
             {"vim": {"vimid": 'vimid_1', "accessinfo": {"tenant": 'tenantname_1'}}}), '200']
         t2_lcm_notify_result = [0, json.JSONEncoder().encode(''), '200']
         mock_call_req.side_effect = [t1_apply_grant_result, t2_lcm_notify_result]
-        mock_call.return_value = None
+        mock_call.return_value = {}
         data = {"terminationType": "FORCEFUL",
                 "gracefulTerminationTimeout": 120}
         self.nf_inst_id = '1111'
@@ -117,4 +118,32 @@ class TestNFTerminate(TestCase):
         JobUtil.add_job_status(self.job_id, 0, "INST_VNF_READY")
         TermVnf(data, nf_inst_id=self.nf_inst_id, job_id=self.job_id).run()
         self.assert_job_result(self.job_id, 100, "Terminate Vnf success.")
+        self.assertEqual(0, StorageInstModel.objects.filter(instid=self.nf_inst_id).count())
 
+    def test_keep_flavor_used_by_other_vnf(self):
+        FlavourInstModel.objects.create(flavourid="2", vimid="1", resouceid="11", instid="2222", is_predefined=1)
+        # both terminations query the flavor before either deletes it
+        term_vnfs = [TermVnf({}, nf_inst_id=inst_id, job_id='') for inst_id in ('1111', '2222')]
+        for term_vnf in term_vnfs:
+            term_vnf.query_inst_resource()
+            self.assertEqual(1, term_vnf.inst_resource['flavor'][0]['is_predefined'])
+        self.assertFalse(term_vnfs[0].release_flavor(term_vnfs[0].inst_resource['flavor'][0]))
+        self.assertTrue(term_vnfs[1].release_flavor(term_vnfs[1].inst_resource['flavor'][0]))
+        # the last user keeps its reference until the flavor is deleted
+        self.assertEqual(["2222"], [flavor.instid for flavor in FlavourInstModel.objects.all()])
+        self.assertIsNone(FlavourInstModel.objects.get(instid="2222").spechash)
+        term_vnfs[1].do_notify_delete("flavor", "11")
+        self.assertEqual(0, FlavourInstModel.objects.count())
+
+    @mock.patch.object(api, 'call')
+    def test_keep_flavor_failed_to_delete(self, mock_call):
+        def delete_call(vim_id, tenant_id, res, method, data=''):
+            if res.startswith("flavors/"):
+                raise VimException("forbidden", "403")
+            return {}
+        mock_call.side_effect = delete_call
+        term_vnf = TermVnf({}, nf_inst_id='1111', job_id='')
+        term_vnf.query_inst_resource()
+        term_vnf.delete_resource()
+        self.assertEqual(0, VmInstModel.objects.filter(instid='1111').count())
+        self.assertEqual(["11"], [flavor.resouceid for flavor in FlavourInstModel.objects.filter(instid='1111')])
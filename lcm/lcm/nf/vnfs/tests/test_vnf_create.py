@@ -21,17 +21,27 @@ from rest_framework import status
 from lcm.nf.vnfs.const import vnfd_rawdata, c1_data_get_tenant_id, c4_data_create_network, c2_data_create_volume, \
     c5_data_create_subnet, c3_data_get_volume, c6_data_create_port, c7_data_create_flavor, c8_data_list_image, \
     c9_data_create_vm, c10_data_get_vm, inst_req_data
-from lcm.nf.vnfs.vnf_create.inst_vnf import InstVnf
-from lcm.pub.database.models import NfInstModel, JobStatusModel
+from lcm.nf.vnfs.vnf_cancel.term_vnf import TermVnf
+from lcm.nf.vnfs.vnf_create.inst_vnf import InstVnf, update_reused_flavors
+from lcm.pub.database.models import NfInstModel, JobModel, JobStatusModel, StorageInstModel, VmInstModel, \
+    VNFCInstModel, NfvoRegInfoModel, LcmOpModel, FlavourInstModel
+from lcm.pub.exceptions import NFLCMQueueFullException
 from lcm.pub.utils import restcall
+from lcm.pub.utils.cacheutil import vnfd_model_cache, vim_meta_cache
 from lcm.pub.utils.jobutil import JobUtil
+from lcm.pub.utils.oputil import op_executor, OP_STATUS
 from lcm.pub.utils.timeutil import now_time
-from lcm.pub.vimapi import api
+from lcm.pub.utils.traceutil import tracer
+from lcm.pub.vimapi import adaptor, api
+from lcm.pub.vimapi.latency import op_latencies, OpLatencies, OP_WAIT
+from lcm.samples.tests import inst_res_data
 
 
 class TestNFInstantiate(TestCase):
     def setUp(self):
         self.client = Client()
+        vnfd_model_cache.clear()
+        vim_meta_cache.clear()
 
     def tearDown(self):
         pass
@@ -69,6 +79,24 @@ class TestNFInstantiate(TestCase):
         response = self.client.post("/openoapi/vnflcm/v1/vnf_instances/12/instantiate", data={}, format='json')
         self.failUnlessEqual(status.HTTP_202_ACCEPTED, response.status_code)
 
+    @mock.patch.object(op_executor, 'submit')
+    def test_instantiate_vnf_is_persisted(self, mock_submit):
+        response = self.client.post("/openoapi/vnflcm/v1/vnf_instances/12/instantiate", data={"a": "1"},
+                                    format='json')
+        self.failUnlessEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        op = LcmOpModel.objects.get(jobid=json.loads(response.content)["jobId"])
+        self.assertEqual(("12", OP_STATUS.QUEUED, {"a": "1"}), (op.instid, op.status, json.loads(op.data)))
+        self.assertEqual(1, mock_submit.call_count)
+
+    @mock.patch.object(op_executor, 'submit')
+    def test_instantiate_vnf_when_overloaded(self, mock_submit):
+        mock_submit.side_effect = NFLCMQueueFullException("Too many LCM operations are waiting(100).")
+        response = self.client.post("/openoapi/vnflcm/v1/vnf_instances/12/instantiate", data={}, format='json')
+        self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+        self.assertTrue(response.has_header('Retry-After'))
+        self.assertFalse(JobModel.objects.filter(resid='12').exists())
+        self.assertFalse(LcmOpModel.objects.filter(instid='12').exists())
+
     def test_instantiate_vnf_when_inst_id_not_exist(self):
         self.nf_inst_id = str(uuid.uuid4())
         self.job_id = JobUtil.create_job('NF', 'CREATE', self.nf_inst_id)
@@ -179,3 +207,174 @@ class TestNFInstantiate(TestCase):
         data = inst_req_data
         InstVnf(data, nf_inst_id=self.nf_inst_id, job_id=self.job_id).run()
         self.assert_job_result(self.job_id, 100, "Instantiate Vnf success.")
+        spans = tracer.get_spans(self.job_id)
+        names = [span["name"] for span in spans]
+        for name in ("inst_pre", "get_packageinfo_by_vnfdid", "query_rawdata_from_catalog", "convert_vnfd_model",
+                     "apply_grant", "apply_grant_to_nfvo", "create_res", "lcm_notify"):
+            self.assertIn(name, names)
+        root = spans[-1]
+        self.assertEqual(("instantiate", None), (root["name"], root["parentId"]))
+        self.assertEqual(root["spanId"], spans[names.index("create_res")]["parentId"])
+
+    def test_instantiate_vnf_flush_res_in_bulk(self):
+        self.nf_inst_id = '1111'
+        self.job_id = JobUtil.create_job('NF', 'CREATE', self.nf_inst_id)
+        inst_vnf = InstVnf(inst_req_data, nf_inst_id=self.nf_inst_id, job_id=self.job_id)
+        inst_vnf.do_notify(adaptor.RES_VOLUME, c2_data_create_volume)
+        # the owner is taken from the ids created with the vm, not from the volumeArray text
+        vm_data = dict(c9_data_create_vm, volumeArray="[{u'volumeId': u'4bd3e9eb-cd8b",
+                       volumeIds=[c2_data_create_volume["id"]])
+        inst_vnf.do_notify(adaptor.RES_VM, vm_data)
+        self.assertFalse(VmInstModel.objects.filter(instid=self.nf_inst_id).exists())
+        inst_vnf.flush_res()
+        self.assertEqual(1, StorageInstModel.objects.filter(instid=self.nf_inst_id).count())
+        self.assertEqual(1, VmInstModel.objects.filter(instid=self.nf_inst_id).count())
+        self.assertEqual(1, VNFCInstModel.objects.filter(instid=self.nf_inst_id).count())
+        vm = VmInstModel.objects.get(instid=self.nf_inst_id)
+        self.assertEqual(vm.vmid, StorageInstModel.objects.get(instid=self.nf_inst_id).ownerid)
+        JobUtil.flush_job_status(self.job_id)
+        self.assertEqual(1, JobStatusModel.objects.filter(jobid=self.job_id).count())
+
+    @mock.patch.object(api, 'call')
+    def test_instantiate_vnf_recover_rollback(self, mock_call):
+        mock_call.return_value = {}
+        self.nf_inst_id = '1111'
+        NfInstModel.objects.create(nfinstid=self.nf_inst_id, nf_name='vFW_01', package_id='222',
+                                   version='', vendor='', netype='', vnfd_model='', status='INSTANTIATED',
+                                   nf_desc='vFW in Nanjing TIC Edge', vnfdid='111', create_time=now_time())
+        NfvoRegInfoModel.objects.create(nfvoid=self.nf_inst_id, vnfminstid='11111', apiurl='1')
+        VmInstModel.objects.create(vmid="1", vimid="1", resouceid="11", insttype=0, instid=self.nf_inst_id,
+                                   vmname="test_01", is_predefined=1, operationalstate=1)
+        self.job_id = JobUtil.create_job('NF', 'CREATE', self.nf_inst_id)
+        InstVnf(inst_req_data, nf_inst_id=self.nf_inst_id, job_id=self.job_id).recover('apply_grant')
+        self.assertEqual(2, mock_call.call_count)
+        self.assertFalse(VmInstModel.objects.filter(instid=self.nf_inst_id).exists())
+        self.assertFalse(NfvoRegInfoModel.objects.filter(nfvoid=self.nf_inst_id).exists())
+        self.assertEqual('NOT_INSTANTIATED', NfInstModel.objects.get(nfinstid=self.nf_inst_id).status)
+        self.assert_job_result(self.job_id, 255, "Instantiate Vnf interrupted, rolled back.")
+
+    @mock.patch.object(api, 'call')
+    def test_instantiate_vnf_recover_unrecorded_res(self, mock_call):
+        vm_name = adaptor.get_tagged_name("vNat", adaptor.get_res_tag('1111', (adaptor.RES_VM, "vdu_vNat")))
+        servers = [{"id": "11", "name": vm_name}, {"id": "vm_2", "name": vm_name},
+                   {"id": "vm_3", "name": "vNat-other"}, {"id": "vm_4", "name": "vNat"}]
+
+        def vim_call(vim_id, tenant_id, res, method, data=''):
+            if res == "tenants":
+                return {"tenants": [{"id": "tenant_1", "name": "vnfm"}]}
+            if method == "DELETE" and res.startswith("servers/"):
+                servers[:] = [s for s in servers if s["id"] != res.split("/")[1]]
+                return {}
+            return {"servers": servers} if res == "servers" else {res: []}
+
+        mock_call.side_effect = vim_call
+        self.nf_inst_id = '1111'
+        NfInstModel.objects.create(nfinstid=self.nf_inst_id, nf_name='vFW_01', package_id='222',
+                                   version='', vendor='', netype='', vnfd_model=json.dumps(inst_res_data),
+                                   status='INSTANTIATED', nf_desc='', vnfdid='111', create_time=now_time())
+        NfvoRegInfoModel.objects.create(nfvoid=self.nf_inst_id, vnfminstid='11111', apiurl='1')
+        VmInstModel.objects.create(vmid="1", vimid="f1e33529-4a88-4155-9d7a-893cf2c80527", resouceid="11",
+                                   tenant="tenant_1", insttype=0, instid=self.nf_inst_id, vmname=vm_name,
+                                   is_predefined=1, operationalstate=1)
+        self.job_id = JobUtil.create_job('NF', 'CREATE', self.nf_inst_id)
+        InstVnf(inst_req_data, nf_inst_id=self.nf_inst_id, job_id=self.job_id).recover('apply_grant')
+        deletes = [c[0][2] for c in mock_call.call_args_list if c[0][3] == "DELETE"]
+        self.assertEqual(["servers/11", "servers/vm_2"], sorted(deletes))
+        self.assertEqual(["vm_3", "vm_4"], [s["id"] for s in servers])
+        self.assert_job_result(self.job_id, 255, "Instantiate Vnf interrupted, rolled back.")
+
+    @mock.patch.object(api, 'call')
+    def test_instantiate_vnf_recover_unrecorded_flavor(self, mock_call):
+        flavor_name = adaptor.get_flavor_param(inst_res_data, inst_res_data["vdus"][0])["name"]
+        flavors = [{"id": "flavor_1", "name": flavor_name}, {"id": "flavor_2", "name": flavor_name},
+                   {"id": "flavor_3", "name": "Flavor_other"}]
+
+        def vim_call(vim_id, tenant_id, res, method, data=''):
+            if res == "tenants":
+                return {"tenants": [{"id": "tenant_1", "name": "vnfm"}]}
+            return {"flavors": flavors} if res == "flavors" else {res: []}
+
+        mock_call.side_effect = vim_call
+        self.nf_inst_id = '1111'
+        NfInstModel.objects.create(nfinstid=self.nf_inst_id, nf_name='vFW_01', package_id='222',
+                                   version='', vendor='', netype='', vnfd_model=json.dumps(inst_res_data),
+                                   status='INSTANTIATED', nf_desc='', vnfdid='111', create_time=now_time())
+        NfvoRegInfoModel.objects.create(nfvoid=self.nf_inst_id, vnfminstid='11111', apiurl='1')
+        # another VNF uses flavor_2
+        FlavourInstModel.objects.create(flavourid="2", vimid="f1e33529-4a88-4155-9d7a-893cf2c80527",
+                                        tenant="tenant_1", resouceid="flavor_2", instid="2222", is_predefined=1)
+        self.job_id = JobUtil.create_job('NF', 'CREATE', self.nf_inst_id)
+        InstVnf(inst_req_data, nf_inst_id=self.nf_inst_id, job_id=self.job_id).recover('apply_grant')
+        deletes = [c[0][2] for c in mock_call.call_args_list if c[0][3] == "DELETE"]
+        self.assertEqual(["flavors/flavor_1"], deletes)
+        self.assertEqual(1, FlavourInstModel.objects.filter(resouceid="flavor_2", instid="2222").count())
+        self.assert_job_result(self.job_id, 255, "Instantiate Vnf interrupted, rolled back.")
+
+    @mock.patch.object(api, 'call')
+    def test_plan_instantiation(self, mock_call):
+        vim_id = "f1e33529-4a88-4155-9d7a-893cf2c80527"
+        # recorded by the process running the instantiations
+        worker_latencies = OpLatencies()
+        worker_latencies.record(vim_id, OP_WAIT % adaptor.RES_VM, 20)
+        worker_latencies.record("vim_2", OP_WAIT % adaptor.RES_VM, 100)
+        worker_latencies.save()
+        op_latencies.clear()
+        data = {"vnfdModel": json.dumps(inst_res_data), "additionalParams": {"vimId": vim_id, "tenant": "vnfm"}}
+        response = self.client.post("/openoapi/vnflcm/v1/instantiation_plan", data=json.dumps(data),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(0, mock_call.call_count)
+        self.assertEqual(6, len(response.data["resources"]))
+        self.assertEqual({"create": 6, "meta": 2, "poll": 8, "total": 16}, response.data["apiCalls"])
+        self.assertEqual(["network:vl_vNat", "subnet:vl_vNat", "port:cp_vNat", "vm:vdu_vNat"],
+                         response.data["criticalPath"]["resources"])
+        self.assertEqual(24, response.data["criticalPath"]["seconds"])
+        self.assertEqual({"vms": 1, "vcpu": 2, "memory": 2, "disk": 0, "volumes": 1, "volumeSize": 100},
+                         response.data["vims"][vim_id])
+        self.assertEqual(100, op_latencies.estimate("vim_3", OP_WAIT % adaptor.RES_VM, 30, 95))
+        op_latencies.clear()
+
+    @mock.patch.object(adaptor, 'get_flavor_hash')
+    def test_not_reuse_flavor_of_terminating_vnf(self, mock_get_flavor_hash):
+        mock_get_flavor_hash.return_value = "hash_1"
+        NfInstModel.objects.create(nfinstid='1111', nf_name='vnf_1', status='terminating', create_time=now_time())
+        FlavourInstModel.objects.create(flavourid="1", vimid="vim_1", tenant="tenant_1", resouceid="flavor_1",
+                                        instid="1111", is_predefined=1, spechash="hash_1")
+        vnfd = json.loads(json.dumps(inst_res_data))
+        vnfd["vdus"][0]["properties"]["location_info"] = {"vimid": "vim_1", "tenant": "admin"}
+        update_reused_flavors(vnfd, lambda vim_id, tenant: "tenant_1")
+        self.assertNotIn("flavor_id", vnfd["vdus"][0])
+        NfInstModel.objects.filter(nfinstid='1111').update(status='INSTANTIATED')
+        update_reused_flavors(vnfd, lambda vim_id, tenant: "tenant_1")
+        self.assertEqual("flavor_1", vnfd["vdus"][0]["flavor_id"])
+
+    @mock.patch.object(adaptor, 'get_flavor_hash')
+    def test_record_reused_flavor(self, mock_get_flavor_hash):
+        mock_get_flavor_hash.return_value = "hash_1"
+        NfInstModel.objects.create(nfinstid='1111', nf_name='vnf_1', status='INSTANTIATED', create_time=now_time())
+        FlavourInstModel.objects.create(flavourid="1", vimid="vim_1", tenant="tenant_1", resouceid="flavor_1",
+                                        instid="1111", is_predefined=1, spechash="hash_1")
+        vnfd = json.loads(json.dumps(inst_res_data))
+        vnfd["vdus"][0]["properties"]["location_info"] = {"vimid": "vim_1", "tenant": "admin"}
+        self.assertEqual(set(["flavor_1"]), update_reused_flavors(vnfd, lambda vim_id, tenant: "tenant_1", "2222"))
+        self.assertEqual(1, FlavourInstModel.objects.filter(instid="2222", resouceid="flavor_1",
+                                                            is_predefined=1).count())
+        # the termination of the creator sees the reference recorded with the choice
+        term_vnf = TermVnf({}, nf_inst_id='1111', job_id='')
+        term_vnf.query_inst_resource()
+        self.assertFalse(term_vnf.release_flavor(term_vnf.inst_resource['flavor'][0]))
+        # and a flavor released by its last user is no longer reused
+        self.assertTrue(TermVnf({}, nf_inst_id='2222', job_id='').release_flavor(
+            {"vim_id": "vim_1", "tenant_id": "tenant_1", "res_id": "flavor_1"}))
+        vnfd = json.loads(json.dumps(inst_res_data))
+        vnfd["vdus"][0]["properties"]["location_info"] = {"vimid": "vim_1", "tenant": "admin"}
+        self.assertEqual(set(), update_reused_flavors(vnfd, lambda vim_id, tenant: "tenant_1", "3333"))
+        self.assertNotIn("flavor_id", vnfd["vdus"][0])
+
+    def test_plan_instantiation_without_vim(self):
+        vnfd = json.loads(json.dumps(inst_res_data))
+        del vnfd["vls"][0]["properties"]["location_info"]
+        response = self.client.post("/openoapi/vnflcm/v1/instantiation_plan", data=json.dumps({"vnfdModel": vnfd}),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_500_INTERNAL_SERVER_ERROR, response.status_code)
+        self.assertEqual("additionalParams.vimId is not set.", response.data["error"])
@@ -12,9 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from django.test import TestCase, Client
+import json
+
+import mock
+
 from rest_framework import status
 
-from lcm.pub.database.models import NfInstModel, StorageInstModel
+from lcm.nf.vnfs.vnf_query.query_vnf import QueryVnf
+from lcm.pub.database.models import NfInstModel, StorageInstModel, VmInstModel, VNFCInstModel
 
 
 class ResourceTest(TestCase):
@@ -117,6 +122,27 @@ class ResourceTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.test_data_single_vnf, response.data)
 
+    def test_get_vnf_with_vnfcs(self):
+        NfInstModel(nfinstid='1', nf_name='VNF1').save()
+        for i in range(1, 4):
+            StorageInstModel(storageid='s0%s' % i, vimid='vim01', resouceid='volume0%s' % i, insttype=0,
+                             instid='1', ownerid='vm0%s' % min(i, 2)).save()
+        VmInstModel(vmid='vm03', vimid='vim01', resouceid='server03', insttype=0, instid='1', volume_array="[]").save()
+        # the storages are linked by their owner, whatever the saved volumeArray text holds
+        VmInstModel(vmid='vm01', vimid='vim01', resouceid='server01', insttype=0, instid='1',
+                    volume_array="[{u'volumeId': u'volume01'}, {u'volumeId': u'volu").save()
+        VmInstModel(vmid='vm02', vimid='vim01', resouceid='server02', insttype=0, instid='1',
+                    volume_array="[{u'volumeId': u'volume02'}, {u'volumeId': u'volume03'}]").save()
+        VNFCInstModel(vnfcinstanceid='vnfc01', vduid='server01', instid='1', vmid='vm01').save()
+        VNFCInstModel(vnfcinstanceid='vnfc02', vduid='server02', instid='1', vmid='vm02').save()
+        VNFCInstModel(vnfcinstanceid='vnfc03', vduid='server03', instid='1', vmid='vm03').save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances/1", format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        vnfcs = response.data["instantiatedVnfInfo"]["vnfcResourceInfo"]
+        self.assertEqual(['s01'], vnfcs[0]["storageResourceIds"])
+        self.assertEqual(['s02', 's03'], sorted(vnfcs[1]["storageResourceIds"]))
+        self.assertEqual([], vnfcs[2]["storageResourceIds"])
+
     def test_get_vnfs(self):
         for i in range(1, 3):
             NfInstModel(nfinstid='%s' % i, nf_name='VNF%s' % i).save()
@@ -125,3 +151,61 @@ class ResourceTest(TestCase):
         response = self.client.get("/openoapi/vnflcm/v1/vnf_instances", format='json')
         self.failUnlessEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(self.test_data_multi_vnf, response.data)
+
+    def test_get_vnfs_query_count_is_constant(self):
+        for i in range(1, 6):
+            NfInstModel(nfinstid='%s' % i, nf_name='VNF%s' % i).save()
+            StorageInstModel(storageid='s0%s' % i, vimid='vim0%s' % i, resouceid='resource0%s' % i,
+                             insttype=1, instid='%s' % i).save()
+            VmInstModel(vmid='vm0%s' % i, vimid='vim0%s' % i, resouceid='resource0%s' % i, insttype=1,
+                        instid='%s' % i).save()
+        with self.assertNumQueries(5):
+            resp_data = QueryVnf({}).query_multi_vnf()
+        self.assertEqual(5, len(resp_data))
+        self.assertEqual('vm05', resp_data[4]["instantiatedVnfInfo"]["vimInfo"][0]["vmid"])
+
+    def test_get_vnfs_by_page(self):
+        for i in range(1, 4):
+            NfInstModel(nfinstid='%s' % i, nf_name='VNF%s' % i).save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?limit=2")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['1', '2'], [vnf["vnfInstanceId"] for vnf in response.data])
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?limit=2&cursor=%s" % response["X-Next-Cursor"])
+        self.assertEqual(['3'], [vnf["vnfInstanceId"] for vnf in response.data])
+        self.assertFalse(response.has_header("X-Next-Cursor"))
+
+    def test_get_vnfs_with_invalid_limit(self):
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?limit=0")
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_get_vnfs_by_filter_and_exclude_fields(self):
+        NfInstModel(nfinstid='1', nf_name='VNF1', status='INSTANTIATED').save()
+        NfInstModel(nfinstid='2', nf_name='VNF2', status='NOT_INSTANTIATED').save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?status=INSTANTIATED&excludeFields=vimInfo")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['1'], [vnf["vnfInstanceId"] for vnf in response.data])
+        self.assertNotIn("vimInfo", response.data[0]["instantiatedVnfInfo"])
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?status=TERMINATED")
+        self.assertEqual([], response.data)
+
+    def test_get_vnfs_in_stream(self):
+        for i in range(1, 3):
+            NfInstModel(nfinstid='%s' % i, nf_name='VNF%s' % i).save()
+            StorageInstModel(storageid='s0%s' % i, vimid='vim0%s' % i, resouceid='resource0%s' % i,
+                             insttype=1, instid='%s' % i).save()
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?stream=true")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.test_data_multi_vnf, json.loads(''.join(response.streaming_content)))
+
+    @mock.patch.object(QueryVnf, 'fill_resp_datas')
+    def test_get_vnfs_in_stream_failed(self, mock_fill_resp_datas):
+        def fill_resp_datas(vnfs, exclude_fields=()):
+            yield {"vnfInstanceId": "1"}
+            raise Exception("db error")
+        NfInstModel(nfinstid='1', nf_name='VNF1').save()
+        mock_fill_resp_datas.side_effect = fill_resp_datas
+        response = self.client.get("/openoapi/vnflcm/v1/vnf_instances?stream=true")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{"vnfInstanceId": "1"}, {"error": "Failed to get Vnfs"}],
+                         json.loads(''.join(response.streaming_content)))
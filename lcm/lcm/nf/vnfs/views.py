@@ -16,6 +16,7 @@ import logging
 import os
 import traceback
 
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -24,18 +25,42 @@ from lcm.nf.vnfs.vnf_cancel.delete_vnf_identifier import DeleteVnf
 from lcm.nf.vnfs.vnf_cancel.term_vnf import TermVnf
 from lcm.nf.vnfs.vnf_create.create_vnf_identifier import CreateVnf
 from lcm.nf.vnfs.vnf_create.inst_vnf import InstVnf
-from lcm.nf.vnfs.vnf_query.query_vnf import QueryVnf
-from lcm.pub.exceptions import NFLCMException
+from lcm.nf.vnfs.vnf_create.plan_vnf import PlanVnf
+from lcm.nf.vnfs.vnf_query.query_vnf import QueryVnf, EXCLUDABLE_FIELDS
+from lcm.pub.config.config import LCM_OP_RETRY_AFTER
+from lcm.pub.exceptions import NFLCMException, NFLCMQueueFullException
 from lcm.pub.utils.jobutil import JobUtil
+from lcm.pub.utils.oputil import op_journal, OP_PRIORITY
 
 logger = logging.getLogger(__name__)
 
+VNF_FILTERS = [("status", "status"), ("vnfdId", "vnfdid"), ("vendor", "vendor"), ("packageId", "package_id")]
+MAX_PAGE_LIMIT = 1000
+
 
 class CreateVnfAndQueryVnfs(APIView):
     def get(self, request):
-        logger.debug("QuerySingleVnf--get::> %s" % request.data)
+        logger.debug("QuerySingleVnf--get::> %s, %s" % (request.data, request.query_params))
+        params = request.query_params
+        filters = dict([(field, params[key]) for key, field in VNF_FILTERS if params.get(key)])
+        exclude_fields = [f for f in params.get("excludeFields", "").split(",") if f in EXCLUDABLE_FIELDS]
+        limit = params.get("limit", "")
+        if limit and (not limit.isdigit() or not 0 < int(limit) <= MAX_PAGE_LIMIT):
+            return Response(data={'error': 'limit must be an integer in [1, %d]' % MAX_PAGE_LIMIT},
+                            status=status.HTTP_400_BAD_REQUEST)
+        headers = {}
         try:
-            resp_data = QueryVnf(request.data).query_multi_vnf()
+            query = QueryVnf(request.data)
+            if params.get("stream", "").lower() == "true":
+                return StreamingHttpResponse(stream_json_list(query.iter_vnfs(filters, exclude_fields)),
+                                             content_type='application/json', status=status.HTTP_200_OK)
+            if limit or params.get("cursor"):
+                resp_data, next_cursor = query.query_vnf_page(filters, int(limit or MAX_PAGE_LIMIT),
+                                                              params.get("cursor", ""), exclude_fields)
+                if next_cursor:
+                    headers["X-Next-Cursor"] = next_cursor
+            else:
+                resp_data = query.query_multi_vnf(filters, exclude_fields)
         except NFLCMException as e:
             logger.error(e.message)
             return Response(data={'error': '%s' % e.message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -43,7 +68,7 @@ class CreateVnfAndQueryVnfs(APIView):
             logger.error(traceback.format_exc())
             return Response(data={'error': 'Failed to get Vnfs'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return Response(data=resp_data, status=status.HTTP_200_OK)
+        return Response(data=resp_data, status=status.HTTP_200_OK, headers=headers)
 
     def post(self, request):
         logger.debug("CreateVnfIdentifier--post::> %s" % request.data)
@@ -65,7 +90,13 @@ class InstantiateVnf(APIView):
         try:
             job_id = JobUtil.create_job('NF', 'INSTANTIATE', instanceid)
             JobUtil.add_job_status(job_id, 0, "INST_VNF_READY")
-            InstVnf(request.data, instanceid, job_id).start()
+            op_journal.enqueue(OP_PRIORITY.INSTANTIATE, InstVnf, request.data, instanceid, job_id)
+        except NFLCMQueueFullException as e:
+            logger.warn(e.message)
+            JobUtil.clear_job_status(job_id)
+            JobUtil.clear_job(job_id)
+            return Response(data={'error': '%s' % e.message}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(LCM_OP_RETRY_AFTER)})
         except NFLCMException as e:
             logger.error(e.message)
             return Response(data={'error': '%s' % e.message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -76,6 +107,20 @@ class InstantiateVnf(APIView):
         return Response(data=rsp, status=status.HTTP_202_ACCEPTED)
 
 
+class PlanInstantiation(APIView):
+    def post(self, request):
+        logger.debug("PlanInstantiation--post::> %s" % request.data)
+        try:
+            resp_data = PlanVnf(request.data).do_biz()
+        except NFLCMException as e:
+            logger.error(e.message)
+            return Response(data={'error': '%s' % e.message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception:
+            logger.error(traceback.format_exc())
+            return Response(data={'error': 'unexpected exception'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(data=resp_data, status=status.HTTP_200_OK)
+
+
 class DeleteVnfAndQueryVnf(APIView):
     def get(self, request, instanceid):
         logger.debug("QuerySingleVnf--get::> %s" % request.data)
@@ -109,7 +154,13 @@ class TerminateVnf(APIView):
         try:
             job_id = JobUtil.create_job('NF', 'TERMINATE', instanceid)
             JobUtil.add_job_status(job_id, 0, "TERM_VNF_READY")
-            TermVnf(request.data, instanceid, job_id).start()
+            op_journal.enqueue(OP_PRIORITY.TERMINATE, TermVnf, request.data, instanceid, job_id)
+        except NFLCMQueueFullException as e:
+            logger.warn(e.message)
+            JobUtil.clear_job_status(job_id)
+            JobUtil.clear_job(job_id)
+            return Response(data={'error': '%s' % e.message}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': str(LCM_OP_RETRY_AFTER)})
         except NFLCMException as e:
             logger.error(e.message)
             return Response(data={'error': '%s' % e.message}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -120,6 +171,23 @@ class TerminateVnf(APIView):
         return Response(data=rsp, status=status.HTTP_202_ACCEPTED)
 
 
+def stream_json_list(items):
+    """
+    Stream the items as a JSON list. The status is sent before they are read,
+    so a failure midway ends the list with an {"error": ...} item instead.
+    """
+    yield "["
+    sep = ""
+    try:
+        for item in items:
+            yield sep + json.dumps(item)
+            sep = ","
+    except:
+        logger.error(traceback.format_exc())
+        yield sep + json.dumps({"error": "Failed to get Vnfs"})
+    yield "]"
+
+
 class SwaggerJsonView(APIView):
     def get(self, request):
         json_file = os.path.join(os.path.dirname(__file__), 'swagger.json')
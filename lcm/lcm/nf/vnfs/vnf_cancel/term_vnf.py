@@ -14,20 +14,27 @@
 import json
 import logging
 import traceback
-from threading import Thread
+from threading import Thread, Lock
 
 from lcm.nf.vnfs.const import VNF_STATUS
 from lcm.pub.database.models import NfInstModel, VmInstModel, NetworkInstModel, StorageInstModel, \
     FlavourInstModel, PortInstModel, SubNetworkInstModel, VNFCInstModel, NfvoRegInfoModel
 from lcm.pub.exceptions import NFLCMException
 from lcm.pub.msapi.gvnfmdriver import apply_grant_to_nfvo, notify_lcm_to_nfvo
+from lcm.pub.utils.dbutil import locking_atomic
 from lcm.pub.utils.jobutil import JobUtil
+from lcm.pub.utils.oputil import save_checkpoint
 from lcm.pub.utils.timeutil import now_time
+from lcm.pub.utils.traceutil import tracer, traced
 from lcm.pub.utils.values import ignore_case_get
 from lcm.pub.vimapi import adaptor
 
 logger = logging.getLogger(__name__)
 
+# serializes the reuse and the release of the shared flavors in the process, the
+# rows locked with select_for_update serialize them across the processes
+flavor_lock = Lock()
+
 
 class TermVnf(Thread):
     def __init__(self, data, nf_inst_id, job_id):
@@ -39,7 +46,7 @@ class TermVnf(Thread):
         self.gracefulTerminationTimeout = ignore_case_get(self.data, "gracefulTerminationTimeout")
         self.apply_result = None
         self.notify_data = None
-        self.inst_resource = {'volumn': [],
+        self.inst_resource = {'volume': [],
                               'network': [],
                               'subnet': [],
                               'port': [],
@@ -48,19 +55,27 @@ class TermVnf(Thread):
                               }
 
     def run(self):
-        try:
-            if self.term_pre():
-                self.grant_resource()
-                self.query_inst_resource()
-                self.query_notify_data()
-                self.delete_resource()
-                self.lcm_notify()
-            JobUtil.add_job_status(self.job_id, 100, "Terminate Vnf success.")
-        except NFLCMException as e:
-            self.vnf_term_failed_handle(e.message)
-        except:
-            self.vnf_term_failed_handle(traceback.format_exc())
+        with tracer.span("terminate", trace_id=self.job_id, vnfInstanceId=self.nf_inst_id):
+            try:
+                if self.term_pre():
+                    self.grant_resource()
+                    save_checkpoint(self.job_id, 'grant_resource')
+                    self.query_inst_resource()
+                    self.query_notify_data()
+                    self.delete_resource()
+                    save_checkpoint(self.job_id, 'delete_resource')
+                    self.lcm_notify()
+                JobUtil.add_job_status(self.job_id, 100, "Terminate Vnf success.")
+            except NFLCMException as e:
+                self.vnf_term_failed_handle(e.message)
+            except:
+                self.vnf_term_failed_handle(traceback.format_exc())
+
+    def recover(self, checkpoint):
+        # each step of the termination can be run again
+        self.run()
 
+    @traced
     def term_pre(self):
         vnf_insts = NfInstModel.objects.filter(nfinstid=self.nf_inst_id)
         if not vnf_insts.exists():
@@ -80,6 +95,7 @@ class TermVnf(Thread):
         logger.info("Nf terminating pre-check finish")
         return True
 
+    @traced
     def grant_resource(self):
         logger.info("nf_cancel_task grant_resource begin")
         content_args = {'vnfInstanceId': self.nf_inst_id, 'vnfDescriptorId': '',
@@ -106,6 +122,7 @@ class TermVnf(Thread):
         logger.info("nf_cancel_task grant_resource end")
         JobUtil.add_job_status(self.job_id, 20, 'Nf terminating grant_resource finish')
 
+    @traced
     def query_inst_resource(self):
         logger.info('[query_resource begin]:inst_id=%s' % self.nf_inst_id)
         vol_list = StorageInstModel.objects.filter(instid=self.nf_inst_id)
@@ -117,8 +134,8 @@ class TermVnf(Thread):
             vol_info["tenant_id"] = vol.tenant
             vol_info["res_id"] = vol.resouceid
             vol_info["is_predefined"] = vol.is_predefined
-            self.inst_resource['volumn'].append(vol_info)
-        logger.info('[query_volumn_resource]:ret_volumns=%s' % self.inst_resource['volumn'])
+            self.inst_resource['volume'].append(vol_info)
+        logger.info('[query_volume_resource]:ret_volumes=%s' % self.inst_resource['volume'])
 
         network_list = NetworkInstModel.objects.filter(instid=self.nf_inst_id)
         for network in network_list:
@@ -157,6 +174,7 @@ class TermVnf(Thread):
         logger.info('[query_port_resource]:ret_networks=%s' % self.inst_resource['port'])
 
         flavor_list = FlavourInstModel.objects.filter(instid=self.nf_inst_id)
+        flavor_ids = set()
         for flavor in flavor_list:
             flavor_info = {}
             if not flavor.resouceid:
@@ -165,6 +183,9 @@ class TermVnf(Thread):
             flavor_info["tenant_id"] = flavor.tenant
             flavor_info["res_id"] = flavor.resouceid
             flavor_info["is_predefined"] = flavor.is_predefined
+            if flavor.resouceid in flavor_ids:
+                continue
+            flavor_ids.add(flavor.resouceid)
             self.inst_resource['flavor'].append(flavor_info)
         logger.info('[query_flavor_resource]:ret_networks=%s' % self.inst_resource['flavor'])
 
@@ -180,6 +201,7 @@ class TermVnf(Thread):
             self.inst_resource['vm'].append(vm_info)
         logger.info('[query_vm_resource]:ret_vms=%s' % self.inst_resource['vm'])
 
+    @traced
     def query_notify_data(self):
         logger.info('[NF terminate] send notify request to nfvo start')
         affected_vnfc = []
@@ -240,8 +262,31 @@ class TermVnf(Thread):
         self.notify_data['VNFMID'] = vnfmInfo[0].vnfminstid
         logger.info('content_args=%s' % self.notify_data)
 
+    def release_flavor(self, res):
+        """
+        A flavor is only deleted with its last user. Under the lock taken to
+        reuse flavors too, the references of this VNF are dropped at once if
+        another VNF still references the flavor. Otherwise they are kept until
+        the flavor is deleted, but no longer offered for reuse.
+        """
+        with flavor_lock, locking_atomic():
+            flavors = FlavourInstModel.objects.select_for_update().\
+                filter(vimid=res["vim_id"], tenant=res["tenant_id"], resouceid=res["res_id"])
+            shared = any(flavor.instid != self.nf_inst_id for flavor in flavors)
+            if shared:
+                flavors.filter(instid=self.nf_inst_id).delete()
+            else:
+                flavors.filter(instid=self.nf_inst_id).update(spechash=None)
+        if shared:
+            logger.info("Keep flavor(%s) used by other VNFs", res["res_id"])
+        return not shared
+
+    @traced
     def delete_resource(self):
         logger.info('rollback resource begin')
+        for flavor_info in self.inst_resource['flavor']:
+            if 1 == flavor_info["is_predefined"] and not self.release_flavor(flavor_info):
+                flavor_info["is_predefined"] = 0
         adaptor.delete_vim_res(self.inst_resource, self.do_notify_delete)
         logger.info('rollback resource complete')
 
@@ -250,7 +295,9 @@ class TermVnf(Thread):
         if res_type == adaptor.RES_VM:
             VmInstModel.objects.filter(instid=self.nf_inst_id, resouceid=res_id).delete()
         elif res_type == adaptor.RES_FLAVOR:
-            FlavourInstModel.objects.filter(instid=self.nf_inst_id, resouceid=res_id).delete()
+            # a flavor which failed to be deleted stays recorded, to be deleted again
+            if not self.is_delete_failed(res_type, res_id):
+                FlavourInstModel.objects.filter(instid=self.nf_inst_id, resouceid=res_id).delete()
         elif res_type == adaptor.RES_PORT:
             PortInstModel.objects.filter(instid=self.nf_inst_id, resouceid=res_id).delete()
         elif res_type == adaptor.RES_SUBNET:
@@ -260,6 +307,10 @@ class TermVnf(Thread):
         elif res_type == adaptor.RES_VOLUME:
             StorageInstModel.objects.filter(instid=self.nf_inst_id, resouceid=res_id).delete()
 
+    def is_delete_failed(self, res_type, res_id):
+        return any(res.get("delete_failed") for res in self.inst_resource[res_type] if res["res_id"] == res_id)
+
+    @traced
     def lcm_notify(self):
         NfInstModel.objects.filter(nfinstid=self.nf_inst_id).update(status='NOT_INSTANTIATED', lastuptime=now_time())
         logger.info('[NF termination] send notify request to nfvo end')
@@ -11,15 +11,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import json
 import logging
 import uuid
 
 from lcm.pub.database.models import NfInstModel
 from lcm.pub.exceptions import NFLCMException
-from lcm.pub.msapi.catalog import query_rawdata_from_catalog
+from lcm.pub.msapi.catalog import query_vnfd_model_from_catalog
 from lcm.pub.msapi.gvnfmdriver import get_packageinfo_by_vnfdid
-from lcm.pub.utils import toscautil
 from lcm.pub.utils.timeutil import now_time
 from lcm.pub.utils.values import ignore_case_get
 
@@ -52,9 +50,7 @@ class CreateVnf:
                     self.package_id = ignore_case_get(val, "csarId")
                     break
 
-            raw_data = query_rawdata_from_catalog(self.package_id)
-            self.vnfd = toscautil.convert_vnfd_model(raw_data["rawData"])  # convert to inner json
-            self.vnfd = json.JSONDecoder().decode(self.vnfd)
+            self.vnfd = query_vnfd_model_from_catalog(self.package_id)
 
             metadata = ignore_case_get(self.vnfd, "metadata")
             version = ignore_case_get(metadata, "vnfd_version")
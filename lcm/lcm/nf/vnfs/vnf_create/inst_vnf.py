@@ -17,17 +17,21 @@ import traceback
 import uuid
 from threading import Thread
 
-from lcm.nf.vnfs.const import vnfd_model_dict
+from lcm.nf.vnfs.const import vnfd_model_dict, VNF_STATUS
+from lcm.nf.vnfs.vnf_cancel.term_vnf import TermVnf, flavor_lock
 from lcm.pub.database.models import NfInstModel, VmInstModel, NetworkInstModel, \
     SubNetworkInstModel, PortInstModel, StorageInstModel, FlavourInstModel, VNFCInstModel, NfvoRegInfoModel
 from lcm.pub.exceptions import NFLCMException
-from lcm.pub.msapi.catalog import query_rawdata_from_catalog
+from lcm.pub.msapi.catalog import query_vnfd_model_from_catalog
 from lcm.pub.msapi.gvnfmdriver import apply_grant_to_nfvo, notify_lcm_to_nfvo, get_packageinfo_by_vnfdid
-from lcm.pub.utils import toscautil
+from lcm.pub.utils.dbutil import BulkWriter, locking_atomic
 from lcm.pub.utils.jobutil import JobUtil
+from lcm.pub.utils.oputil import save_checkpoint
 from lcm.pub.utils.timeutil import now_time
+from lcm.pub.utils.traceutil import tracer, traced
 from lcm.pub.utils.values import ignore_case_get, get_none, get_boolean, get_integer
 from lcm.pub.vimapi import adaptor
+from lcm.pub.vimapi.latency import op_latencies
 
 logger = logging.getLogger(__name__)
 
@@ -45,20 +49,84 @@ class InstVnf(Thread):
         self.package_id = ''
         # self.csar_id = ''
         self.vnfd_info = []
+        self.res_writer = BulkWriter()
+        self.vm_volumes = []
+        self.reused_flavors = set()
+        self.res_job_status = None
+        self.res_progress = 0
 
     def run(self):
+        with tracer.span("instantiate", trace_id=self.job_id, vnfInstanceId=self.nf_inst_id):
+            try:
+                self.inst_pre()
+                save_checkpoint(self.job_id, 'inst_pre')
+                self.apply_grant()
+                save_checkpoint(self.job_id, 'apply_grant')
+                self.create_res()
+                save_checkpoint(self.job_id, 'create_res')
+                self.lcm_notify()
+                save_checkpoint(self.job_id, 'lcm_notify')
+                JobUtil.add_job_status(self.job_id, 100, "Instantiate Vnf success.")
+            except NFLCMException as e:
+                self.vnf_inst_failed_handle(e.message)
+            except:
+                logger.error(traceback.format_exc())
+                self.vnf_inst_failed_handle('unexpected exception')
+
+    def recover(self, checkpoint):
+        """
+        Finish an instantiation interrupted once all its resources were
+        created, roll back the other ones.
+        """
+        with tracer.span("recover_instantiate", trace_id=self.job_id, checkpoint=checkpoint):
+            try:
+                if checkpoint in ('create_res', 'lcm_notify'):
+                    if checkpoint == 'create_res':
+                        self.lcm_notify()
+                    JobUtil.add_job_status(self.job_id, 100, "Instantiate Vnf success.")
+                else:
+                    self.rollback()
+                    JobUtil.add_job_status(self.job_id, 255, "Instantiate Vnf interrupted, rolled back.")
+            except NFLCMException as e:
+                self.vnf_inst_failed_handle(e.message)
+            except:
+                logger.error(traceback.format_exc())
+                self.vnf_inst_failed_handle('unexpected exception')
+
+    @traced
+    def rollback(self):
+        logger.info('[NF instantiation] rollback start')
+        term_vnf = TermVnf({}, self.nf_inst_id, self.job_id)
+        term_vnf.query_inst_resource()
+        self.add_unrecorded_res(term_vnf.inst_resource)
+        term_vnf.delete_resource()
+        VNFCInstModel.objects.filter(instid=self.nf_inst_id).delete()
+        NfvoRegInfoModel.objects.filter(nfvoid=self.nf_inst_id).delete()
+        NfInstModel.objects.filter(nfinstid=self.nf_inst_id).update(status='NOT_INSTANTIATED', lastuptime=now_time())
+        logger.info('[NF instantiation] rollback end')
+
+    def add_unrecorded_res(self, inst_resource):
+        """
+        Add to the resources to delete the ones created on the vims but not
+        recorded before the interruption, found by their names with the VNFD
+        model saved by apply_grant.
+        """
+        vnf_insts = NfInstModel.objects.filter(nfinstid=self.nf_inst_id)
         try:
-            self.inst_pre()
-            self.apply_grant()
-            self.create_res()
-            self.lcm_notify()
-            JobUtil.add_job_status(self.job_id, 100, "Instantiate Vnf success.")
-        except NFLCMException as e:
-            self.vnf_inst_failed_handle(e.message)
-        except:
-            logger.error(traceback.format_exc())
-            self.vnf_inst_failed_handle('unexpected exception')
+            vnfd_info = json.loads(vnf_insts[0].vnfd_model) if vnf_insts and vnf_insts[0].vnfd_model else None
+        except ValueError:
+            vnfd_info = None
+        if not vnfd_info:
+            logger.warn("No vnfd model of VNF(%s) to find its unrecorded resources", self.nf_inst_id)
+            return
+        for res_type, res_list in adaptor.find_tagged_res(vnfd_info, self.nf_inst_id).items():
+            recorded_ids = [res["res_id"] for res in inst_resource.get(res_type, [])]
+            for res in res_list:
+                if res["res_id"] not in recorded_ids:
+                    logger.info("Delete unrecorded %s(%s)", res_type, res["res_id"])
+                    inst_resource.setdefault(res_type, []).append(res)
 
+    @traced
     def inst_pre(self):
         vnf_insts = NfInstModel.objects.filter(nfinstid=self.nf_inst_id)
         if not vnf_insts.exists():
@@ -83,9 +151,7 @@ class InstVnf(Thread):
                 inputs = json.loads(inputs)
             for key, val in inputs.items():
                 input_parameters.append({"key": key, "value": val})
-        raw_data = query_rawdata_from_catalog(self.package_id, input_parameters)
-        self.vnfd_info = toscautil.convert_vnfd_model(raw_data["rawData"])  # convert to inner json
-        self.vnfd_info = json.JSONDecoder().decode(self.vnfd_info)
+        self.vnfd_info = query_vnfd_model_from_catalog(self.package_id, input_parameters)
 
         #self.vnfd_info = vnfd_model_dict  # just for test
         self.update_cps()
@@ -96,7 +162,7 @@ class InstVnf(Thread):
         vendor = ignore_case_get(metadata, "vendor")
         netype = ignore_case_get(metadata, "vnf_type")
         vnfsoftwareversion = ignore_case_get(metadata, "version")
-        vnfd_model = self.vnfd_info
+        vnfd_model = json.dumps(self.vnfd_info)
         NfInstModel.objects.filter(nfinstid=self.nf_inst_id).\
             update(package_id=self.package_id, flavour_id=ignore_case_get(self.data, "flavourId"), version=version,
                    vendor=vendor, netype=netype, vnfd_model=vnfd_model, status='NOT_INSTANTIATED', vnfdid=self.vnfd_id,
@@ -109,6 +175,7 @@ class InstVnf(Thread):
         JobUtil.add_job_status(self.job_id, 15, 'Nf instancing pre-check finish')
         logger.info("Nf instancing pre-check finish")
 
+    @traced
     def apply_grant(self):
         logger.info('[NF instantiation] send resource grand request to nfvo start')
         content_args = {'vnfInstanceId': self.nf_inst_id, 'vnfDescriptorId': '',
@@ -157,17 +224,27 @@ class InstVnf(Thread):
                 logger.info('vl["properties"]["location_info"]=%s' % vl["properties"]["location_info"])
 
         logger.info('self.vnfd_info=%s' % self.vnfd_info)
-        NfInstModel.objects.filter(nfinstid=self.nf_inst_id).update(status='INSTANTIATED', lastuptime=now_time())
+        # saved with the locations of the resources, to find them if the creates are interrupted
+        NfInstModel.objects.filter(nfinstid=self.nf_inst_id).update(status='INSTANTIATED', lastuptime=now_time(),
+                                                                    vnfd_model=json.dumps(self.vnfd_info))
         JobUtil.add_job_status(self.job_id, 20, 'Nf instancing apply grant finish')
         logger.info("Nf instancing apply grant finish")
 
+    @traced
     def create_res(self):
         logger.info("[NF instantiation] create resource start")
-        adaptor.create_vim_res(self.vnfd_info, self.do_notify)
+        self.update_flavors()
+        try:
+            adaptor.create_vim_res(self.vnfd_info, self.do_notify, do_flush=self.flush_res,
+                                   inst_id=self.nf_inst_id)
+        finally:
+            self.flush_res()
+            op_latencies.save()
 
         JobUtil.add_job_status(self.job_id, 70, '[NF instantiation] create resource finish')
         logger.info("[NF instantiation] create resource finish")
 
+    @traced
     def lcm_notify(self):
         logger.info('[NF instantiation] send notify request to nfvo start')
         affected_vnfc = []
@@ -240,8 +317,8 @@ class InstVnf(Thread):
         logger.info('creating [%s] resource' % res_type)
         if res_type == adaptor.RES_VOLUME:
             logger.info('Create vloumns!')
-            JobUtil.add_job_status(self.job_id, 25, 'Create vloumns!')
-            StorageInstModel.objects.create(
+            self.set_res_job_status(25, 'Create vloumns!')
+            self.res_writer.add(StorageInstModel(
                 storageid=str(uuid.uuid4()),
                 vimid=ignore_case_get(ret, "vimId"),
                 resouceid=ignore_case_get(ret, "id"),
@@ -253,11 +330,11 @@ class InstVnf(Thread):
                 insttype=0,
                 is_predefined=ignore_case_get(ret, "returnCode"),
                 nodeId=ignore_case_get(ret, "nodeId"),
-                instid=self.nf_inst_id)
+                instid=self.nf_inst_id))
         elif res_type == adaptor.RES_NETWORK:
             logger.info('Create networks!')
-            JobUtil.add_job_status(self.job_id, 35, 'Create networks!')
-            NetworkInstModel.objects.create(
+            self.set_res_job_status(35, 'Create networks!')
+            self.res_writer.add(NetworkInstModel(
                 networkid=str(uuid.uuid4()),
                 name=ignore_case_get(ret, "name"),
                 vimid=ignore_case_get(ret, "vimId"),
@@ -272,11 +349,11 @@ class InstVnf(Thread):
                 insttype=0,
                 is_predefined=ignore_case_get(ret, "returnCode"),
                 nodeId=ignore_case_get(ret, "nodeId"),
-                instid=self.nf_inst_id)
+                instid=self.nf_inst_id))
         elif res_type == adaptor.RES_SUBNET:
             logger.info('Create subnets!')
-            JobUtil.add_job_status(self.job_id, 40, 'Create subnets!')
-            SubNetworkInstModel.objects.create(
+            self.set_res_job_status(40, 'Create subnets!')
+            self.res_writer.add(SubNetworkInstModel(
                 subnetworkid=str(uuid.uuid4()),
                 name=ignore_case_get(ret, "name"),
                 vimid=ignore_case_get(ret, "vimId"),
@@ -292,11 +369,11 @@ class InstVnf(Thread):
                 allocationPools=ignore_case_get(ret, "allocationPools"),
                 insttype=0,
                 is_predefined=ignore_case_get(ret, "returnCode"),
-                instid=self.nf_inst_id)
+                instid=self.nf_inst_id))
         elif res_type == adaptor.RES_PORT:
             logger.info('Create ports!')
-            JobUtil.add_job_status(self.job_id, 50, 'Create ports!')
-            PortInstModel.objects.create(
+            self.set_res_job_status(50, 'Create ports!')
+            self.res_writer.add(PortInstModel(
                 portid=str(uuid.uuid4()),
                 networkid=ignore_case_get(ret, "networkId"),
                 subnetworkid=ignore_case_get(ret, "subnetId"),
@@ -311,11 +388,13 @@ class InstVnf(Thread):
                 insttype=0,
                 is_predefined=ignore_case_get(ret, "returnCode"),
                 nodeId=ignore_case_get(ret, "nodeId"),
-                instid=self.nf_inst_id)
+                instid=self.nf_inst_id))
         elif res_type == adaptor.RES_FLAVOR:
             logger.info('Create flavors!')
-            JobUtil.add_job_status(self.job_id, 60, 'Create flavors!')
-            FlavourInstModel.objects.create(
+            self.set_res_job_status(60, 'Create flavors!')
+            if ignore_case_get(ret, "id") in self.reused_flavors:
+                return
+            self.res_writer.add(FlavourInstModel(
                 flavourid=str(uuid.uuid4()),
                 name=ignore_case_get(ret, "name"),
                 vimid=ignore_case_get(ret, "vimId"),
@@ -329,12 +408,13 @@ class InstVnf(Thread):
                 isPublic=get_boolean(ignore_case_get(ret, "isPublic")),
                 extraspecs=ignore_case_get(ret, "extraSpecs"),
                 is_predefined=ignore_case_get(ret, "returnCode"),
-                instid=self.nf_inst_id)
+                spechash=ignore_case_get(ret, "specHash"),
+                instid=self.nf_inst_id))
         elif res_type == adaptor.RES_VM:
             logger.info('Create vms!')
-            JobUtil.add_job_status(self.job_id, 70, 'Create vms!')
+            self.set_res_job_status(70, 'Create vms!')
             vm_id = str(uuid.uuid4())
-            VmInstModel.objects.create(
+            self.res_writer.add(VmInstModel(
                 vmid=vm_id,
                 vmname=ignore_case_get(ret, "name"),
                 vimid=ignore_case_get(ret, "vimId"),
@@ -350,22 +430,113 @@ class InstVnf(Thread):
                 operationalstate=ignore_case_get(ret, "status"),
                 insttype=0,
                 is_predefined=ignore_case_get(ret, "returnCode"),
-                instid=self.nf_inst_id)
-            VNFCInstModel.objects.create(
+                instid=self.nf_inst_id))
+            self.res_writer.add(VNFCInstModel(
                 vnfcinstanceid=str(uuid.uuid4()),
                 vduid=ignore_case_get(ret, "id"),
                 is_predefined=ignore_case_get(ret, "returnCode"),
                 instid=self.nf_inst_id,
-                vmid=vm_id)
+                vmid=vm_id))
+            self.vm_volumes.append((vm_id, ignore_case_get(ret, "volumeIds")))
+
+    def set_res_job_status(self, progress, status_desc):
+        if progress > self.res_progress:
+            self.res_progress = progress
+            self.res_job_status = (progress, status_desc)
+
+    def flush_res(self):
+        self.res_writer.flush()
+        self.set_storage_owners()
+        if self.res_job_status:
+            JobUtil.add_job_status(self.job_id, *self.res_job_status)
+            self.res_job_status = None
+
+    def set_storage_owners(self):
+        """
+        Record the vm each flushed volume is attached to, as the owner of
+        its storage.
+        """
+        while self.vm_volumes:
+            vm_id, volume_ids = self.vm_volumes[0]
+            if volume_ids:
+                StorageInstModel.objects.filter(instid=self.nf_inst_id, resouceid__in=volume_ids).\
+                    update(ownerid=vm_id)
+            self.vm_volumes.pop(0)
 
     def update_cps(self):
-        for extlink in ignore_case_get(self.data, "extVirtualLinks"):
-            for cp in ignore_case_get(self.vnfd_info, "cps"):
-                cpdid = ignore_case_get(extlink, "cpdId")
-                if cpdid == ignore_case_get(cp, "cp_id"):
-                    cp["networkId"] = ignore_case_get(extlink, "resourceId")
-                    cp["subnetId"] = ignore_case_get(extlink, "resourceSubnetId")
-                    break
+        update_ext_cps(self.data, self.vnfd_info)
+
+    def update_flavors(self):
+        self.reused_flavors = update_reused_flavors(self.vnfd_info, adaptor.get_tenant_id, self.nf_inst_id)
 
     def check_parameter_exist(self):
         pass
+
+
+def update_ext_cps(data, vnfd_info):
+    for extlink in ignore_case_get(data, "extVirtualLinks"):
+        for cp in ignore_case_get(vnfd_info, "cps"):
+            cpdid = ignore_case_get(extlink, "cpdId")
+            if cpdid == ignore_case_get(cp, "cp_id"):
+                cp["networkId"] = ignore_case_get(extlink, "resourceId")
+                cp["subnetId"] = ignore_case_get(extlink, "resourceSubnetId")
+                break
+
+
+def update_reused_flavors(vnfd_info, get_tenant_id, inst_id=None):
+    """
+    Set in the VDUs the flavor of the same spec another VNF created in their
+    vim tenant, but not of a VNF being terminated, which may be deleting it.
+    get_tenant_id returns None for a tenant to skip. With inst_id, the VNF is
+    recorded as a user of each flavor it reuses under the lock taken by the
+    release of the flavors, so that it can't be deleted in between. Return
+    the ids of the flavors recorded.
+    """
+    reused = set()
+    for vdu in ignore_case_get(vnfd_info, "vdus"):
+        location_info = ignore_case_get(vdu["properties"], "location_info")
+        if not location_info:
+            continue
+        tenant_id = get_tenant_id(location_info["vimid"], location_info["tenant"])
+        if not tenant_id:
+            continue
+        with flavor_lock, locking_atomic():
+            flavors = FlavourInstModel.objects.filter(vimid=location_info["vimid"], tenant=tenant_id,
+                                                      spechash=adaptor.get_flavor_hash(vnfd_info, vdu))
+            flavors = flavors.exclude(resouceid='')
+            if inst_id:
+                flavors = flavors.select_for_update()
+            flavors = list(flavors)
+            terminating = list(NfInstModel.objects.filter(nfinstid__in=[flavor.instid for flavor in flavors],
+                                                          status=VNF_STATUS.TERMINATING).
+                               values_list("nfinstid", flat=True))
+            flavors = [flavor for flavor in flavors if flavor.instid not in terminating]
+            if not flavors:
+                continue
+            if inst_id and flavors[0].resouceid not in reused:
+                record_flavor_user(flavors[0], inst_id)
+                reused.add(flavors[0].resouceid)
+        logger.info("Vdu(%s) reuses flavor(%s)", vdu["vdu_id"], flavors[0].resouceid)
+        vdu["flavor_id"] = flavors[0].resouceid
+        vdu["flavor_return_code"] = flavors[0].is_predefined
+    return reused
+
+
+def record_flavor_user(flavor, inst_id):
+    FlavourInstModel.objects.create(
+        flavourid=str(uuid.uuid4()),
+        name=flavor.name,
+        vimid=flavor.vimid,
+        resouceid=flavor.resouceid,
+        tenant=flavor.tenant,
+        vcpu=flavor.vcpu,
+        memory=flavor.memory,
+        disk=flavor.disk,
+        ephemeral=flavor.ephemeral,
+        swap=flavor.swap,
+        isPublic=flavor.isPublic,
+        extraspecs=flavor.extraspecs,
+        is_predefined=flavor.is_predefined,
+        spechash=flavor.spechash,
+        create_time=now_time(),
+        instid=inst_id)
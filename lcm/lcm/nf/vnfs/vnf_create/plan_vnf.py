@@ -0,0 +1,195 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import copy
+import json
+import logging
+
+from lcm.nf.vnfs.vnf_create.inst_vnf import update_ext_cps, update_reused_flavors
+from lcm.pub.config.config import VIM_POLL_INTERVAL, VIM_POLL_MAX_INTERVAL
+from lcm.pub.exceptions import NFLCMException
+from lcm.pub.utils.cacheutil import vim_meta_cache
+from lcm.pub.utils.values import ignore_case_get
+from lcm.pub.vimapi import adaptor
+from lcm.pub.vimapi.exceptions import VimException
+from lcm.pub.vimapi.latency import op_latencies, OP_CREATE, OP_WAIT
+
+logger = logging.getLogger(__name__)
+
+# seconds estimated for the operations not recorded yet by the adaptor
+DEFAULT_CREATE_SECONDS = 1
+DEFAULT_WAIT_SECONDS = {adaptor.RES_VOLUME: 10, adaptor.RES_VM: 30}
+POLL_LIST_KEYS = {adaptor.RES_VOLUME: "volumes", adaptor.RES_VM: "servers"}
+
+
+def get_poll_count(seconds):
+    """
+    Return the list calls a poller makes to wait seconds for a batch of
+    resources whose statuses do not change before.
+    """
+    count, elapsed, interval = 0, 0, VIM_POLL_INTERVAL
+    while elapsed < seconds:
+        count += 1
+        elapsed += interval * 0.75
+        interval = min(interval * 2, VIM_POLL_MAX_INTERVAL)
+    return count
+
+
+def get_task_seconds(vim_id, res_type, has_create, percent):
+    seconds = 0
+    if has_create:
+        seconds += op_latencies.estimate(vim_id, OP_CREATE % res_type, DEFAULT_CREATE_SECONDS, percent)
+    if res_type in DEFAULT_WAIT_SECONDS:
+        seconds += op_latencies.estimate(vim_id, OP_WAIT % res_type, DEFAULT_WAIT_SECONDS[res_type], percent)
+    return seconds
+
+
+def get_cached_tenant_id(vim_id, tenant_name):
+    entry = vim_meta_cache.peek((vim_id, "", adaptor.META_TENANT))
+    return entry[0].get(tenant_name) if entry else None
+
+
+class PlanVnf(object):
+    """
+    Dry run of the instantiation of a converted VNFD: the resources it would
+    create on the vims, in order, with the vim calls, duration and capacity
+    they are expected to take. Nothing is sent to the vims.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.additional_params = ignore_case_get(data, "additionalParams")
+        self.vnfd_info = ignore_case_get(data, "vnfdModel")
+
+    def do_biz(self):
+        logger.debug("PlanVnf--do_biz::> %s" % self.data)
+        if not self.vnfd_info:
+            raise NFLCMException('vnfdModel is not set.')
+        if isinstance(self.vnfd_info, (str, unicode)):
+            self.vnfd_info = json.loads(self.vnfd_info)
+        self.vnfd_info = copy.deepcopy(self.vnfd_info)
+        self.set_locations()
+        update_ext_cps(self.data, self.vnfd_info)
+        update_reused_flavors(self.vnfd_info, get_cached_tenant_id)
+        try:
+            plan = adaptor.plan_vim_res(self.vnfd_info)
+            resources = [self.get_res_info(task_id, deps, args) for task_id, deps, args in plan]
+            vims = self.get_vim_totals()
+        except (KeyError, ValueError, VimException) as e:
+            raise NFLCMException('Invalid vnfdModel: %s' % e)
+        return {"resources": resources,
+                "apiCalls": self.get_api_calls(resources),
+                "criticalPath": self.get_critical_path(resources),
+                "vims": vims}
+
+    def set_locations(self):
+        """
+        Place the nodes without location_info on the vimId and tenant of the
+        additionalParams, as the grant of the instantiation does.
+        """
+        location = {"vimid": ignore_case_get(self.additional_params, "vimId"),
+                    "tenant": ignore_case_get(self.additional_params, "tenant")}
+        for key in ("vdus", "vls", "volume_storages"):
+            for node in ignore_case_get(self.vnfd_info, key):
+                properties = node.setdefault("properties", {})
+                if not ignore_case_get(properties, "location_info"):
+                    if not location["vimid"]:
+                        raise NFLCMException('additionalParams.vimId is not set.')
+                    properties["location_info"] = dict(location)
+
+    def get_res_info(self, task_id, deps, args):
+        res_type, node = task_id[0], args[-1]
+        location_info = adaptor.get_res_location(self.vnfd_info, res_type, node)
+        # flavors are not created for the VDUs which reuse the flavor of an
+        # earlier VDU or of another VNF
+        has_create = not (res_type == adaptor.RES_FLAVOR and (deps or ignore_case_get(node, "flavor_id")))
+        return {"id": "%s:%s" % task_id,
+                "resType": res_type,
+                "nodeId": task_id[1],
+                "vimId": location_info["vimid"],
+                "tenant": location_info["tenant"],
+                "dependsOn": ["%s:%s" % dep for dep in deps],
+                "createCalls": 1 if has_create else 0,
+                "seconds": get_task_seconds(location_info["vimid"], res_type, has_create, 50),
+                "p95Seconds": get_task_seconds(location_info["vimid"], res_type, has_create, 95)}
+
+    def get_api_calls(self, resources):
+        """
+        Return the vim calls of the run: the creates, the listing of the
+        tenants and images missing in the cache, and the polls of the
+        resources which become usable asynchronously, batched by vim tenant.
+        """
+        metas, polls = set(), {}
+        for res in resources:
+            vim_id, tenant = res["vimId"], res["tenant"]
+            if not vim_meta_cache.peek((vim_id, "", adaptor.META_TENANT)):
+                metas.add((vim_id, adaptor.META_TENANT))
+            if res["resType"] == adaptor.RES_VM and self.boots_from_image(res["nodeId"]):
+                tenant_id = get_cached_tenant_id(vim_id, tenant)
+                if not (tenant_id and vim_meta_cache.peek((vim_id, tenant_id, adaptor.META_IMAGE))):
+                    metas.add((vim_id, tenant, adaptor.META_IMAGE))
+            if res["resType"] in POLL_LIST_KEYS:
+                key = (vim_id, tenant, res["resType"])
+                polls[key] = max(polls.get(key, 0), res["seconds"])
+        calls = {"create": sum(res["createCalls"] for res in resources),
+                 "meta": len(metas),
+                 "poll": sum(get_poll_count(seconds) for seconds in polls.values())}
+        calls["total"] = sum(calls.values())
+        return calls
+
+    def boots_from_image(self, vdu_id):
+        for vdu in ignore_case_get(self.vnfd_info, "vdus"):
+            if vdu["vdu_id"] == vdu_id:
+                return bool(adaptor.get_vm_image_name(self.vnfd_info, vdu))
+        return False
+
+    def get_critical_path(self, resources):
+        """
+        Return the longest chain of dependent resources, which bounds the
+        duration of the run when enough workers create the others alongside.
+        """
+        finish, finish_p95, prev = {}, {}, {}
+        for res in resources:
+            start, start_p95 = 0, 0
+            for dep in res["dependsOn"]:
+                if finish[dep] > start:
+                    start, prev[res["id"]] = finish[dep], dep
+                start_p95 = max(start_p95, finish_p95[dep])
+            finish[res["id"]] = start + res["seconds"]
+            finish_p95[res["id"]] = start_p95 + res["p95Seconds"]
+        if not resources:
+            return {"seconds": 0, "p95Seconds": 0, "resources": []}
+        res_id = max(finish, key=finish.get)
+        path = [res_id]
+        while path[-1] in prev:
+            path.append(prev[path[-1]])
+        return {"seconds": finish[res_id], "p95Seconds": max(finish_p95.values()), "resources": path[::-1]}
+
+    def get_vim_totals(self):
+        vims = {}
+
+        def get_totals(location_info):
+            return vims.setdefault(location_info["vimid"], {
+                "vms": 0, "vcpu": 0, "memory": 0, "disk": 0, "volumes": 0, "volumeSize": 0})
+
+        for vdu in ignore_case_get(self.vnfd_info, "vdus"):
+            spec = adaptor.get_flavor_spec(self.vnfd_info, vdu)
+            totals = get_totals(vdu["properties"]["location_info"])
+            totals["vms"] += 1
+            totals["vcpu"] += spec["vcpu"]
+            totals["memory"] += spec["memory"]
+            totals["disk"] += sum(spec.get(key, 0) for key in ("disk", "ephemeral", "swap"))
+        for vol in ignore_case_get(self.vnfd_info, "volume_storages"):
+            totals = get_totals(vol["properties"]["location_info"])
+            totals["volumes"] += 1
+            totals["volumeSize"] += adaptor.get_volume_param(vol)["volumeSize"]
+        return vims
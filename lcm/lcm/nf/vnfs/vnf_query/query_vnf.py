@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import base64
 import logging
 
 from lcm.pub.database.models import NfInstModel, StorageInstModel, VLInstModel, NetworkInstModel, VNFCInstModel, \
@@ -19,6 +20,9 @@ from lcm.pub.exceptions import NFLCMException
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 100
+EXCLUDABLE_FIELDS = ["vimInfo", "vnfcResourceInfo", "virtualLinkResourceInfo", "virtualStorageResourceInfo"]
+
 
 class QueryVnf:
     def __init__(self, data, instanceid=''):
@@ -30,21 +34,87 @@ class QueryVnf:
         vnf_inst = NfInstModel.objects.filter(nfinstid=self.vnf_inst_id)
         if not vnf_inst.exists():
             raise NFLCMException('VnfInst(%s) does not exist' % self.vnf_inst_id)
-        resp_data = self.fill_resp_data(vnf_inst[0])
+        resp_data = self.fill_resp_datas(vnf_inst)[0]
         return resp_data
 
-    def query_multi_vnf(self):
-        vnf_insts = NfInstModel.objects.all()
-        if not vnf_insts:
+    def query_multi_vnf(self, filters=None, exclude_fields=()):
+        vnf_insts = NfInstModel.objects.filter(**(filters or {}))
+        if not vnf_insts and not filters:
             raise NFLCMException('VnfInsts does not exist')
-        resp_data = []
-        for vnf_inst in vnf_insts:
-            resp_data.append(self.fill_resp_data(vnf_inst))
+        resp_data = self.fill_resp_datas(vnf_insts, exclude_fields)
         return  resp_data
 
-    def fill_resp_data(self, vnf):
-        logger.info('Get the list of vloumes')
-        storage_inst = StorageInstModel.objects.filter(instid=vnf.nfinstid)
+    def query_vnf_page(self, filters, limit, cursor='', exclude_fields=()):
+        """
+        Return one page of at most limit vnf instances ordered by nfinstid,
+        starting after the instance the cursor points to, and the cursor of
+        the next page ('' on the last page).
+        """
+        vnf_insts = NfInstModel.objects.filter(**filters).order_by("nfinstid")
+        if cursor:
+            vnf_insts = vnf_insts.filter(nfinstid__gt=decode_cursor(cursor))
+        vnfs = list(vnf_insts[:limit + 1])
+        next_cursor = encode_cursor(vnfs[limit - 1].nfinstid) if len(vnfs) > limit else ''
+        return self.fill_resp_datas(vnfs[:limit], exclude_fields), next_cursor
+
+    def iter_vnfs(self, filters, exclude_fields=(), chunk_size=STREAM_CHUNK_SIZE):
+        last_inst_id = None
+        while True:
+            vnf_insts = NfInstModel.objects.filter(**filters).order_by("nfinstid")
+            if last_inst_id is not None:
+                vnf_insts = vnf_insts.filter(nfinstid__gt=last_inst_id)
+            vnfs = list(vnf_insts[:chunk_size])
+            for resp_data in self.fill_resp_datas(vnfs, exclude_fields):
+                yield resp_data
+            if len(vnfs) < chunk_size:
+                return
+            last_inst_id = vnfs[-1].nfinstid
+
+    def fill_resp_datas(self, vnfs, exclude_fields=()):
+        """
+        Fill the response of a set of vnf instances. Each child table is
+        queried once for the whole set, not once per instance or per row.
+        The tables behind excluded fields are not queried at all.
+        """
+        vnfs = list(vnfs)
+        inst_ids = [vnf.nfinstid for vnf in vnfs]
+        storages, vls, networks, vnfcs, vms = {}, {}, {}, {}, {}
+        if inst_ids and "virtualStorageResourceInfo" not in exclude_fields:
+            logger.info('Get the list of vloumes')
+            storages = group_by(StorageInstModel.objects.filter(instid__in=inst_ids), "instid")
+        if inst_ids and "virtualLinkResourceInfo" not in exclude_fields:
+            logger.info('Get the VLInstModel of list.')
+            vls = group_by(VLInstModel.objects.filter(ownerid__in=inst_ids), "ownerid")
+        network_ids = [v.relatednetworkid for vl_list in vls.values() for v in vl_list]
+        if network_ids:
+            networks = index_by(NetworkInstModel.objects.filter(networkid__in=network_ids), "networkid")
+        if inst_ids and "vnfcResourceInfo" not in exclude_fields:
+            logger.info('Get VNFCInstModel of list.')
+            vnfcs = group_by(VNFCInstModel.objects.filter(instid__in=inst_ids), "instid")
+        if inst_ids and ("vimInfo" not in exclude_fields or vnfcs):
+            logger.info('Get the VimInstModel of list.')
+            vms = group_by(VmInstModel.objects.filter(instid__in=inst_ids), "instid")
+        vnfc_vms = index_by([vm for vm_list in vms.values() for vm in vm_list], "vmid")
+        vnfc_vm_ids = [vnfc.vmid for vnfc_list in vnfcs.values() for vnfc in vnfc_list]
+        other_vm_ids = [vm_id for vm_id in vnfc_vm_ids if vm_id not in vnfc_vms]
+        if other_vm_ids:
+            vnfc_vms.update(index_by(VmInstModel.objects.filter(vmid__in=other_vm_ids), "vmid"))
+        vm_storages = {}
+        if vnfc_vm_ids:
+            vm_storages = group_by(StorageInstModel.objects.filter(ownerid__in=vnfc_vm_ids), "ownerid")
+        if "vimInfo" in exclude_fields:
+            vms = {}
+        resp_datas = []
+        for vnf in vnfs:
+            resp_data = self.fill_resp_data(vnf, storages.get(vnf.nfinstid, []), vls.get(vnf.nfinstid, []),
+                                            networks, vnfcs.get(vnf.nfinstid, []), vnfc_vms, vm_storages,
+                                            vms.get(vnf.nfinstid, []))
+            for field in exclude_fields:
+                resp_data["instantiatedVnfInfo"].pop(field, None)
+            resp_datas.append(resp_data)
+        return resp_datas
+
+    def fill_resp_data(self, vnf, storage_inst, vl_inst, networks, vnfc_insts, vnfc_vms, vm_storages, vms):
         arr = []
         for s in storage_inst:
             storage = {
@@ -55,44 +125,37 @@ class QueryVnf:
                 }
             }
             arr.append(storage)
-        logger.info('Get the VLInstModel of list.')
-        vl_inst = VLInstModel.objects.filter(ownerid=vnf.nfinstid)
         vl_arr = []
         for v in vl_inst:
-            net = NetworkInstModel.objects.filter(networkid=v.relatednetworkid)
+            net = networks.get(v.relatednetworkid)
             if not net:
                 raise NFLCMException('NetworkInst(%s) does not exist.' % v.relatednetworkid)
             v_dic = {
                 "virtualLinkInstanceId": v.vlinstanceid,
                 "virtualLinkDescId": v.vldid,
                 "networkResource": {
-                    "vimId": net[0].vimid,
-                    "resourceId": net[0].resouceid
+                    "vimId": net.vimid,
+                    "resourceId": net.resouceid
                 }
             }
             vl_arr.append(v_dic)
-        logger.info('Get VNFCInstModel of list.')
-        vnfc_insts = VNFCInstModel.objects.filter(instid=vnf.nfinstid)
         vnfc_arr = []
         for vnfc in vnfc_insts:
-            vm = VmInstModel.objects.filter(vmid=vnfc.vmid)
+            vm = vnfc_vms.get(vnfc.vmid)
             if not vm:
                 raise NFLCMException('VmInst(%s) does not exist.' % vnfc.vmid)
-            storage = StorageInstModel.objects.filter(ownerid=vm[0].vmid)
-            if not storage:
-                raise NFLCMException('StorageInst(%s) does not exist.' % vm[0].vmid)
+            # a vm created without volumes, e.g. with local storages only, has no storage
+            storage = vm_storages.get(vm.vmid, [])
             vnfc_dic = {
                 "vnfcInstanceId": vnfc.vnfcinstanceid,
                 "vduId": vnfc.vduid,
                 "computeResource": {
-                    "vimId": vm[0].vimid,
-                    "resourceId": vm[0].resouceid
+                    "vimId": vm.vimid,
+                    "resourceId": vm.resouceid
                 },
                 "storageResourceIds": [s.storageid for s in storage]
             }
             vnfc_arr.append(vnfc_dic)
-        logger.info('Get the VimInstModel of list.')
-        vms = VmInstModel.objects.filter(instid=vnf.nfinstid)
         vm_arr = []
         for vm in vms:
             vm_dic = {
@@ -146,3 +209,25 @@ class QueryVnf:
             # "extensions": vnf.extension
         }
         return resp_data
+
+
+def group_by(rows, attr):
+    groups = {}
+    for row in rows:
+        groups.setdefault(getattr(row, attr), []).append(row)
+    return groups
+
+
+def index_by(rows, attr):
+    return dict([(getattr(row, attr), row) for row in rows])
+
+
+def encode_cursor(inst_id):
+    return base64.urlsafe_b64encode(inst_id.encode("utf-8"))
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(str(cursor)).decode("utf-8")
+    except (TypeError, UnicodeError):
+        raise NFLCMException('Invalid cursor(%s)' % cursor)
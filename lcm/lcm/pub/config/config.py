@@ -44,3 +44,78 @@ REG_TO_MSB_REG_PARAM = {
         "ttl": 0
     }]
 }
+
+# [vim]
+VIM_RES_WORKERS = 8
+VIM_POLL_INTERVAL = 2
+VIM_POLL_MAX_INTERVAL = 30
+# retries of a failed resource create or delete, with a backoff doubling from the interval
+VIM_CREATE_RETRIES = 2
+VIM_DELETE_RETRIES = 3
+VIM_RETRY_INTERVAL = 2
+# seconds the tenants and images listed from a vim are cached, and
+# age of the cached list reloaded once when a name is not found in it
+VIM_META_CACHE_TTL = 300
+VIM_META_CACHE_MISS_REFRESH = 10
+# calls per second and burst of calls allowed to each vim, 0 for no limit
+VIM_RATE_LIMIT = 50
+VIM_RATE_BURST = 100
+# calls in flight to each vim, and seconds a call waits for a free slot
+VIM_MAX_CONCURRENCY = 32
+VIM_LIMIT_WAIT_TIMEOUT = 60
+# consecutive 5xx or unanswered calls which open the circuit breaker of a
+# vim, and seconds it rejects the calls before letting a trial through
+VIM_BREAKER_THRESHOLD = 5
+VIM_BREAKER_RESET_TIMEOUT = 30
+# durations of the last creates and waits kept per vim and resource type to
+# estimate the instantiation plans, and seconds between their loads from the DB
+VIM_LATENCY_SAMPLES = 200
+VIM_LATENCY_LOAD_INTERVAL = 60
+
+# [rest]
+# keep-alive connections in use per host, None to size it from the concurrency
+# of the lcm operations, whose vim calls all go through the msb
+REST_POOL_MAX_CONN_PER_HOST = None
+REST_POOL_IDLE_TIMEOUT = 60
+# seconds a call waits for a connection of the pool to be released
+REST_POOL_WAIT_TIMEOUT = 60
+# seconds a vim read call waits for its response, the creates and deletes
+# have no timeout: they may take long and a retried create duplicates it
+REST_CALL_TIMEOUT = 60
+
+# [vnfd cache]
+VNFD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+VNFD_CACHE_TTL = 3600
+# redis db of the shared tier, None to keep the cache in process only
+VNFD_CACHE_REDIS_DB = None
+
+# [job]
+JOB_STATUS_FLUSH_INTERVAL = 1
+JOB_HUB_MAX_JOBS = 10000
+# max statuses returned by one job status query
+JOB_STATUS_QUERY_LIMIT = 1000
+# long-poll and event stream of job statuses
+JOB_WAIT_MAX_TIMEOUT = 60
+JOB_WAIT_DB_INTERVAL = 5
+JOB_EVENTS_KEEPALIVE = 15
+JOB_EVENTS_MAX_DURATION = 600
+
+# [trace]
+# record timed spans of the LCM operations, and finished spans kept in memory
+TRACE_ENABLED = True
+TRACE_MAX_SPANS = 20000
+
+# [lcm op]
+LCM_OP_WORKERS = 10
+LCM_OP_MAX_QUEUE = 100
+# seconds a client is asked to wait before retrying a rejected operation
+LCM_OP_RETRY_AFTER = 30
+# resume or roll back the operations left unfinished by a stopped process
+RECOVER_LCM_OPS_WHEN_START = True
+LCM_OP_HEARTBEAT_INTERVAL = 10
+LCM_OP_HEARTBEAT_TIMEOUT = 60
+# 'thread' runs the operations in the REST process, 'process' only queues
+# them for the processes started by "python manage.py lcm_worker"
+LCM_WORKER_MODE = 'thread'
+# seconds an idle lcm_worker waits before polling the queue again
+LCM_WORKER_POLL_INTERVAL = 1
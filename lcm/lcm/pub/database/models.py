@@ -63,6 +63,9 @@ class JobModel(models.Model):
 class JobStatusModel(models.Model):
     class Meta:
         db_table = 'JOB_STATUS'
+        # not created on existing databases, which need:
+        # CREATE INDEX JOB_STATUS_JOBID_INDEXID ON JOB_STATUS (JOBID, INDEXID);
+        index_together = [['jobid', 'indexid']]
 
     _database = 'job'
 
@@ -78,6 +81,36 @@ class JobStatusModel(models.Model):
         import json
         return json.dumps(dict([(attr, getattr(self, attr)) for attr in [f.name for f in self._meta.fields]]))
 
+class LcmOpModel(models.Model):
+    class Meta:
+        db_table = 'LCMOP'
+
+    _database = 'job'
+
+    jobid = models.CharField(db_column='JOBID', primary_key=True, max_length=255)
+    optype = models.CharField(db_column='OPTYPE', max_length=255)
+    opclass = models.CharField(db_column='OPCLASS', max_length=255)
+    instid = models.CharField(db_column='INSTID', max_length=255)
+    data = models.TextField(db_column='DATA', null=True, blank=True)
+    priority = models.IntegerField(db_column='PRIORITY', default=0)
+    status = models.CharField(db_column='STATUS', max_length=255)
+    checkpoint = models.CharField(db_column='CHECKPOINT', max_length=255, null=True, blank=True)
+    owner = models.CharField(db_column='OWNER', max_length=255, null=True, blank=True)
+    heartbeat = models.IntegerField(db_column='HEARTBEAT', default=0)
+    createtime = models.CharField(db_column='CREATETIME', max_length=255, null=True, blank=True)
+    updatetime = models.CharField(db_column='UPDATETIME', max_length=255, null=True, blank=True)
+
+class OpLatencyModel(models.Model):
+    class Meta:
+        db_table = 'OPLATENCY'
+        unique_together = (('vimid', 'op'),)
+
+    _database = 'job'
+
+    vimid = models.CharField(db_column='VIMID', max_length=255)
+    op = models.CharField(db_column='OP', max_length=255)
+    durations = models.TextField(db_column='DURATIONS')
+
 class NfvoRegInfoModel(models.Model):
     class Meta:
         db_table = 'NFVOREGINFO'
@@ -106,7 +139,7 @@ class StorageInstModel(models.Model):
     size = models.CharField(db_column='SIZE', max_length=255)
     # rdmaenabled = models.IntegerField(db_column='RDMAENABLED', null=True)
     # disktype = models.CharField(db_column='DISKTYPE', max_length=255)
-    # ownerid = models.CharField(db_column='OWNERID', max_length=255, null=True)
+    ownerid = models.CharField(db_column='OWNERID', max_length=255, null=True)
     # zoneid = models.CharField(db_column='ZONEID', max_length=255, null=True)
     # hostid = models.CharField(db_column='HOSTID', max_length=255, null=True)
     # operationalstate = models.CharField(db_column='OPERATIONALSTATE', max_length=255, null=True)
@@ -168,6 +201,7 @@ class FlavourInstModel(models.Model):
     instid = models.CharField(db_column='INSTID', max_length=255)
     create_time = models.CharField(db_column='CREATETIME', max_length=200, null=True, blank=True)
     is_predefined = models.IntegerField(db_column='ISPREDEFINED', default=0, null=True)
+    spechash = models.CharField(db_column='SPECHASH', max_length=64, null=True, blank=True)
 
 class NetworkInstModel(models.Model):
     class Meta:
@@ -14,4 +14,7 @@
 
 
 class NFLCMException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class NFLCMQueueFullException(NFLCMException):
+    pass
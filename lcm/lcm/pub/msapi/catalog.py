@@ -15,7 +15,10 @@
 import json
 import logging
 
+from lcm.pub.utils import toscautil
+from lcm.pub.utils.cacheutil import vnfd_model_cache
 from lcm.pub.utils.restcall import req_by_msb
+from lcm.pub.utils.traceutil import tracer, traced
 from lcm.pub.utils.values import ignore_case_get
 from lcm.pub.exceptions import NFLCMException
 
@@ -38,6 +41,7 @@ def query_csar_from_catalog(csar_id, key=''):
     return ignore_case_get(csar_info, key) if key else csar_info
 
 
+@traced
 def query_rawdata_from_catalog(csar_id, input_parameters=[]):
     req_param = json.JSONEncoder().encode({"csarId": csar_id, "inputParameters": input_parameters})
     ret = req_by_msb("/openoapi/catalog/v1/servicetemplates/queryingrawdata", "POST", req_param)
@@ -47,6 +51,23 @@ def query_rawdata_from_catalog(csar_id, input_parameters=[]):
     return json.JSONDecoder().decode(ret[1])
 
 
+@traced
+def query_vnfd_model_from_catalog(csar_id, input_parameters=[]):
+    """
+    Return the converted VNFD model of the CSAR as a dict, from the cache if
+    the same CSAR has already been converted with the same input parameters.
+    Every call returns a new dict that the caller may modify.
+    """
+    vnfd_model = vnfd_model_cache.get(csar_id, input_parameters)
+    if vnfd_model is not None:
+        return json.JSONDecoder().decode(vnfd_model)
+    raw_data = query_rawdata_from_catalog(csar_id, input_parameters)
+    with tracer.span("convert_vnfd_model"):
+        vnfd_dict = toscautil.convert_vnfd_dict(raw_data["rawData"])
+    vnfd_model_cache.set(csar_id, input_parameters, json.JSONEncoder().encode(vnfd_dict))
+    return vnfd_dict
+
+
 def set_csar_state(csar_id, prop, val):
     ret = req_by_msb("/openoapi/catalog/v1/csars/%s?%s=%s" % (csar_id, prop, val), "PUT")
     if ret[0] != 0:
@@ -56,6 +77,7 @@ def set_csar_state(csar_id, prop, val):
 
 
 def delete_csar_from_catalog(csar_id):
+    vnfd_model_cache.invalidate(csar_id)
     ret = req_by_msb("/openoapi/catalog/v1/csars/%s" % csar_id, "DELETE")
     if ret[0] != 0 and ret[2] != '404':
         logger.error("Status code is %s, detail is %s.", ret[2], ret[1])
@@ -16,10 +16,12 @@ import logging
 
 from lcm.pub.exceptions import NFLCMException
 from lcm.pub.utils.restcall import req_by_msb
+from lcm.pub.utils.traceutil import traced
 
 logger = logging.getLogger(__name__)
 
 
+@traced
 def get_packageinfo_by_vnfdid(vnfdid):
     ret = req_by_msb("openoapi/gvnfmdriver/v1/vnfpackages", "GET")  # TODO
     if ret[0] != 0:
@@ -28,6 +30,7 @@ def get_packageinfo_by_vnfdid(vnfdid):
     return json.JSONDecoder().decode(ret[1])
 
 
+@traced
 def apply_grant_to_nfvo(data):
     ret = req_by_msb("openoapi/gvnfmdriver/v1/resource/grant", "PUT", data)
     if ret[0] != 0:
@@ -36,6 +39,7 @@ def apply_grant_to_nfvo(data):
     return json.JSONDecoder().decode(ret[1])
 
 
+@traced
 def notify_lcm_to_nfvo(data):
     ret = req_by_msb("openoapi/gvnfmdriver/v1/vnfs/lifecyclechangesnotification", "POST", data)
     if ret[0] != 0:
@@ -0,0 +1,245 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import redis
+
+from lcm.pub.config.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWD
+from lcm.pub.config.config import VNFD_CACHE_MAX_BYTES, VNFD_CACHE_TTL, VNFD_CACHE_REDIS_DB
+from lcm.pub.config.config import VIM_META_CACHE_TTL, VIM_META_CACHE_MISS_REFRESH
+
+logger = logging.getLogger(__name__)
+
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+
+class ModelCache(object):
+    """
+    Cache of converted VNFD models keyed by (csar_id, hash of input parameters).
+    The in-process tier is an LRU bounded by the total size of the cached
+    models. If a redis client is given, it is used as a shared second tier so
+    the other LCM processes do not convert the same package again. Redis
+    errors only degrade the cache to the in-process tier.
+    """
+    def __init__(self, max_bytes=VNFD_CACHE_MAX_BYTES, ttl=VNFD_CACHE_TTL, redis_client=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.redis = redis_client
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def redis_key(self, csar_id):
+        return "vnfd_model:%s" % csar_id
+
+    def get(self, csar_id, params):
+        key = (csar_id, params_hash(params))
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and entry[1] > time.time():
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self.size -= len(entry[0])
+        model = None
+        if self.redis:
+            try:
+                model = self.redis.hget(self.redis_key(csar_id), key[1])
+            except:
+                logger.error(traceback.format_exc())
+        with self.lock:
+            if model is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.put_local(key, model)
+        return model
+
+    def set(self, csar_id, params, model):
+        key = (csar_id, params_hash(params))
+        self.put_local(key, model)
+        if self.redis:
+            try:
+                self.redis.hset(self.redis_key(csar_id), key[1], model)
+                self.redis.expire(self.redis_key(csar_id), self.ttl)
+            except:
+                logger.error(traceback.format_exc())
+
+    def put_local(self, key, model):
+        if len(model) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= len(old[0])
+            self.entries[key] = (model, time.time() + self.ttl)
+            self.size += len(model)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, csar_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == csar_id]:
+                self.size -= len(self.entries.pop(key)[0])
+        if self.redis:
+            try:
+                self.redis.delete(self.redis_key(csar_id))
+            except:
+                logger.error(traceback.format_exc())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "size": self.size, "hits": self.hits, "misses": self.misses}
+
+
+def create_vnfd_model_cache():
+    redis_client = None
+    if VNFD_CACHE_REDIS_DB is not None:
+        redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWD, db=VNFD_CACHE_REDIS_DB,
+                                   socket_timeout=1)
+    return ModelCache(redis_client=redis_client)
+
+
+vnfd_model_cache = create_vnfd_model_cache()
+
+
+class Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class VimMetaCache(object):
+    """
+    Name to id indexes of the tenants and images of the VIMs, keyed by
+    (vim_id, tenant_id, kind) and shared by all the jobs of the process.
+    An index is loaded by one list call on a miss or once it is older than
+    ttl, and the concurrent misses of an index wait for that call. A name
+    missing from an index older than miss_refresh seconds reloads it once,
+    in case the resource was added since.
+    """
+    def __init__(self, ttl=VIM_META_CACHE_TTL, miss_refresh=VIM_META_CACHE_MISS_REFRESH):
+        self.ttl = ttl
+        self.miss_refresh = miss_refresh
+        self.entries = {}
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = self.loads = 0
+
+    def get_id(self, key, name, load):
+        """
+        Return the id of the resource with the name in the index of key, None
+        if there is none. load returns the listed resources, each a dict with
+        an id and a name, and is only called on a miss.
+        """
+        index, load_time = self.get_index(key, load)
+        if name not in index and time.time() - load_time > self.miss_refresh:
+            index, load_time = self.get_index(key, load, load_time)
+        return index.get(name)
+
+    def get_index(self, key, load, stale_time=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] + self.ttl > time.time() and entry[1] != stale_time:
+                self.hits += 1
+                return entry
+            flight = self.flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self.flights[key] = Flight()
+                self.loads += 1
+        if owner:
+            try:
+                flight.entry = (self.make_index(load()), time.time())
+            except:
+                logger.error(traceback.format_exc())
+                flight.error = sys.exc_info()
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+                    if flight.entry:
+                        self.entries[key] = flight.entry
+            flight.event.set()
+        else:
+            flight.event.wait()
+        if flight.error:
+            raise flight.error[0], flight.error[1], flight.error[2]
+        return flight.entry
+
+    def make_index(self, items):
+        index = {}
+        for item in items:
+            index.setdefault(item["name"], item["id"])
+        return index
+
+    def peek(self, key):
+        """
+        Return the (index, load time) of key if it is cached and fresh, None
+        otherwise, without loading it.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] + self.ttl > time.time():
+                self.hits += 1
+                return entry
+        return None
+
+    def put(self, key, items):
+        entry = (self.make_index(items), time.time())
+        with self.lock:
+            self.loads += 1
+            self.entries[key] = entry
+        return entry
+
+    def invalidate(self, vim_id=None, tenant_id=None, kind=None):
+        """
+        Drop the indexes matching the given vim, tenant and kind, all of
+        them if none is given. The loads in progress are not cached.
+        """
+        def match(key):
+            return all(val is None or val == key[i] for i, val in enumerate((vim_id, tenant_id, kind)))
+        with self.lock:
+            for key in [key for key in self.entries if match(key)]:
+                del self.entries[key]
+            for key in [key for key in self.flights if match(key)]:
+                del self.flights[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def get_stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "loads": self.loads}
+
+
+vim_meta_cache = VimMetaCache()
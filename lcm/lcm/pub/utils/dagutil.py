@@ -0,0 +1,154 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import Queue
+import sys
+import threading
+import traceback
+
+from lcm.pub.exceptions import NFLCMException
+from lcm.pub.utils.traceutil import tracer
+
+logger = logging.getLogger(__name__)
+
+EVT_NOTIFY, EVT_DONE = 0, 1
+
+
+class DagExecutor(object):
+    """
+    Run the tasks of a dependency graph on a bounded pool of worker threads.
+    A task starts as soon as all the tasks it depends on have finished.
+    Notifications posted by the tasks are delivered to the callback on the
+    thread that calls run(), in the order they were posted. If given, flush
+    is called on that thread after each batch of notifications, before the
+    tasks unblocked by the batch are started. Each task is traced as a span
+    of the trace run() is called in.
+    """
+    def __init__(self, max_workers, callback, flush=None):
+        self.max_workers = max(1, int(max_workers))
+        self.callback = callback
+        self.flush = flush
+        self.task_ids = []
+        self.tasks = {}
+        self.deps = {}
+        self.events = Queue.Queue()
+
+    def add_task(self, task_id, deps, fun, *args, **kwargs):
+        if task_id in self.tasks:
+            raise NFLCMException("Duplicate task(%s)" % str(task_id))
+        self.task_ids.append(task_id)
+        self.tasks[task_id] = (fun, args, kwargs)
+        self.deps[task_id] = set(deps)
+
+    def has_task(self, task_id):
+        return task_id in self.tasks
+
+    def run(self):
+        waiting, dependents = {}, {}
+        for task_id in self.task_ids:
+            for dep in self.deps[task_id]:
+                if dep not in self.tasks:
+                    raise NFLCMException("Task(%s) depends on undefined task(%s)" % (str(task_id), str(dep)))
+                dependents.setdefault(dep, []).append(task_id)
+            waiting[task_id] = len(self.deps[task_id])
+        if not self.task_ids:
+            return
+
+        todo = Queue.Queue()
+        context = tracer.get_context()
+        workers = [threading.Thread(target=self.work, args=(todo, context))
+                   for _ in range(min(self.max_workers, len(self.task_ids)))]
+        for worker in workers:
+            worker.setDaemon(True)
+            worker.start()
+
+        running, finished, err = 0, 0, None
+        for task_id in self.task_ids:
+            if waiting[task_id] == 0:
+                todo.put(task_id)
+                running += 1
+        try:
+            while running > 0:
+                ready = []
+                for evt in self.get_events():
+                    if evt[0] == EVT_NOTIFY:
+                        try:
+                            self.callback(*evt[1])
+                        except:
+                            logger.error(traceback.format_exc())
+                            err = err or sys.exc_info()
+                        continue
+                    task_id, task_err = evt[1], evt[2]
+                    running -= 1
+                    finished += 1
+                    err = err or task_err
+                    for next_id in dependents.get(task_id, []):
+                        waiting[next_id] -= 1
+                        if waiting[next_id] == 0:
+                            ready.append(next_id)
+                if self.flush:
+                    try:
+                        self.flush()
+                    except:
+                        logger.error(traceback.format_exc())
+                        err = err or sys.exc_info()
+                if err:
+                    continue
+                for next_id in ready:
+                    todo.put(next_id)
+                    running += 1
+        finally:
+            for _ in workers:
+                todo.put(None)
+            for worker in workers:
+                worker.join()
+
+        if err:
+            raise err[0], err[1], err[2]
+        if finished < len(self.task_ids):
+            raise NFLCMException("Cyclic dependency found among tasks")
+
+    def get_events(self):
+        evts = [self.events.get()]
+        try:
+            while True:
+                evts.append(self.events.get_nowait())
+        except Queue.Empty:
+            pass
+        return evts
+
+    def work(self, todo, context=None):
+        while True:
+            task_id = todo.get()
+            if task_id is None:
+                return
+            fun, args, kwargs = self.tasks[task_id]
+            kwargs = dict(kwargs, do_notify=self.notify)
+            try:
+                with tracer.attach(context), tracer.span(get_task_name(task_id)):
+                    fun(*args, **kwargs)
+                self.events.put((EVT_DONE, task_id, None))
+            except:
+                logger.error(traceback.format_exc())
+                self.events.put((EVT_DONE, task_id, sys.exc_info()))
+
+    def notify(self, *args):
+        self.events.put((EVT_NOTIFY, args))
+
+
+def get_task_name(task_id):
+    if isinstance(task_id, tuple):
+        return ":".join(str(key) for key in task_id)
+    return str(task_id)
@@ -0,0 +1,65 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def locking_atomic():
+    """
+    Run the block in a transaction in which select_for_update locks the rows
+    it reads. On the backends which can't lock rows, e.g. the sqlite of the
+    tests, the statements of the block are committed one by one instead: a
+    sqlite transaction which reads before writing fails at once when another
+    connection writes at the same time.
+    """
+    if connection.features.has_select_for_update:
+        with transaction.atomic():
+            yield
+    else:
+        yield
+
+
+class BulkWriter(object):
+    """
+    Unit of work for new model instances: add() only buffers them, flush()
+    inserts all the buffered instances with one bulk_create per model, in
+    one transaction. Instances are kept in the buffer if the flush fails.
+    """
+    def __init__(self):
+        self.models = []
+        self.pending = {}
+
+    def add(self, obj):
+        model = type(obj)
+        if model not in self.pending:
+            self.models.append(model)
+            self.pending[model] = []
+        self.pending[model].append(obj)
+
+    def flush(self):
+        count = sum([len(objs) for objs in self.pending.values()])
+        if not count:
+            return 0
+        with transaction.atomic():
+            for model in self.models:
+                model.objects.bulk_create(self.pending[model])
+        logger.debug("Flush %d records of %s", count, ",".join([model.__name__ for model in self.models]))
+        self.models, self.pending = [], {}
+        return count
@@ -14,11 +14,17 @@
 
 import datetime
 import logging
+import threading
+import time
 import uuid
 import traceback
+from collections import OrderedDict
 
+from django.db import connection, transaction
+from django.db.models import Max
+
+from lcm.pub.config.config import JOB_STATUS_FLUSH_INTERVAL, JOB_WAIT_DB_INTERVAL, JOB_HUB_MAX_JOBS
 from lcm.pub.database.models import JobStatusModel, JobModel
-from lcm.pub.utils import idutil
 
 logger = logging.getLogger(__name__)
 
@@ -42,20 +48,47 @@ class JobUtil(object):
         return "%s-%s" % (job_name if job_name else "UnknownJob", uuid.uuid1())
 
     @staticmethod
-    def query_job_status(job_id, index_id=-1):
+    def query_job_status(job_id, index_id=-1, limit=None, oldest=False):
+        """
+        Return the latest status of the job if index_id < 0, else its statuses
+        newer than index_id, latest first. With a limit, only the limit latest
+        of them are returned, or with oldest the limit oldest, so that a reader
+        of all the statuses can catch up in steps.
+        """
         #logger.info("Query job status, jobid =[%s], responseid [%d]" % (job_id, index_id))
         jobs = []
         if index_id < 0:
             row = JobStatusModel.objects.filter(jobid=job_id).order_by("-indexid").first()
             if row:
                 jobs.append(row)
+        elif limit and oldest:
+            rows = JobStatusModel.objects.filter(jobid=job_id, indexid__gt=index_id).order_by("indexid")[:limit]
+            jobs = list(reversed(rows))
+        elif limit:
+            jobs = list(JobStatusModel.objects.filter(jobid=job_id, indexid__gt=index_id).order_by("-indexid")[:limit])
         else:
-            [jobs.append(job) for job in JobStatusModel.objects.filter(jobid=job_id).order_by("-indexid")
-             if job.indexid > index_id]
+            jobs = list(JobStatusModel.objects.filter(jobid=job_id, indexid__gt=index_id).order_by("-indexid"))
 
         #logger.info("Query job status, rows=%s" % str(jobs))
         return jobs
 
+    @staticmethod
+    def wait_job_status(job_id, index_id, timeout, limit=None, oldest=False):
+        """
+        Like query_job_status, but if the job has no status newer than index_id
+        yet, block until it has one or timeout seconds have passed. Statuses
+        written by this process wake the waiters up at once, the DB is checked
+        again every JOB_WAIT_DB_INTERVAL seconds for the others.
+        """
+        deadline = time.time() + timeout
+        while True:
+            seq = job_status_hub.get_seq(job_id)
+            jobs = JobUtil.query_job_status(job_id, index_id, limit, oldest)
+            remaining = deadline - time.time()
+            if jobs or remaining <= 0:
+                return jobs
+            job_status_hub.wait(job_id, seq, min(remaining, JOB_WAIT_DB_INTERVAL))
+
     @staticmethod
     def is_job_exists(job_id):
         jobs = JobModel.objects.filter(jobid=job_id)
@@ -88,48 +121,16 @@ class JobUtil(object):
 
     @staticmethod
     def add_job_status(job_id, progress, status_decs, error_code=""):
-        jobs = JobModel.objects.filter(jobid=job_id)
-        if not jobs:
-            logger.error("Job[%s] is not exists, please create job first." % job_id)
-            raise Exception("Job[%s] is not exists." % job_id)
-        try:
-            int_progress = int(progress)
-            job_status = JobStatusModel()
-            job_status.indexid = int(idutil.get_auto_id(job_id))
-            job_status.jobid = job_id
-            job_status.status = "processing"
-            job_status.progress = int_progress
-
-            if job_status.progress == 0:
-                job_status.status = "started"
-            elif job_status.progress == 100:
-                job_status.status = "finished"
-            elif job_status.progress == 101:
-                job_status.status = "partly_finished"
-            elif job_status.progress > 101:
-                job_status.status = "error"
-
-            job_status.descp = status_decs
-            job_status.errcode = error_code
-            job_status.addtime = datetime.datetime.now().strftime('%Y-%m-%d %X')
-            job_status.save()
-            logger.debug("Add a new job status, jobid=%s, indexid=%d,"
-                         " status=%s, description=%s, progress=%d, errcode=%s, addtime=%r" %
-                         (job_status.jobid, job_status.indexid, job_status.status, job_status.descp,
-                          job_status.progress, job_status.errcode, job_status.addtime))
-
-            job = jobs[0]
-            job.progress = int_progress
-            if job_status.progress >= 100:
-                job.status = JOB_STATUS.FINISH
-                job.endtime = datetime.datetime.now().strftime('%Y-%m-%d %X')
-            job.save()
-            logger.debug("update job, jobid=%s, progress=%d" % (job_status.jobid, int_progress))
-        except:
-            logger.error(traceback.format_exc())
+        job_status_writer.add(job_id, progress, status_decs, error_code)
+
+    @staticmethod
+    def flush_job_status(job_id=None):
+        job_status_writer.flush(job_id)
 
     @staticmethod
     def clear_job_status(job_id):
+        job_status_writer.forget(job_id)
+        job_status_hub.forget(job_id)
         [job.delete() for job in JobStatusModel.objects.filter(jobid=job_id)]
         logger.debug("Clear job status, job_id=%s" % job_id)
 
@@ -138,3 +139,169 @@ class JobUtil(object):
         jobs = JobModel.objects.filter(resid=inst_id, jobtype=inst_type, status=JOB_STATUS.PROCESSING)
         progresses = reduce(lambda content, job: content + [url_prefix + "/" + job.jobid], jobs, [])
         return progresses
+
+
+def get_job_status_name(progress):
+    if progress == 0:
+        return "started"
+    elif progress == 100:
+        return "finished"
+    elif progress == 101:
+        return "partly_finished"
+    elif progress > 101:
+        return "error"
+    return "processing"
+
+
+class JobStatusWriter(object):
+    """
+    Write the statuses of the jobs in batches. The index ids of a job are
+    allocated from an in-memory sequence seeded from the DB, as a job is
+    only run by one process at a time. The statuses of a job are buffered
+    for up to flush_interval seconds, then written with the job update in
+    one transaction, in index order, so that the pollers always see
+    increasing responseIds without gaps. The first and the final statuses
+    of a job are written at once, and the sequence is dropped after them:
+    the first one is written by the process taking the request, which may
+    hand the job over to a lcm_worker process.
+    """
+    def __init__(self, flush_interval=JOB_STATUS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.RLock()
+        self.index_ids = {}
+        self.pending = {}
+        self.thread = None
+
+    def add(self, job_id, progress, status_decs, error_code=""):
+        # the first status of a job loads its sequence out of the lock, not
+        # to hold up the statuses of the other jobs
+        with self.lock:
+            index_id = self.index_ids.get(job_id)
+        if index_id is None:
+            index_id = self.load_index_id(job_id)
+        with self.lock:
+            self.index_ids.setdefault(job_id, index_id)
+            try:
+                job_status = JobStatusModel(jobid=job_id, progress=int(progress), descp=status_decs,
+                                            errcode=error_code, addtime=datetime.datetime.now().strftime('%Y-%m-%d %X'))
+            except:
+                logger.error(traceback.format_exc())
+                return
+            self.index_ids[job_id] += 1
+            job_status.indexid = self.index_ids[job_id]
+            job_status.status = get_job_status_name(job_status.progress)
+            if job_id not in self.pending:
+                self.pending[job_id] = (time.time(), [])
+            self.pending[job_id][1].append(job_status)
+            flush_now = job_status.progress == 0 or job_status.progress >= 100 or \
+                time.time() - self.pending[job_id][0] >= self.flush_interval
+            if not flush_now and not self.thread:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.setDaemon(True)
+                self.thread.start()
+        if flush_now:
+            self.flush(job_id)
+
+    def load_index_id(self, job_id):
+        if not JobModel.objects.filter(jobid=job_id).exists():
+            logger.error("Job[%s] is not exists, please create job first." % job_id)
+            raise Exception("Job[%s] is not exists." % job_id)
+        return JobStatusModel.objects.filter(jobid=job_id).aggregate(Max('indexid'))['indexid__max'] or 0
+
+    def flush(self, job_id=None):
+        with self.flush_lock:
+            with self.lock:
+                job_ids = [job_id] if job_id else self.pending.keys()
+                batches = [(jid, self.pending.pop(jid)[1]) for jid in job_ids if jid in self.pending]
+            for jid, job_statuses in batches:
+                try:
+                    self.write(jid, job_statuses)
+                except:
+                    logger.error(traceback.format_exc())
+                    with self.lock:
+                        if jid in self.pending:
+                            job_statuses.extend(self.pending[jid][1])
+                        self.pending[jid] = (time.time(), job_statuses)
+
+    def write(self, job_id, job_statuses):
+        last = job_statuses[-1]
+        job_update = {"progress": last.progress}
+        if last.progress >= 100:
+            job_update["status"] = JOB_STATUS.FINISH
+            job_update["endtime"] = datetime.datetime.now().strftime('%Y-%m-%d %X')
+        with transaction.atomic():
+            JobStatusModel.objects.bulk_create(job_statuses)
+            JobModel.objects.filter(jobid=job_id).update(**job_update)
+        logger.debug("Add %d job status, jobid=%s, indexid=%d, status=%s, description=%s, progress=%d" %
+                     (len(job_statuses), job_id, last.indexid, last.status, last.descp, last.progress))
+        job_status_hub.publish(job_id)
+        if last.progress == 0 or last.progress >= 100:
+            self.forget(job_id, last.indexid)
+
+    def forget(self, job_id, index_id=None):
+        with self.lock:
+            if index_id is None:
+                self.pending.pop(job_id, None)
+            if index_id is None or self.index_ids.get(job_id) == index_id:
+                self.index_ids.pop(job_id, None)
+
+    def run(self):
+        try:
+            while True:
+                time.sleep(self.flush_interval)
+                with self.lock:
+                    # cleared under the lock, so that the next add starts a new thread
+                    if not self.pending:
+                        self.thread = None
+                        return
+                    due = [job_id for job_id, (since, _) in self.pending.items()
+                           if time.time() - since >= self.flush_interval]
+                for job_id in due:
+                    self.flush(job_id)
+        finally:
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+            connection.close()
+
+
+class JobStatusHub(object):
+    """
+    Wake up the threads waiting for new statuses of a job when this process
+    writes them. A waiter takes the sequence number of the job before
+    reading the DB, then waits for it to change, so no write is missed.
+    """
+    def __init__(self, max_jobs=JOB_HUB_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self.cond = threading.Condition()
+        self.seqs = OrderedDict()
+
+    def get_seq(self, job_id):
+        with self.cond:
+            return self.seqs.get(job_id, 0)
+
+    def publish(self, job_id):
+        with self.cond:
+            self.seqs[job_id] = self.seqs.pop(job_id, 0) + 1
+            while len(self.seqs) > self.max_jobs:
+                self.seqs.popitem(last=False)
+            self.cond.notify_all()
+
+    def wait(self, job_id, seq, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.seqs.get(job_id, 0) == seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def forget(self, job_id):
+        with self.cond:
+            self.seqs.pop(job_id, None)
+
+
+job_status_writer = JobStatusWriter()
+job_status_hub = JobStatusHub()
@@ -0,0 +1,308 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import itertools
+import json
+import logging
+import os
+import Queue
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from lcm.pub.config.config import LCM_OP_WORKERS, LCM_OP_MAX_QUEUE
+from lcm.pub.config.config import LCM_OP_HEARTBEAT_INTERVAL, LCM_OP_HEARTBEAT_TIMEOUT
+from lcm.pub.config.config import LCM_WORKER_MODE, LCM_WORKER_POLL_INTERVAL
+from lcm.pub.database.models import LcmOpModel, JobModel
+from lcm.pub.exceptions import NFLCMQueueFullException
+from lcm.pub.utils.jobutil import enum
+from lcm.pub.utils.timeutil import now_time
+
+logger = logging.getLogger(__name__)
+
+OP_PRIORITY = enum(TERMINATE=0, INSTANTIATE=1)
+OP_STATUS = enum(QUEUED='queued', RUNNING='running')
+# hostname:pid:boot id, the boot id tells a restarted process from its predecessor with the same pid
+OP_OWNER = "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class OpExecutor(object):
+    """
+    Run the LCM operations on a bounded pool of worker threads. Operations
+    wait in a bounded queue, the ones with the lowest priority value first,
+    in submission order among the same priority. submit raises
+    NFLCMQueueFullException once max_queue operations are waiting.
+    """
+    def __init__(self, max_workers=LCM_OP_WORKERS, max_queue=LCM_OP_MAX_QUEUE):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max_queue
+        self.queue = Queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.waiting = self.running = 0
+        self.stats = {"submitted": 0, "rejected": 0, "finished": 0, "max_waiting": 0,
+                      "wait_time": 0.0, "max_wait_time": 0.0}
+
+    def submit(self, priority, op):
+        """
+        Queue op, a callable or an object with a run method such as InstVnf.
+        """
+        with self.lock:
+            if self.waiting >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise NFLCMQueueFullException("Too many LCM operations are waiting(%d)." % self.waiting)
+            self.waiting += 1
+            self.stats["submitted"] += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self.waiting)
+            self.queue.put((priority, next(self.seq), time.time(), op))
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            if len(self.workers) < self.max_workers and len(self.workers) < self.waiting + self.running:
+                worker = threading.Thread(target=self.work)
+                worker.setDaemon(True)
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        while True:
+            _, _, submit_time, op = self.queue.get()
+            wait_time = time.time() - submit_time
+            with self.lock:
+                self.waiting -= 1
+                self.running += 1
+                self.stats["wait_time"] += wait_time
+                self.stats["max_wait_time"] = max(self.stats["max_wait_time"], wait_time)
+            try:
+                getattr(op, "run", op)()
+            except:
+                logger.error(traceback.format_exc())
+            finally:
+                connection.close()
+                with self.lock:
+                    self.running -= 1
+                    self.stats["finished"] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, waiting=self.waiting, running=self.running, workers=self.max_workers,
+                         max_queue=self.max_queue)
+        started = stats["finished"] + stats["running"]
+        stats["avg_wait_time"] = stats["wait_time"] / started if started else 0.0
+        return stats
+
+
+def save_checkpoint(job_id, checkpoint):
+    """
+    Record the last phase the operation of job_id has completed.
+    """
+    LcmOpModel.objects.filter(jobid=job_id).update(checkpoint=checkpoint, updatetime=now_time())
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def is_owner_dead(op, now):
+    if now - op.heartbeat > LCM_OP_HEARTBEAT_TIMEOUT:
+        return True
+    host, pid, _ = (op.owner or "::").rsplit(":", 2)
+    if host != socket.gethostname() or op.owner == OP_OWNER:
+        return False
+    return pid == str(os.getpid()) or not pid_exists(int(pid))
+
+
+class DurableOp(object):
+    """
+    Run the operation of a LCMOP row, op_class(data, inst_id, job_id).run(),
+    or op.recover(checkpoint) when it is recovered from a stopped process,
+    and drop the row once the operation is over.
+    """
+    def __init__(self, job_id, op, checkpoint=None, recover=False):
+        self.job_id = job_id
+        self.op = op
+        self.checkpoint = checkpoint
+        self.recover = recover
+
+    def run(self):
+        LcmOpModel.objects.filter(jobid=self.job_id).update(status=OP_STATUS.RUNNING, updatetime=now_time())
+        try:
+            if self.recover:
+                self.op.recover(self.checkpoint)
+            else:
+                self.op.run()
+        finally:
+            LcmOpModel.objects.filter(jobid=self.job_id).delete()
+
+
+class OpJournal(object):
+    """
+    Persist the LCM operations in LCMOP before they are run, so that the
+    ones left unfinished by a stopped process are resumed or rolled back.
+    In the 'thread' mode an operation is owned and run by the process which
+    queued it. In the 'process' mode it is left without owner until one of
+    the lcm_worker processes claims it.
+    The process owning unfinished operations refreshes their heartbeat;
+    an owner is known to be dead when its heartbeat is stale, or at once
+    when it was a process of this host which is gone.
+    """
+    def __init__(self, executor, heartbeat_interval=LCM_OP_HEARTBEAT_INTERVAL, mode=LCM_WORKER_MODE):
+        self.executor = executor
+        self.heartbeat_interval = heartbeat_interval
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enqueue(self, priority, op_class, data, inst_id, job_id):
+        """
+        Persist and queue the operation op_class(data, inst_id, job_id).
+        """
+        local = self.mode == 'thread'
+        if not local:
+            waiting = LcmOpModel.objects.filter(owner__isnull=True).count()
+            if waiting >= self.executor.max_queue:
+                raise NFLCMQueueFullException("Too many LCM operations are waiting(%d)." % waiting)
+        LcmOpModel.objects.create(jobid=job_id, optype=op_class.__name__, instid=inst_id,
+                                  opclass="%s.%s" % (op_class.__module__, op_class.__name__),
+                                  data=json.dumps(data), priority=priority, status=OP_STATUS.QUEUED,
+                                  owner=OP_OWNER if local else None, heartbeat=int(time.time()) if local else 0,
+                                  createtime=now_time(), updatetime=now_time())
+        if not local:
+            return
+        try:
+            self.executor.submit(priority, DurableOp(job_id, op_class(data, inst_id, job_id)))
+        except NFLCMQueueFullException:
+            LcmOpModel.objects.filter(jobid=job_id).delete()
+            raise
+        self.start_heartbeat()
+
+    def submit(self, op, recover=False):
+        worker = import_string(op.opclass)(json.loads(op.data), op.instid, op.jobid)
+        self.executor.submit(op.priority, DurableOp(op.jobid, worker, op.checkpoint, recover))
+
+    def start_heartbeat(self):
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.heartbeat)
+                self.thread.setDaemon(True)
+                self.thread.start()
+
+    def heartbeat(self):
+        try:
+            while True:
+                time.sleep(self.heartbeat_interval)
+                with self.lock:
+                    if not LcmOpModel.objects.filter(owner=OP_OWNER).update(heartbeat=int(time.time())):
+                        self.thread = None
+                        return
+        except:
+            logger.error(traceback.format_exc())
+            with self.lock:
+                self.thread = None
+        finally:
+            connection.close()
+
+    def claim(self, limit):
+        """
+        Claim up to limit queued operations without owner, most urgent first,
+        and queue them on the executor. Return the ids of their jobs.
+        """
+        job_ids = []
+        for op in LcmOpModel.objects.filter(owner__isnull=True).order_by('priority', 'createtime')[:limit]:
+            claimed = LcmOpModel.objects.filter(jobid=op.jobid, owner__isnull=True).\
+                update(owner=OP_OWNER, heartbeat=int(time.time()), updatetime=now_time())
+            if not claimed:
+                continue
+            try:
+                self.submit(op)
+            except:
+                logger.error(traceback.format_exc())
+                LcmOpModel.objects.filter(jobid=op.jobid).update(owner=None, heartbeat=0)
+                break
+            job_ids.append(op.jobid)
+        if job_ids:
+            self.start_heartbeat()
+        return job_ids
+
+    def recover(self):
+        """
+        Take over the operations of the dead owners. The queued ones are run
+        again, the running ones are recovered from their last checkpoint.
+        Return the ids of the jobs taken over.
+        """
+        now = int(time.time())
+        job_ids = []
+        try:
+            ops = list(LcmOpModel.objects.filter(owner__isnull=False).exclude(owner=OP_OWNER).
+                       order_by('priority', 'createtime'))
+        except:
+            logger.error(traceback.format_exc())
+            return job_ids
+        for op in ops:
+            if not is_owner_dead(op, now):
+                continue
+            claimed = LcmOpModel.objects.filter(jobid=op.jobid, owner=op.owner, heartbeat=op.heartbeat).\
+                update(owner=OP_OWNER, heartbeat=now, updatetime=now_time())
+            if not claimed:
+                continue
+            logger.warn("Recover %s operation of job(%s) of %s at checkpoint(%s)" %
+                        (op.status, op.jobid, op.owner, op.checkpoint))
+            try:
+                if JobModel.objects.filter(jobid=op.jobid, progress__gte=100).exists():
+                    LcmOpModel.objects.filter(jobid=op.jobid).delete()
+                    continue
+                self.submit(op, recover=op.status == OP_STATUS.RUNNING)
+            except:
+                logger.error(traceback.format_exc())
+                LcmOpModel.objects.filter(jobid=op.jobid).update(owner=op.owner, heartbeat=op.heartbeat)
+                continue
+            job_ids.append(op.jobid)
+        if job_ids:
+            self.start_heartbeat()
+        return job_ids
+
+    def get_stats(self):
+        return {"mode": self.mode, "persisted": LcmOpModel.objects.count(),
+                "unclaimed": LcmOpModel.objects.filter(owner__isnull=True).count()}
+
+
+def run_worker(journal, poll_interval=LCM_WORKER_POLL_INTERVAL):
+    """
+    Main loop of a lcm_worker process: take over the operations of the dead
+    owners now and then, and claim queued operations while the executor has
+    idle workers, so that the queue is shared among the worker processes.
+    """
+    logger.info("LCM worker %s started with %d workers" % (OP_OWNER, journal.executor.max_workers))
+    last_recover = 0
+    while True:
+        if time.time() - last_recover >= journal.heartbeat_interval:
+            journal.recover()
+            last_recover = time.time()
+        stats = journal.executor.get_stats()
+        idle = stats["workers"] - stats["waiting"] - stats["running"]
+        if idle <= 0 or not journal.claim(idle):
+            time.sleep(poll_interval)
+
+
+op_executor = OpExecutor()
+op_journal = OpJournal(op_executor)
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 import sys
+import threading
+import time
 import traceback
 import logging
 import urllib2
@@ -20,6 +22,8 @@ import uuid
 import httplib2
 
 from lcm.pub.config.config import MSB_SERVICE_IP, MSB_SERVICE_PORT
+from lcm.pub.config.config import REST_POOL_MAX_CONN_PER_HOST, REST_POOL_IDLE_TIMEOUT, REST_POOL_WAIT_TIMEOUT
+from lcm.pub.config.config import LCM_OP_WORKERS, VIM_RES_WORKERS, VIM_MAX_CONCURRENCY
 
 rest_no_auth, rest_oneway_auth, rest_bothway_auth = 0, 1, 2
 HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_202_ACCEPTED = '200', '201', '204', '202'
@@ -29,7 +33,121 @@ HTTP_404_NOTFOUND, HTTP_403_FORBIDDEN, HTTP_401_UNAUTHORIZED, HTTP_400_BADREQUES
 logger = logging.getLogger(__name__)
 
 
-def call_req(base_url, user, passwd, auth_type, resource, method, content=''):
+def get_max_conn():
+    """
+    Room for LCM_OP_WORKERS operations creating VIM_RES_WORKERS resources
+    each through the msb, plus the polls and the other calls of the process.
+    """
+    if REST_POOL_MAX_CONN_PER_HOST:
+        return REST_POOL_MAX_CONN_PER_HOST
+    return LCM_OP_WORKERS * VIM_RES_WORKERS + VIM_MAX_CONCURRENCY
+
+
+class HttpPool(object):
+    """
+    Keep-alive httplib2.Http clients shared by all threads, pooled per base url.
+    An Http object is used by one thread at a time; at most max_conn of them
+    are in use per base url, the others wait up to wait_timeout seconds for
+    one to be released.
+    """
+    def __init__(self, max_conn=None, idle_timeout=REST_POOL_IDLE_TIMEOUT, wait_timeout=REST_POOL_WAIT_TIMEOUT):
+        self.max_conn = max_conn or get_max_conn()
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.cond = threading.Condition()
+        self.idle = {}
+        self.busy = {}
+        self.stats = {"acquired": 0, "reused": 0, "created": 0, "evicted": 0, "waited": 0, "wait_time": 0.0,
+                      "wait_timeouts": 0}
+
+    def acquire(self, base_url, auth_type, timeout=None):
+        """
+        Return an Http object for the base url whose requests time out after
+        timeout seconds, never if None, or None if none was released in time.
+        """
+        key = (base_url, auth_type)
+        with self.cond:
+            self.evict()
+            begin = time.time()
+            while not self.idle.get(key) and self.busy.get(key, 0) >= self.max_conn:
+                remaining = begin + self.wait_timeout - time.time()
+                if remaining <= 0:
+                    self.stats["wait_timeouts"] += 1
+                    return None
+                self.cond.wait(remaining)
+            wait_time = time.time() - begin
+            if wait_time > 0.001:
+                self.stats["waited"] += 1
+                self.stats["wait_time"] += wait_time
+            self.stats["acquired"] += 1
+            self.busy[key] = self.busy.get(key, 0) + 1
+            if self.idle.get(key):
+                http = self.idle[key].pop()[0]
+                self.stats["reused"] += 1
+            else:
+                http = None
+                self.stats["created"] += 1
+        if not http:
+            http = httplib2.Http(timeout=timeout, disable_ssl_certificate_validation=(auth_type == rest_no_auth))
+            http.follow_all_redirects = True
+        http.timeout = timeout
+        for conn in http.connections.values():
+            conn.timeout = timeout
+            if getattr(conn, "sock", None):
+                conn.sock.settimeout(timeout)
+        return http
+
+    def release(self, base_url, auth_type, http, reusable=True):
+        key = (base_url, auth_type)
+        with self.cond:
+            self.busy[key] -= 1
+            if reusable:
+                self.idle.setdefault(key, []).append((http, time.time()))
+            self.cond.notify()
+        if not reusable:
+            close_http(http)
+
+    def evict(self):
+        expired_time = time.time() - self.idle_timeout
+        for key, idle_https in self.idle.items():
+            for http, last_used in idle_https[:]:
+                if last_used < expired_time:
+                    idle_https.remove((http, last_used))
+                    close_http(http)
+                    self.stats["evicted"] += 1
+
+    def clear(self):
+        """
+        Close the idle keep-alive connections, e.g. before their server is
+        stopped. The Http objects in use are kept.
+        """
+        with self.cond:
+            idle, self.idle = self.idle, {}
+        for idle_https in idle.values():
+            for http, _ in idle_https:
+                close_http(http)
+
+    def get_stats(self):
+        with self.cond:
+            stats = dict(self.stats)
+            stats["idle"] = sum([len(v) for v in self.idle.values()])
+            stats["busy"] = sum(self.busy.values())
+        stats["reuse_ratio"] = float(stats["reused"]) / stats["acquired"] if stats["acquired"] else 0.0
+        return stats
+
+
+def close_http(http):
+    for conn in http.connections.values():
+        try:
+            conn.close()
+        except:
+            logger.error(traceback.format_exc())
+
+
+http_pool = HttpPool()
+
+
+def call_req(base_url, user, passwd, auth_type, resource, method, content='', timeout=None):
     callid = str(uuid.uuid1())
     logger.debug("[%s]call_req('%s','%s','%s',%s,'%s','%s','%s')" % (
         callid, base_url, user, passwd, auth_type, resource, method, content))
@@ -40,12 +158,16 @@ def call_req(base_url, user, passwd, auth_type, resource, method, content=''):
         headers = {'content-type': 'application/json', 'accept': 'application/json'}
         if user:
             headers['Authorization'] = 'Basic ' + ('%s:%s' % (user, passwd)).encode("base64")
-        ca_certs = None
         for retry_times in range(3):
-            http = httplib2.Http(ca_certs=ca_certs, disable_ssl_certificate_validation=(auth_type == rest_no_auth))
-            http.follow_all_redirects = True
+            http = http_pool.acquire(base_url, auth_type, timeout)
+            if not http:
+                ret = [3, "No connection to %s released in %s seconds." % (base_url, http_pool.wait_timeout),
+                       resp_status]
+                break
+            reusable = False
             try:
                 resp, resp_content = http.request(full_url, method=method.upper(), body=content, headers=headers)
+                reusable = True
                 resp_status, resp_body = resp['status'], resp_content.decode('UTF-8')
                 logger.debug("[%s][%d]status=%s,resp_body=%s)" % (callid, retry_times, resp_status, resp_body))
                 if resp_status in status_ok_list:
@@ -60,6 +182,8 @@ def call_req(base_url, user, passwd, auth_type, resource, method, content=''):
                     ret = [1, "Unable to connect to %s" % full_url, resp_status]
                     continue
                 raise ex
+            finally:
+                http_pool.release(base_url, auth_type, http, reusable)
     except urllib2.URLError as err:
         ret = [2, str(err), resp_status]
     except Exception as ex:
@@ -77,9 +201,9 @@ def call_req(base_url, user, passwd, auth_type, resource, method, content=''):
     return ret
 
 
-def req_by_msb(resource, method, content=''):
+def req_by_msb(resource, method, content='', timeout=None):
     base_url = "http://%s:%s/" % (MSB_SERVICE_IP, MSB_SERVICE_PORT)
-    return call_req(base_url, "", "", rest_no_auth, resource, method, content)
+    return call_req(base_url, "", "", rest_no_auth, resource, method, content, timeout)
 
 
 def combine_url(base_url, resource):
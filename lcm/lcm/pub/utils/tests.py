@@ -0,0 +1,442 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import unittest
+
+import mock
+from django.test import TestCase
+
+from lcm.benchmarks.tosca_bench import make_vnfd
+from lcm.pub.database.models import JobModel, JobStatusModel, LcmOpModel
+from lcm.pub.exceptions import NFLCMException, NFLCMQueueFullException
+from lcm.pub.msapi import catalog
+from lcm.pub.utils import restcall, toscautil
+from lcm.pub.utils.cacheutil import ModelCache, VimMetaCache
+from lcm.pub.utils.jobutil import JobStatusWriter, JOB_STATUS
+from lcm.pub.utils.oputil import OpExecutor, OpJournal, OP_PRIORITY, OP_STATUS, OP_OWNER
+from lcm.pub.utils.traceutil import Tracer, to_chrome_trace
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[key] = value
+
+    def expire(self, name, ttl):
+        pass
+
+    def delete(self, name):
+        self.data.pop(name, None)
+
+
+class HttpPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = restcall.HttpPool(max_conn=2, idle_timeout=60)
+
+    @mock.patch.object(restcall.httplib2, 'Http')
+    def test_reuse_released_http(self, mock_http):
+        mock_http.return_value.connections = {}
+        http = self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10)
+        self.pool.release("http://127.0.0.1:80/", restcall.rest_no_auth, http)
+        self.assertEqual(http, self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10))
+        self.assertEqual(1, mock_http.call_count)
+        stats = self.pool.get_stats()
+        self.assertEqual(0.5, stats["reuse_ratio"])
+        self.assertEqual(1, stats["busy"])
+
+    @mock.patch.object(restcall.httplib2, 'Http')
+    def test_evict_idle_http(self, mock_http):
+        mock_http.return_value.connections = {}
+        self.pool.idle_timeout = -1
+        http = self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10)
+        self.pool.release("http://127.0.0.1:80/", restcall.rest_no_auth, http)
+        self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10)
+        self.assertEqual(2, mock_http.call_count)
+        self.assertEqual(1, self.pool.get_stats()["evicted"])
+
+    @mock.patch.object(restcall, 'close_http')
+    @mock.patch.object(restcall.httplib2, 'Http')
+    def test_clear_idle_http(self, mock_http, mock_close_http):
+        mock_http.return_value.connections = {}
+        http = self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10)
+        self.pool.release("http://127.0.0.1:80/", restcall.rest_no_auth, http)
+        self.pool.clear()
+        mock_close_http.assert_called_once_with(http)
+        self.assertEqual(0, self.pool.get_stats()["idle"])
+
+    @mock.patch.object(restcall.httplib2, 'Http')
+    def test_acquire_timeout(self, mock_http):
+        mock_http.return_value.connections = {}
+        for _ in range(2):
+            self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10)
+        self.pool.wait_timeout = 0.05
+        self.assertEqual(None, self.pool.acquire("http://127.0.0.1:80/", restcall.rest_no_auth, 10))
+        self.assertEqual(1, self.pool.get_stats()["wait_timeouts"])
+        with mock.patch.object(restcall, 'http_pool', self.pool):
+            ret = restcall.call_req("http://127.0.0.1:80/", "", "", restcall.rest_no_auth, "res", "GET")
+        self.assertEqual(3, ret[0])
+
+    def test_size_from_op_concurrency(self):
+        self.assertEqual(restcall.LCM_OP_WORKERS * restcall.VIM_RES_WORKERS + restcall.VIM_MAX_CONCURRENCY,
+                         restcall.HttpPool().max_conn)
+
+    @mock.patch.object(restcall, 'http_pool')
+    def test_call_req_keeps_return_contract(self, mock_pool):
+        mock_pool.acquire.return_value.request.return_value = ({'status': '200'}, '{"a": 1}')
+        ret = restcall.call_req("http://127.0.0.1:80/", "", "", restcall.rest_no_auth, "res", "GET")
+        self.assertEqual([0, '{"a": 1}', '200'], ret)
+        self.assertEqual(1, mock_pool.release.call_count)
+
+
+class ModelCacheTest(unittest.TestCase):
+    def test_evict_least_recently_used(self):
+        cache = ModelCache(max_bytes=10, ttl=60)
+        cache.set("csar1", [], "12345")
+        cache.set("csar2", [], "12345")
+        cache.get("csar1", [])
+        cache.set("csar3", [], "12345")
+        self.assertEqual("12345", cache.get("csar1", []))
+        self.assertEqual(None, cache.get("csar2", []))
+        self.assertEqual(10, cache.get_stats()["size"])
+
+    def test_key_by_input_parameters(self):
+        cache = ModelCache(max_bytes=100, ttl=60)
+        cache.set("csar1", [{"key": "a", "value": 1}], "model_a")
+        self.assertEqual("model_a", cache.get("csar1", [{"value": 1, "key": "a"}]))
+        self.assertEqual(None, cache.get("csar1", [{"key": "a", "value": 2}]))
+
+    def test_shared_tier(self):
+        fake_redis = FakeRedis()
+        ModelCache(max_bytes=100, ttl=60, redis_client=fake_redis).set("csar1", [], "model")
+        cache = ModelCache(max_bytes=100, ttl=60, redis_client=fake_redis)
+        self.assertEqual("model", cache.get("csar1", []))
+        cache.invalidate("csar1")
+        self.assertEqual(None, cache.get("csar1", []))
+        self.assertEqual({}, fake_redis.data)
+
+    @mock.patch.object(catalog.toscautil, 'convert_vnfd_dict')
+    @mock.patch.object(catalog, 'req_by_msb')
+    @mock.patch.object(catalog, 'vnfd_model_cache', ModelCache(max_bytes=100, ttl=60))
+    def test_invalidate_when_delete_csar(self, mock_req_by_msb, mock_convert):
+        mock_req_by_msb.side_effect = [[0, '{"rawData": {}}', '200'], [0, '', '204'], [0, '{"rawData": {}}', '200']]
+        mock_convert.return_value = {"vdus": []}
+        self.assertEqual({"vdus": []}, catalog.query_vnfd_model_from_catalog("csar1"))
+        vnfd = catalog.query_vnfd_model_from_catalog("csar1")
+        vnfd["vdus"].append("vdu1")
+        self.assertEqual({"vdus": []}, catalog.query_vnfd_model_from_catalog("csar1"))
+        self.assertEqual(1, mock_convert.call_count)
+        catalog.delete_csar_from_catalog("csar1")
+        catalog.query_vnfd_model_from_catalog("csar1")
+        self.assertEqual(2, mock_convert.call_count)
+
+
+class VimMetaCacheTest(unittest.TestCase):
+    def test_single_flight(self):
+        started, loads = threading.Event(), []
+
+        def load():
+            loads.append(1)
+            started.wait(1)
+            return [{"id": "tenant_1", "name": "vnfm"}, {"id": "tenant_2", "name": "vnfm"}]
+
+        cache, ids = VimMetaCache(ttl=60, miss_refresh=60), []
+        getters = [threading.Thread(target=lambda: ids.append(cache.get_id(("vim_1", "", "tenants"), "vnfm", load)))
+                   for _ in range(5)]
+        [getter.start() for getter in getters]
+        started.set()
+        [getter.join() for getter in getters]
+        self.assertEqual(["tenant_1"] * 5, ids)
+        self.assertEqual(1, len(loads))
+        self.assertEqual(None, cache.get_id(("vim_1", "", "tenants"), "admin", load))
+        self.assertEqual(1, len(loads))
+
+    def test_reload_when_expired_or_missing(self):
+        load = mock.Mock(return_value=[{"id": "image_1", "name": "cirros"}])
+        cache = VimMetaCache(ttl=60, miss_refresh=0)
+        self.assertEqual("image_1", cache.get_id(("vim_1", "tenant_1", "images"), "cirros", load))
+        self.assertEqual(None, cache.get_id(("vim_1", "tenant_1", "images"), "ubuntu", load))
+        self.assertEqual(2, load.call_count)
+        cache.ttl = 0
+        cache.get_id(("vim_1", "tenant_1", "images"), "cirros", load)
+        self.assertEqual(3, load.call_count)
+
+    def test_invalidate(self):
+        load = mock.Mock(return_value=[{"id": "image_1", "name": "cirros"}])
+        cache = VimMetaCache(ttl=60, miss_refresh=60)
+        cache.get_id(("vim_1", "tenant_1", "images"), "cirros", load)
+        cache.get_id(("vim_2", "tenant_1", "images"), "cirros", load)
+        cache.invalidate(vim_id="vim_1")
+        self.assertEqual(None, cache.peek(("vim_1", "tenant_1", "images")))
+        self.assertEqual({"cirros": "image_1"}, cache.peek(("vim_2", "tenant_1", "images"))[0])
+
+    def test_load_error(self):
+        cache = VimMetaCache(ttl=60, miss_refresh=60)
+        self.assertRaises(KeyError, cache.get_id, ("vim_1", "", "tenants"), "vnfm", mock.Mock(side_effect=KeyError))
+        self.assertEqual(None, cache.peek(("vim_1", "", "tenants")))
+
+
+class ToscaIndexTest(unittest.TestCase):
+    def test_convert_synthetic_vnfd(self):
+        vnfd = toscautil.convert_vnfd_dict(make_vnfd(2000))
+        self.assertEqual(400, len(vnfd["vdus"]))
+        vdu = vnfd["vdus"][399]
+        self.assertEqual(["cp_399"], vdu["cps"])
+        self.assertEqual(["vl_399"], vdu["vls"])
+        self.assertEqual("image_399", vdu["image_file"])
+        self.assertEqual(["storage_399"], vdu["local_storages"])
+        self.assertEqual({"cp_id": "cp_399", "vl_id": "vl_399", "vdu_id": "vdu_399", "description": "",
+                          "properties": {"order": 0, "name": "cp_399"}}, vnfd["cps"][399])
+
+    def test_unknown_node(self):
+        src_json = make_vnfd(5)
+        src_json["instance"]["nodes"][0]["relationships"][0]["target_node_id"] = "image_x"
+        self.assertRaises(Exception, toscautil.convert_vnfd_model, src_json)
+
+    def test_classify_node_type_by_first_rule(self):
+        node_types = toscautil.VNFD_NODE_TYPES
+        self.assertEqual("vdus", node_types.classify("tosca.nodes.nfv.ext.zte.VDU"))
+        self.assertEqual("local_storages", node_types.classify("tosca.nodes.nfv.ext.LocalStorage"))
+        self.assertEqual("cps", node_types.classify("tosca.nodes.nfv.ext.zte.CP.Ext"))
+        self.assertEqual(None, node_types.classify("tosca.nodes.nfv.ext.Unknown"))
+
+
+class JobStatusWriterTest(TestCase):
+    def setUp(self):
+        self.writer = JobStatusWriter(flush_interval=60)
+        JobModel(jobid="job_1", jobtype="VNF", jobaction="INST", resid="1").save()
+
+    def test_write_in_batch(self):
+        JobStatusModel(indexid=3, jobid="job_1", status="started", progress=0, descp="INST_VNF_READY").save()
+        self.writer.add("job_1", 10, "step 1")
+        self.writer.add("job_1", 20, "step 2")
+        self.assertEqual(1, JobStatusModel.objects.filter(jobid="job_1").count())
+        with self.assertNumQueries(4):
+            self.writer.add("job_1", 100, "done")
+        self.assertEqual([3, 4, 5, 6], [s.indexid for s in JobStatusModel.objects.filter(jobid="job_1").order_by("indexid")])
+        job = JobModel.objects.get(jobid="job_1")
+        self.assertEqual(100, job.progress)
+        self.assertEqual(JOB_STATUS.FINISH, job.status)
+
+    def test_job_not_exist(self):
+        self.assertRaises(Exception, self.writer.add, "job_2", 10, "step 1")
+
+    def test_forget_job_after_first_status(self):
+        self.writer.add("job_1", 0, "INST_VNF_READY")
+        self.assertNotIn("job_1", self.writer.index_ids)
+        # the job may go on in another process
+        JobStatusModel(indexid=2, jobid="job_1", status="processing", progress=10, descp="step 1").save()
+        self.writer.add("job_1", 100, "done")
+        self.assertEqual([1, 2, 3], [s.indexid for s in JobStatusModel.objects.filter(jobid="job_1").order_by("indexid")])
+        self.assertEqual({}, self.writer.index_ids)
+
+    def test_load_index_id_out_of_lock(self):
+        self.writer.add("job_1", 10, "step 1")
+        loading, release = threading.Event(), threading.Event()
+
+        def load_index_id(job_id):
+            loading.set()
+            release.wait(5)
+            return 0
+
+        with mock.patch.object(self.writer, "load_index_id", side_effect=load_index_id):
+            thread = threading.Thread(target=self.writer.add, args=("job_2", 10, "step 1"))
+            thread.start()
+            loading.wait(5)
+            threading.Timer(2, release.set).start()
+            start = time.time()
+            self.writer.add("job_1", 20, "step 2")
+            self.assertLess(time.time() - start, 1)
+            release.set()
+            thread.join()
+        self.assertEqual(1, self.writer.index_ids["job_2"])
+
+    def test_restart_flush_thread(self):
+        self.writer.flush_interval = 0.01
+        with mock.patch.object(self.writer, "write"):
+            self.writer.add("job_1", 10, "step 1")
+            for _ in range(100):
+                if not self.writer.thread:
+                    break
+                time.sleep(0.01)
+            self.assertIsNone(self.writer.thread)
+            self.writer.add("job_1", 20, "step 2")
+            self.assertIsNotNone(self.writer.thread)
+
+
+class OpExecutorTest(unittest.TestCase):
+    def test_run_terminate_first(self):
+        executor = OpExecutor(max_workers=1, max_queue=10)
+        started, release, done = threading.Event(), threading.Event(), []
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        executor.submit(OP_PRIORITY.INSTANTIATE, block)
+        started.wait(5)
+        executor.submit(OP_PRIORITY.INSTANTIATE, lambda: done.append("instantiate"))
+        executor.submit(OP_PRIORITY.TERMINATE, lambda: done.append("terminate"))
+        self.assertEqual(2, executor.get_stats()["waiting"])
+        last = threading.Event()
+        executor.submit(OP_PRIORITY.INSTANTIATE, last.set)
+        release.set()
+        last.wait(5)
+        self.assertEqual(["terminate", "instantiate"], done)
+
+    def test_reject_when_queue_full(self):
+        executor = OpExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        executor.queue.put((OP_PRIORITY.TERMINATE, -1, 0, lambda: release.wait(5)))
+        executor.waiting = 1
+        self.assertRaises(NFLCMQueueFullException, executor.submit, OP_PRIORITY.INSTANTIATE, lambda: None)
+        self.assertEqual(1, executor.get_stats()["rejected"])
+        release.set()
+
+
+class TracerTest(unittest.TestCase):
+    def test_nested_spans(self):
+        tracer = Tracer(max_spans=10)
+        with tracer.span("untraced"):
+            pass
+        with tracer.span("instantiate", trace_id="job_1"):
+            with tracer.span("inst_pre"):
+                pass
+            try:
+                with tracer.span("apply_grant", vimId="vim_1"):
+                    raise NFLCMException("grant failed")
+            except NFLCMException:
+                pass
+        root, pre, grant = [tracer.get_spans("job_1")[i] for i in (2, 0, 1)]
+        self.assertEqual(3, len(tracer.get_spans()))
+        self.assertEqual((None, root["spanId"], root["spanId"]), (root["parentId"], pre["parentId"], grant["parentId"]))
+        self.assertEqual("NFLCMException: grant failed", grant["error"])
+        self.assertEqual({"vimId": "vim_1"}, grant["attrs"])
+        self.assertLessEqual(grant["duration"], root["duration"])
+
+    def test_attach_other_thread(self):
+        tracer = Tracer(max_spans=10)
+        with tracer.span("create_res", trace_id="job_1") as root:
+            context = tracer.get_context()
+
+            def work():
+                with tracer.attach(context), tracer.span("create_vm"):
+                    pass
+            worker = threading.Thread(target=work)
+            worker.start()
+            worker.join()
+        child = tracer.get_spans("job_1")[0]
+        self.assertEqual(("create_vm", root["spanId"]), (child["name"], child["parentId"]))
+        self.assertNotEqual(root["thread"], child["thread"])
+
+    def test_keep_last_spans(self):
+        tracer = Tracer(max_spans=3)
+        for i in range(5):
+            with tracer.span("op_%d" % i, trace_id="job_%d" % (i % 2)):
+                pass
+        self.assertEqual(["op_2", "op_3", "op_4"], [span["name"] for span in tracer.get_spans()])
+        self.assertEqual(["op_2", "op_4"], [span["name"] for span in tracer.get_spans("job_0")])
+
+    def test_chrome_trace(self):
+        tracer = Tracer(max_spans=10)
+        with tracer.span("instantiate", trace_id="job_1"):
+            with tracer.span("inst_pre"):
+                pass
+        events = to_chrome_trace(tracer.get_spans())["traceEvents"]
+        self.assertEqual(["process_name", "thread_name", "instantiate", "inst_pre"], [e["name"] for e in events])
+        root, pre = events[2], events[3]
+        self.assertEqual(("X", "job_1"), (root["ph"], events[0]["args"]["name"]))
+        self.assertEqual((root["pid"], root["tid"]), (pre["pid"], pre["tid"]))
+        self.assertLessEqual(root["ts"], pre["ts"])
+        self.assertEqual(root["args"]["spanId"], pre["args"]["parentId"])
+
+
+class FakeOp(object):
+    def __init__(self, data, inst_id, job_id):
+        self.data, self.inst_id, self.job_id = data, inst_id, job_id
+        self.calls = []
+
+    def run(self):
+        self.calls.append("run")
+
+    def recover(self, checkpoint):
+        self.calls.append(("recover", checkpoint))
+
+
+class OpJournalTest(TestCase):
+    def setUp(self):
+        self.executor = mock.Mock()
+        self.journal = OpJournal(self.executor)
+        self.journal.start_heartbeat = mock.Mock()
+
+    def add_op(self, job_id, status, owner, heartbeat, checkpoint=None):
+        LcmOpModel.objects.create(jobid=job_id, optype="FakeOp", opclass="lcm.pub.utils.tests.FakeOp",
+                                  instid="inst_1", data='{"a": 1}', priority=OP_PRIORITY.INSTANTIATE,
+                                  status=status, checkpoint=checkpoint, owner=owner, heartbeat=heartbeat)
+
+    def test_enqueue_and_run(self):
+        self.journal.enqueue(OP_PRIORITY.INSTANTIATE, FakeOp, {"a": 1}, "inst_1", "job_1")
+        op = LcmOpModel.objects.get(jobid="job_1")
+        self.assertEqual((OP_STATUS.QUEUED, OP_OWNER, "lcm.pub.utils.tests.FakeOp"),
+                         (op.status, op.owner, op.opclass))
+        priority, durable_op = self.executor.submit.call_args[0]
+        durable_op.run()
+        self.assertEqual(["run"], durable_op.op.calls)
+        self.assertFalse(LcmOpModel.objects.filter(jobid="job_1").exists())
+
+    def test_enqueue_when_queue_full(self):
+        self.executor.submit.side_effect = NFLCMQueueFullException("full")
+        self.assertRaises(NFLCMQueueFullException, self.journal.enqueue,
+                          OP_PRIORITY.INSTANTIATE, FakeOp, {}, "inst_1", "job_1")
+        self.assertFalse(LcmOpModel.objects.filter(jobid="job_1").exists())
+
+    def test_recover_ops_of_dead_owners(self):
+        now = int(time.time())
+        self.add_op("job_1", OP_STATUS.QUEUED, "host_x:1:a", 0)
+        self.add_op("job_2", OP_STATUS.RUNNING, "host_x:1:a", 0, checkpoint="create_res")
+        self.add_op("job_3", OP_STATUS.RUNNING, "host_x:2:b", now)
+        self.add_op("job_4", OP_STATUS.RUNNING, "host_x:1:a", 0)
+        JobModel.objects.create(jobid="job_4", jobtype="NF", jobaction="INSTANTIATE", resid="inst_1", progress=100)
+        self.assertEqual(["job_1", "job_2"], sorted(self.journal.recover()))
+        durable_ops = dict((args[0][1].job_id, args[0][1]) for args in self.executor.submit.call_args_list)
+        self.assertEqual(["job_1", "job_2"], sorted(durable_ops.keys()))
+        self.assertFalse(durable_ops["job_1"].recover)
+        self.assertTrue(durable_ops["job_2"].recover)
+        self.assertEqual("create_res", durable_ops["job_2"].checkpoint)
+        self.assertEqual({"a": 1}, durable_ops["job_2"].op.data)
+        self.assertEqual(OP_OWNER, LcmOpModel.objects.get(jobid="job_2").owner)
+        self.assertEqual("host_x:2:b", LcmOpModel.objects.get(jobid="job_3").owner)
+        self.assertFalse(LcmOpModel.objects.filter(jobid="job_4").exists())
+
+    def test_enqueue_and_claim_in_process_mode(self):
+        self.executor.max_queue = 2
+        journal = OpJournal(self.executor, mode='process')
+        journal.start_heartbeat = mock.Mock()
+        journal.enqueue(OP_PRIORITY.INSTANTIATE, FakeOp, {"a": 1}, "inst_1", "job_1")
+        journal.enqueue(OP_PRIORITY.TERMINATE, FakeOp, {"a": 2}, "inst_2", "job_2")
+        self.assertRaises(NFLCMQueueFullException, journal.enqueue,
+                          OP_PRIORITY.INSTANTIATE, FakeOp, {}, "inst_3", "job_3")
+        self.assertFalse(self.executor.submit.called)
+        self.assertEqual([], journal.recover())
+        self.assertEqual(["job_2"], journal.claim(1))
+        self.assertEqual(OP_OWNER, LcmOpModel.objects.get(jobid="job_2").owner)
+        self.assertEqual(["job_1"], journal.claim(5))
+        self.assertEqual([], journal.claim(5))
+        self.assertEqual(2, self.executor.submit.call_count)
@@ -0,0 +1,82 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+def safe_get(key_val, key):
+    return key_val[key] if key in key_val else ""
+
+
+class ToscaIndex(object):
+    """
+    Lookup tables over the nodes and node templates of a parsed descriptor,
+    built once per conversion so that the converters resolve references in
+    constant time instead of scanning the whole descriptor.
+    When a name is used more than once, the first node wins, as with the
+    linear scans the index replaces.
+    """
+    def __init__(self, src_json_inst, src_json_model):
+        self.nodes = safe_get(src_json_inst, 'nodes') or []
+        self.nodes_by_id = {}
+        self.nodes_by_name = {}
+        for node in self.nodes:
+            self.nodes_by_id.setdefault(node['id'], node)
+            self.nodes_by_name.setdefault(node['template_name'], node)
+        self.node_tpls_by_name = {}
+        self.requirement_sources = {}
+        for model_tpl in safe_get(src_json_model, "node_templates"):
+            self.node_tpls_by_name.setdefault(model_tpl['name'], model_tpl)
+            for rt in safe_get(model_tpl, 'requirement_templates'):
+                key = (safe_get(rt, 'name'), safe_get(rt, 'target_node_template_name'))
+                self.requirement_sources.setdefault(key, []).append(model_tpl['name'])
+        self.cp_vls = {}
+
+    def get_node(self, node_id):
+        if node_id not in self.nodes_by_id:
+            raise Exception('can not find node(%s).' % node_id)
+        return self.nodes_by_id[node_id]
+
+    def get_node_tpl(self, tpl_name):
+        return self.node_tpls_by_name.get(tpl_name)
+
+    def find_requirement_sources(self, requirement_name, target_name):
+        return list(self.requirement_sources.get((requirement_name, target_name), []))
+
+    def find_cp_vls(self, cp_name):
+        """
+        Return the names of the virtual links the CP node is linked to.
+        """
+        if cp_name not in self.cp_vls:
+            cp_node = self.nodes_by_name.get(cp_name, {})
+            self.cp_vls[cp_name] = [self.get_node(relation['target_node_id'])['template_name']
+                                    for relation in safe_get(cp_node, 'relationships')
+                                    if relation['name'] == 'virtualLink']
+        return self.cp_vls[cp_name]
+
+
+class NodeTypeTable(object):
+    """
+    Classify node type names by the first rule whose suffixes or infixes
+    match. Descriptors reuse a handful of type names over many nodes, so
+    the kind of each type name is cached.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.kinds = {}
+
+    def classify(self, type_name):
+        if type_name not in self.kinds:
+            self.kinds[type_name] = next((kind for kind, suffixes, infixes in self.rules
+                                          if type_name.endswith(suffixes) or
+                                          any(type_name.find(infix) > 0 for infix in infixes)), None)
+        return self.kinds[type_name]
@@ -14,32 +14,22 @@
 
 import json
 
+from lcm.pub.utils.toscaindex import ToscaIndex, NodeTypeTable
+
 def safe_get(key_val, key):
     return key_val[key] if key in key_val else ""
 
 
-def find_node_name(node_id, node_list):
-    for node in node_list:
-        if node['id'] == node_id:
-            return node['template_name']
-    raise Exception('can not find node(%s).' % node_id)
+def find_node_name(node_id, index):
+    return index.get_node(node_id)['template_name']
 
 
-def find_node_type(node_id, node_list):
-    for node in node_list:
-        if node['id'] == node_id:
-            return node['type_name']
-    raise Exception('can not find node(%s).' % node_id)
+def find_node_type(node_id, index):
+    return index.get_node(node_id)['type_name']
 
 
-def find_related_node(node_id, src_json_model, requirement_name):
-    related_nodes = []
-    for model_tpl in safe_get(src_json_model, "node_templates"):
-        for rt in safe_get(model_tpl, 'requirement_templates'):
-            if safe_get(rt, 'name') == requirement_name and \
-                safe_get(rt, 'target_node_template_name') == node_id:
-                related_nodes.append(model_tpl['name'])
-    return related_nodes
+def find_related_node(node_id, index, requirement_name):
+    return index.find_requirement_sources(requirement_name, node_id)
 
 
 def convert_props(src_node, dest_node):
@@ -69,13 +59,12 @@ def convert_inputs(src_json):
     return inputs
 
 
-def convert_vnf_node(src_node, src_json_model):
+def convert_vnf_node(src_node, index):
     vnf_node = {'type': src_node['type_name'], 'vnf_id': src_node['template_name'],
         'description': '', 'properties': {}, 'dependencies': [], 'networks': []}
     convert_props(src_node, vnf_node)
-    for model_tpl in safe_get(src_json_model, "node_templates"):
-        if model_tpl['name'] != vnf_node['vnf_id']:
-            continue
+    model_tpl = index.get_node_tpl(vnf_node['vnf_id'])
+    if model_tpl:
         vnf_node['dependencies'] = [{
             'key_name': requirement['name'],
             'vl_id': requirement['target_node_template_name']} for \
@@ -87,45 +76,45 @@ def convert_vnf_node(src_node, src_json_model):
     return vnf_node
 
 
-def convert_pnf_node(src_node, src_json_model):
+def convert_pnf_node(src_node, index):
     pnf_node = {'pnf_id': src_node['template_name'], 'description': '', 'properties': {}}
     convert_props(src_node, pnf_node)
-    pnf_node['cps'] = find_related_node(src_node['id'], src_json_model, 'virtualbinding')
+    pnf_node['cps'] = find_related_node(src_node['id'], index, 'virtualbinding')
     return pnf_node
 
 
-def convert_vl_node(src_node, src_node_list):
+def convert_vl_node(src_node, index):
     vl_node = {'vl_id': src_node['template_name'], 'description': '', 'properties': {}}
     convert_props(src_node, vl_node)
     vl_node['route_id'] = ''
     for relation in safe_get(src_node, 'relationships'):
         if safe_get(relation, 'type_name').endswith('.VirtualLinksTo'):
-            vl_node['route_id'] = find_node_name(relation['target_node_id'], src_node_list)
+            vl_node['route_id'] = find_node_name(relation['target_node_id'], index)
             break
     vl_node['route_external'] = (src_node['type_name'].find('.RouteExternalVL') > 0)
     return vl_node
 
 
-def convert_cp_node(src_node, src_node_list, model_type='NSD'):
+def convert_cp_node(src_node, index, model_type='NSD'):
     cp_node = {'cp_id': src_node['template_name'], 'description': '', 'properties': {}}
     convert_props(src_node, cp_node)
     src_relationships = src_node['relationships']
     for relation in src_relationships:
         if safe_get(relation, 'name') == 'virtualLink':
-            cp_node['vl_id'] = find_node_name(relation['target_node_id'], src_node_list)
+            cp_node['vl_id'] = find_node_name(relation['target_node_id'], index)
         elif safe_get(relation, 'name') == 'virtualbinding':
             node_key = 'pnf_id' if model_type == 'NSD' else 'vdu_id'
-            cp_node[node_key] = find_node_name(relation['target_node_id'], src_node_list)
+            cp_node[node_key] = find_node_name(relation['target_node_id'], index)
     return cp_node
 
 
-def convert_router_node(src_node, src_node_list):
+def convert_router_node(src_node, index):
     router_node = {'router_id': src_node['template_name'], 'description': '', 'properties': {}}
     convert_props(src_node, router_node)
     for relation in src_node['relationships']:
         if safe_get(relation, 'name') != 'external_virtual_link':
             continue
-        router_node['external_vl_id'] = find_node_name(relation['target_node_id'], src_node_list)
+        router_node['external_vl_id'] = find_node_name(relation['target_node_id'], index)
         router_node['external_ip_addresses'] = []
         if 'properties' not in relation:
             continue
@@ -136,7 +125,7 @@ def convert_router_node(src_node, src_node_list):
     return router_node
 
 
-def convert_fp_node(src_node, src_node_list, src_json_model):
+def convert_fp_node(src_node, index):
     fp_node = {'fp_id': src_node['template_name'], 'description': '', 
         'properties': {}, 'forwarder_list': []}
     convert_props(src_node, fp_node)
@@ -144,49 +133,45 @@ def convert_fp_node(src_node, src_node_list, src_json_model):
         if safe_get(relation, 'name') != 'forwarder':
             continue
         forwarder_point = {'type': 'vnf'}
-        target_node_type = find_node_type(relation['target_node_id'], src_node_list).upper()
+        target_node_type = find_node_type(relation['target_node_id'], index).upper()
         if target_node_type.find('.CP.') >= 0 or target_node_type.endswith('.CP'):
             forwarder_point['type'] = 'cp'
-        forwarder_point['node_name'] = find_node_name(relation['target_node_id'], src_node_list)
+        forwarder_point['node_name'] = find_node_name(relation['target_node_id'], index)
         forwarder_point['capability'] = ''
         if forwarder_point['type'] == 'vnf':
-            for node_tpl in src_json_model["node_templates"]:
-                if fp_node['fp_id'] != node_tpl["name"]:
+            for r_tpl in safe_get(index.get_node_tpl(fp_node['fp_id']) or {}, "requirement_templates"):
+                if safe_get(r_tpl, "target_node_template_name") != forwarder_point['node_name']:
                     continue
-                for r_tpl in safe_get(node_tpl, "requirement_templates"):
-                    if safe_get(r_tpl, "target_node_template_name") != forwarder_point['node_name']:
-                        continue
-                    forwarder_point['capability'] = safe_get(r_tpl, "target_capability_name")
-                    break
+                forwarder_point['capability'] = safe_get(r_tpl, "target_capability_name")
                 break
         fp_node['forwarder_list'].append(forwarder_point)
     return fp_node
 
 
-def convert_vnffg_group(src_group, src_group_list, src_node_list):
+def convert_vnffg_group(src_group, src_group_list, index):
     vnffg = {'vnffg_id': src_group['template_name'], 'description': '', 
         'properties': {}, 'members': []}
     convert_props(src_group, vnffg)
     for member_node_id in src_group['member_node_ids']:
-        vnffg['members'].append(find_node_name(member_node_id, src_node_list))
+        vnffg['members'].append(find_node_name(member_node_id, index))
     return vnffg
 
 
-def convert_imagefile_node(src_node, src_node_list):
+def convert_imagefile_node(src_node, index):
     image_node = {'image_file_id': src_node['template_name'], 'description': '', 
         'properties': {}}
     convert_props(src_node, image_node)
     return image_node
 
 
-def convert_localstorage_node(src_node, src_node_list):
+def convert_localstorage_node(src_node, index):
     localstorage_node = {'local_storage_id': src_node['template_name'], 'description': '', 
         'properties': {}}
     convert_props(src_node, localstorage_node)
     return localstorage_node
 
 
-def convert_vdu_node(src_node, src_node_list, src_json_model):
+def convert_vdu_node(src_node, index):
     vdu_node = {'vdu_id': src_node['template_name'], 'description': '', 'properties': {},
         'image_file': '', 'local_storages': [], 'dependencies': [], 'nfv_compute': {},
         'vls': [], 'artifacts': []}
@@ -195,13 +180,13 @@ def convert_vdu_node(src_node, src_node_list, src_json_model):
     for relation in src_node['relationships']:
         r_id, r_name = safe_get(relation, 'target_node_id'), safe_get(relation, 'name')
         if r_name == 'guest_os':
-            vdu_node['image_file'] = find_node_name(r_id, src_node_list)
+            vdu_node['image_file'] = find_node_name(r_id, index)
         elif r_name == 'local_storage':
-            vdu_node['local_storages'].append(find_node_name(r_id, src_node_list))
+            vdu_node['local_storages'].append(find_node_name(r_id, index))
         elif r_name.endswith('.AttachesTo'):
-            nt = find_node_type(r_id, src_node_list)
+            nt = find_node_type(r_id, index)
             if nt.endswith('.BlockStorage.Local') or nt.endswith('.LocalStorage'):
-                vdu_node['local_storages'].append(find_node_name(r_id, src_node_list))
+                vdu_node['local_storages'].append(find_node_name(r_id, index))
 
     for capability in src_node['capabilities']:
         if capability['name'] != 'nfv_compute':
@@ -210,18 +195,12 @@ def convert_vdu_node(src_node, src_node_list, src_json_model):
             if 'value' in prop_info:
                 vdu_node['nfv_compute'][prop_name] = prop_info['value']
 
-    vdu_node['cps'] = find_related_node(src_node['id'], src_json_model, 'virtualbinding')
+    vdu_node['cps'] = find_related_node(src_node['id'], index, 'virtualbinding')
 
     for cp_node in vdu_node['cps']:
-        for src_cp_node in src_node_list:
-            if src_cp_node['template_name'] != cp_node:
-                continue
-            for relation in safe_get(src_cp_node, 'relationships'):
-                if relation['name'] != 'virtualLink':
-                    continue
-                vl_node_name = find_node_name(relation['target_node_id'], src_node_list)
-                if vl_node_name not in vdu_node['vls']:
-                    vdu_node['vls'].append(vl_node_name)
+        for vl_node_name in index.find_cp_vls(cp_node):
+            if vl_node_name not in vdu_node['vls']:
+                vdu_node['vls'].append(vl_node_name)
 
     for item in safe_get(src_node, 'artifacts'):
         artifact = {'artifact_name': item['name'], 'type': item['type_name'], 
@@ -231,22 +210,22 @@ def convert_vdu_node(src_node, src_node_list, src_json_model):
     return vdu_node
 
 
-def convert_exposed_node(src_json, src_nodes, exposed):
+def convert_exposed_node(src_json, index, exposed):
     for item in safe_get(safe_get(src_json, 'substitution'), 'requirements'):
         exposed['external_cps'].append({'key_name': item['mapped_name'],
-            "cp_id": find_node_name(item['node_id'], src_nodes)})
+            "cp_id": find_node_name(item['node_id'], index)})
     for item in safe_get(safe_get(src_json, 'substitution'), 'capabilities'):
         exposed['forward_cps'].append({'key_name': item['mapped_name'],
-            "cp_id": find_node_name(item['node_id'], src_nodes)})
+            "cp_id": find_node_name(item['node_id'], index)})
 
 
-def convert_vnffgs(src_json_inst, src_nodes):
+def convert_vnffgs(src_json_inst, index):
     vnffgs = []
     src_groups = safe_get(src_json_inst, 'groups')
     for group in src_groups:
         type_name = group['type_name'].upper()
         if type_name.find('.VNFFG.') >= 0 or type_name.endswith('.VNFFG'):
-            vnffgs.append(convert_vnffg_group(group, src_groups, src_nodes))
+            vnffgs.append(convert_vnffg_group(group, src_groups, index))
     return vnffgs
 
 
@@ -271,63 +250,90 @@ def convert_policy_node(src_json):
 
     return target_json
 
-def convert_nsd_model(src_json):
+NSD_NODE_TYPES = NodeTypeTable([
+    ('vnfs', ('.VNF',), ('.VNF.',)),
+    ('pnfs', ('.PNF',), ('.PNF.',)),
+    ('vls', ('.VL',), ('.VL.', '.RouteExternalVL')),
+    ('cps', ('.CP',), ('.CP.',)),
+    ('fps', ('.FP',), ('.FP.',)),
+    ('routers', ('.Router',), ()),
+    ('policies', ('tosca.policies.Drools',), ())])
+
+NSD_NODE_CONVERTERS = {
+    'vnfs': convert_vnf_node,
+    'pnfs': convert_pnf_node,
+    'vls': convert_vl_node,
+    'cps': convert_cp_node,
+    'fps': convert_fp_node,
+    'routers': convert_router_node,
+    'policies': lambda node, index: convert_policy_node(node)}
+
+VNFD_NODE_TYPES = NodeTypeTable([
+    ('image_files', ('.ImageFile',), ()),
+    ('local_storages', ('.BlockStorage.Local', '.LocalStorage'), ()),
+    ('vdus', ('.VDU',), ('.VDU.',)),
+    ('vls', ('.VL',), ('.VL.', '.RouteExternalVL')),
+    ('cps', ('.CP',), ('.CP.',)),
+    ('routers', ('.Router',), ())])
+
+VNFD_NODE_CONVERTERS = {
+    'image_files': convert_imagefile_node,
+    'local_storages': convert_localstorage_node,
+    'vdus': convert_vdu_node,
+    'vls': convert_vl_node,
+    'cps': lambda node, index: convert_cp_node(node, index, 'VNFD'),
+    'routers': convert_router_node}
+
+
+def convert_nodes(src_nodes, index, node_types, node_converters, target_json):
+    for node in src_nodes:
+        kind = node_types.classify(node['type_name'])
+        if kind:
+            target_json[kind].append(node_converters[kind](node, index))
+
+
+def convert_nsd_dict(src_json):
     target_json = {'vnfs': [], 'pnfs': [], 'fps': [], 'policies': []}
     src_json_inst, src_json_model = convert_common(src_json, target_json)
-   
-    src_nodes = src_json_inst['nodes']
-    for node in src_nodes:
-        type_name = node['type_name']
-        if type_name.find('.VNF.') > 0 or type_name.endswith('.VNF'):
-            target_json['vnfs'].append(convert_vnf_node(node, src_json_model))
-        elif type_name.find('.PNF.') > 0 or type_name.endswith('.PNF'):
-            target_json['pnfs'].append(convert_pnf_node(node, src_json_model))
-        elif type_name.find('.VL.') > 0 or type_name.endswith('.VL') \
-                or node['type_name'].find('.RouteExternalVL') > 0:
-            target_json['vls'].append(convert_vl_node(node, src_nodes))
-        elif type_name.find('.CP.') > 0 or type_name.endswith('.CP'):
-            target_json['cps'].append(convert_cp_node(node, src_nodes))
-        elif type_name.find('.FP.') > 0 or type_name.endswith('.FP'):
-            target_json['fps'].append(convert_fp_node(node, src_nodes, src_json_model))
-        elif type_name.endswith('.Router'):
-            target_json['routers'].append(convert_router_node(node, src_nodes))
-        elif type_name.endswith('tosca.policies.Drools'):
-            target_json['policies'].append(convert_policy_node(node))
-
-    target_json['vnffgs'] = convert_vnffgs(src_json_inst, src_nodes)
+
+    index = ToscaIndex(src_json_inst, src_json_model)
+    convert_nodes(src_json_inst['nodes'], index, NSD_NODE_TYPES, NSD_NODE_CONVERTERS, target_json)
+
+    target_json['vnffgs'] = convert_vnffgs(src_json_inst, index)
 
     target_json['ns_exposed'] = {'external_cps': [], 'forward_cps': []}
-    convert_exposed_node(src_json_inst, src_nodes, target_json['ns_exposed'])
-    return json.dumps(target_json)
+    convert_exposed_node(src_json_inst, index, target_json['ns_exposed'])
+    return target_json
 
 
-def convert_vnfd_model(src_json):
+def convert_nsd_model(src_json):
+    return json.dumps(convert_nsd_dict(src_json))
+
+
+def convert_vnfd_dict(src_json):
+    """
+    Convert the raw data of a VNFD, v1 or v2, to the inner model and return
+    it as a dict. The raw data is only parsed once.
+    """
+    if isinstance(src_json, (unicode, str)):
+        src_json = json.loads(src_json)
+    if "vnfdVersion" in src_json["instance"].get("metadata", {}):
+        from . import toscautil_new
+        return toscautil_new.convert_vnfd_dict(src_json)
+
     target_json = {'image_files': [], 'local_storages': [], 'vdus': []}
     src_json_inst, src_json_model = convert_common(src_json, target_json)
-    if "vnfdVersion" in src_json_inst.get("metadata", {}):
-        from . import toscautil_new
-        return toscautil_new.convert_vnfd_model(src_json)
 
-    src_nodes = src_json_inst['nodes']
-    for node in src_nodes:
-        type_name = node['type_name']
-        if type_name.endswith('.ImageFile'):
-            target_json['image_files'].append(convert_imagefile_node(node, src_nodes))
-        elif type_name.endswith('.BlockStorage.Local') or type_name.endswith('.LocalStorage'):
-            target_json['local_storages'].append(convert_localstorage_node(node, src_nodes))
-        elif type_name.find('.VDU.') > 0 or type_name.endswith('.VDU'):
-            target_json['vdus'].append(convert_vdu_node(node, src_nodes, src_json_model))
-        elif type_name.find('.VL.') > 0 or type_name.endswith('.VL') \
-                or node['type_name'].find('.RouteExternalVL') > 0:
-            target_json['vls'].append(convert_vl_node(node, src_nodes))
-        elif type_name.find('.CP.') > 0 or type_name.endswith('.CP'):
-            target_json['cps'].append(convert_cp_node(node, src_nodes, 'VNFD'))
-        elif type_name.endswith('.Router'):
-            target_json['routers'].append(convert_router_node(node, src_nodes))
-    
+    index = ToscaIndex(src_json_inst, src_json_model)
+    convert_nodes(src_json_inst['nodes'], index, VNFD_NODE_TYPES, VNFD_NODE_CONVERTERS, target_json)
+
     target_json['vnf_exposed'] = {'external_cps': [], 'forward_cps': []}
-    convert_exposed_node(src_json_inst, src_nodes, target_json['vnf_exposed'])
-    return json.dumps(target_json)
+    convert_exposed_node(src_json_inst, index, target_json['vnf_exposed'])
+    return target_json
+
+
+def convert_vnfd_model(src_json):
+    return json.dumps(convert_vnfd_dict(src_json))
 
 if __name__ == '__main__':
     src_json = json.dumps(
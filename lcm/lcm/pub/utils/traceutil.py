@@ -0,0 +1,149 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import functools
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from lcm.pub.config.config import TRACE_ENABLED, TRACE_MAX_SPANS
+
+
+class Tracer(object):
+    """
+    Timed spans of the LCM operations, the last max_spans finished ones kept
+    in a ring buffer. Each span belongs to the trace of a job: the spans are
+    only recorded under a root span opened with the job id, on its thread or
+    on the threads given its context with attach().
+    """
+    def __init__(self, max_spans=TRACE_MAX_SPANS, enabled=TRACE_ENABLED):
+        self.enabled = enabled
+        self.spans = collections.deque(maxlen=max_spans)
+        self.lock = threading.Lock()
+        self.span_ids = itertools.count(1)
+        self.local = threading.local()
+
+    def get_stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def get_context(self):
+        """
+        Return the innermost open span of the thread, None outside traces.
+        """
+        stack = self.get_stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        """
+        Time the block as a child span of the innermost open span of the
+        thread, or as the root span of the trace of trace_id. The block runs
+        untraced outside any trace.
+        """
+        parent = self.get_context()
+        if not trace_id and parent:
+            trace_id = parent["traceId"]
+        if not (self.enabled and trace_id):
+            yield None
+            return
+        with self.lock:
+            span_id = next(self.span_ids)
+        span = {"traceId": trace_id,
+                "spanId": span_id,
+                "parentId": parent["spanId"] if parent and parent["traceId"] == trace_id else None,
+                "name": name,
+                "start": time.time(),
+                "duration": None,
+                "thread": threading.current_thread().name,
+                "attrs": attrs}
+        stack = self.get_stack()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = "%s: %s" % (e.__class__.__name__, e)
+            raise
+        finally:
+            stack.pop()
+            span["duration"] = time.time() - span["start"]
+            with self.lock:
+                self.spans.append(span)
+
+    @contextmanager
+    def attach(self, context):
+        """
+        Open the spans of the block as children of context, a span returned
+        by get_context() on another thread.
+        """
+        if not context:
+            yield
+            return
+        stack = self.get_stack()
+        stack.append(context)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def get_spans(self, trace_id=None):
+        with self.lock:
+            spans = list(self.spans)
+        return [span for span in spans if not trace_id or span["traceId"] == trace_id]
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+
+def traced(fun):
+    """
+    Time each call of fun in the current trace as a span named after it.
+    """
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+        with tracer.span(fun.__name__):
+            return fun(*args, **kwargs)
+    return wrapper
+
+
+def to_chrome_trace(spans):
+    """
+    Return the spans in the Chrome trace event format, loadable in
+    chrome://tracing or Perfetto: one process per trace, one row per thread.
+    """
+    events, pids, tids = [], {}, {}
+    for span in sorted(spans, key=lambda s: s["start"]):
+        if span["traceId"] not in pids:
+            pids[span["traceId"]] = len(pids) + 1
+            events.append({"name": "process_name", "ph": "M", "pid": pids[span["traceId"]], "tid": 0,
+                           "args": {"name": span["traceId"]}})
+        pid = pids[span["traceId"]]
+        if (pid, span["thread"]) not in tids:
+            tids[(pid, span["thread"])] = len(tids) + 1
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tids[(pid, span["thread"])],
+                           "args": {"name": span["thread"]}})
+        args = dict(span["attrs"], spanId=span["spanId"], parentId=span["parentId"])
+        if "error" in span:
+            args["error"] = span["error"]
+        events.append({"name": span["name"], "ph": "X", "pid": pid, "tid": tids[(pid, span["thread"])],
+                       "ts": int(span["start"] * 1000000), "dur": int(span["duration"] * 1000000),
+                       "args": args})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+tracer = Tracer()
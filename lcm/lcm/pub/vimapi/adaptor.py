@@ -13,13 +13,22 @@
 # limitations under the License.
 
 import logging
+import random
 import sys
+import threading
 import time
 import traceback
 
+from lcm.pub.config.config import VIM_RES_WORKERS
+from lcm.pub.config.config import VIM_CREATE_RETRIES, VIM_DELETE_RETRIES, VIM_RETRY_INTERVAL
+from lcm.pub.utils.cacheutil import params_hash, vim_meta_cache
+from lcm.pub.utils.dagutil import DagExecutor
+from lcm.pub.utils.traceutil import tracer
 from lcm.pub.utils.values import ignore_case_get, set_opt_val
 from . import api
 from .exceptions import VimException
+from .latency import op_latencies, OP_CREATE, OP_WAIT
+from .poller import poller, STATUS_GONE
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +36,12 @@ ERR_CODE = "500"
 RES_EXIST, RES_NEW = 0, 1
 IP_V4, IP_V6 = 4, 6
 BOOT_FROM_VOLUME, BOOT_FROM_IMAGE = 1, 2
+VOLUME_WAIT_TIMEOUT, VM_WAIT_TIMEOUT = 600, 200
+PORT_WAIT_TIMEOUT = 60
+# http codes of the delete calls worth a retry, '' when the call failed to connect
+RETRY_HTTP_CODES = ["", "409", "429", "500", "502", "503", "504"]
+# http codes of the create calls which may come from a stale tenant or image id
+STALE_META_HTTP_CODES = ["400", "404"]
 
 RES_VOLUME = "volume"
 RES_NETWORK = "network"
@@ -34,63 +49,292 @@ RES_SUBNET = "subnet"
 RES_PORT = "port"
 RES_FLAVOR = "flavor"
 RES_VM = "vm"
+# res_cache key of the flavors created in a run, by get_flavor_key
+RES_FLAVOR_SPEC = "flavor_spec"
 
+# kinds of the vim metadata cached by name, as listed by the vim api
+META_TENANT, META_IMAGE = "tenants", "images"
+META_NAMES = {META_TENANT: "Tenant", META_IMAGE: "Image"}
 
-def get_tenant_id(vim_cache, vim_id, tenant_name):
-    if vim_id not in vim_cache:
-        tenants = api.list_tenant(vim_id)
-        vim_cache[vim_id] = {}
-        for tenant in tenants["tenants"]:
-            id, name = tenant["id"], tenant["name"]
-            vim_cache[vim_id][name] = id
-    if tenant_name not in vim_cache[vim_id]:
-        raise VimException("Tenant(%s) not found in vim(%s)" % (tenant_name, vim_id), ERR_CODE)
-    return vim_cache[vim_id][tenant_name]
+# kinds of resources which must be gone before a kind is deleted
+DELETE_DEPS = {RES_VM: [], RES_FLAVOR: [RES_VM], RES_PORT: [RES_VM], RES_VOLUME: [RES_VM],
+               RES_SUBNET: [RES_PORT], RES_NETWORK: [RES_SUBNET]}
+DELETE_ORDER = [RES_VM, RES_FLAVOR, RES_PORT, RES_VOLUME, RES_SUBNET, RES_NETWORK]
+# failure statuses and timeout of the deletes which complete asynchronously
+DELETE_WAITS = {RES_VM: (["ERROR"], VM_WAIT_TIMEOUT),
+                RES_VOLUME: (["ERROR_DELETING"], VOLUME_WAIT_TIMEOUT),
+                RES_PORT: ([], PORT_WAIT_TIMEOUT)}
+LIST_KEYS = {RES_VOLUME: "volumes", RES_NETWORK: "networks", RES_SUBNET: "subnets",
+             RES_PORT: "ports", RES_FLAVOR: "flavors", RES_VM: "servers"}
+
+cache_lock = threading.RLock()
+
+
+def get_meta_id(vim_id, tenant_id, kind, name):
+    """
+    Return the id of the tenant or image of the vim with the name, listing
+    them only when they are not in vim_meta_cache.
+    """
+    meta_id = vim_meta_cache.get_id((vim_id, tenant_id, kind), name,
+        lambda: META_LIST_FUNS[kind](vim_id, tenant_id)[kind])
+    return check_meta_id(meta_id, vim_id, kind, name)
+
+def check_meta_id(meta_id, vim_id, kind, name):
+    if not meta_id:
+        raise VimException("%s(%s) not found in vim(%s)" % (META_NAMES[kind], name, vim_id), ERR_CODE)
+    return meta_id
+
+def get_tenant_id(vim_id, tenant_name):
+    return get_meta_id(vim_id, "", META_TENANT, tenant_name)
 
 def set_res_cache(res_cache, res_type, key, val):
-    if res_type not in res_cache:
-        res_cache[res_type] = {}
-    if key in res_cache[res_type]:
-        raise VimException("Duplicate key(%s) of %s" % (key, res_type), ERR_CODE)
-    res_cache[res_type][key] = val
+    with cache_lock:
+        if res_type not in res_cache:
+            res_cache[res_type] = {}
+        if key in res_cache[res_type]:
+            raise VimException("Duplicate key(%s) of %s" % (key, res_type), ERR_CODE)
+        res_cache[res_type][key] = val
 
 def get_res_id(res_cache, res_type, key):
-    if res_type not in res_cache:
-        raise VimException("%s not found in cache" % res_type, ERR_CODE)
-    if key not in res_cache[res_type]:
-        raise VimException("%s(%s) not found in cache" % (res_type, key), ERR_CODE)
-    return res_cache[res_type][key]
-
-def create_vim_res(data, do_notify):
-    vim_cache, res_cache = {}, {}
+    with cache_lock:
+        if res_type not in res_cache:
+            raise VimException("%s not found in cache" % res_type, ERR_CODE)
+        if key not in res_cache[res_type]:
+            raise VimException("%s(%s) not found in cache" % (res_type, key), ERR_CODE)
+        return res_cache[res_type][key]
+
+def plan_vim_res(data):
+    """
+    Return the resources of the VNF to create as (res_type, key) task ids
+    with the task ids they depend on and the arguments of their create
+    function, in creation order.
+    """
+    plan, task_ids = [], set()
+
+    def add(task_id, deps, *args):
+        plan.append((task_id, [d for d in deps if d in task_ids], args))
+        task_ids.add(task_id)
+
     for vol in ignore_case_get(data, "volume_storages"):
-        create_volume(vim_cache, res_cache, vol, do_notify, RES_VOLUME)
+        add((RES_VOLUME, vol["volume_storage_id"]), [], vol)
     for network in ignore_case_get(data, "vls"):
-        create_network(vim_cache, res_cache, network, do_notify, RES_NETWORK)
+        add((RES_NETWORK, network["vl_id"]), [], network)
     for subnet in ignore_case_get(data, "vls"):
-        create_subnet(vim_cache, res_cache, subnet, do_notify, RES_SUBNET)
+        add((RES_SUBNET, subnet["vl_id"]), [(RES_NETWORK, subnet["vl_id"])], subnet)
     for port in ignore_case_get(data, "cps"):
-        create_port(vim_cache, res_cache, data, port, do_notify, RES_PORT)
+        deps = []
+        if not ignore_case_get(port, "networkId"):
+            deps = [(RES_NETWORK, port["vl_id"]), (RES_SUBNET, port["vl_id"])]
+        add((RES_PORT, port["cp_id"]), deps, data, port)
+    flavor_owners = {}
     for flavor in ignore_case_get(data, "vdus"):
-        create_flavor(vim_cache, res_cache, data, flavor, do_notify, RES_FLAVOR)
+        owner = flavor_owners.setdefault(get_flavor_key(data, flavor), flavor["vdu_id"])
+        deps = [(RES_FLAVOR, owner)] if owner != flavor["vdu_id"] else []
+        add((RES_FLAVOR, flavor["vdu_id"]), deps, data, flavor)
     for vm in ignore_case_get(data, "vdus"):
-        create_vm(vim_cache, res_cache, data, vm, do_notify, RES_VM)
-
-def delete_vim_res(data, do_notify):
-    res_types = [RES_VM, RES_FLAVOR, RES_PORT, RES_SUBNET, RES_NETWORK, RES_VOLUME]
-    res_del_funs = [api.delete_vm, api.delete_flavor, api.delete_port, 
-        api.delete_subnet, api.delete_network, api.delete_volume]
-    for res_type, res_del_fun in zip(res_types, res_del_funs):
-        for res in ignore_case_get(data, res_type):
-            try:
-                if 1 == res["is_predefined"]:
-                    res_del_fun(res["vim_id"], res["tenant_id"], res["res_id"])
-            except VimException as e:
-                logger.error("Failed to delete %s(%s)", res_type, res["res_id"])
-                logger.error("%s:%s", e.http_code, e.message)
-            do_notify(res_type, res["res_id"])
-
-def create_volume(vim_cache, res_cache, vol, do_notify, res_type):
+        add((RES_VM, vm["vdu_id"]), get_vm_deps(data, vm), data, vm)
+    return plan
+
+def get_flavor_key(data, flavor):
+    """
+    Return the (vim_id, tenant name, spec hash) the VDUs of a run sharing a
+    flavor have in common. The VDUs after the first wait for its flavor.
+    """
+    location_info = flavor["properties"]["location_info"]
+    return location_info["vimid"], location_info["tenant"], get_flavor_hash(data, flavor)
+
+def create_vim_res(data, do_notify, max_workers=VIM_RES_WORKERS, do_flush=None, inst_id=None):
+    """
+    Create the resources of the VNF. Given the VNF instance id, the creates
+    are idempotent: the resources are named after get_res_tag and the
+    failed creates are retried after adopting what they may have created.
+    """
+    res_cache = {}
+    executor = DagExecutor(max_workers, do_notify, do_flush)
+    for task_id, deps, args in plan_vim_res(data):
+        executor.add_task(task_id, deps, CREATE_FUNS[task_id[0]], res_cache, *args, res_type=task_id[0],
+            res_tag=get_res_tag(inst_id, task_id))
+    executor.run()
+
+def get_res_tag(inst_id, task_id):
+    """
+    Return the tag appended to the name of the resource of task_id, the
+    same on each try to instantiate the VNF, None without an instance id.
+    """
+    if not inst_id:
+        return None
+    return params_hash([inst_id, task_id[0], task_id[1]])[:8]
+
+def get_tagged_name(name, res_tag):
+    return "%s-%s" % (name, res_tag)
+
+def adopt_res(res_type, vim_id, tenant_id, param, listed):
+    """
+    Return the resource named as param in the listed resources, as returned
+    by its create call, None if there is none.
+    """
+    for res in listed.get(LIST_KEYS[res_type], []):
+        if res.get("name") == param["name"]:
+            logger.info("Adopt %s(%s) created by a failed call", res_type, res["id"])
+            ret = dict(param, vimId=vim_id, tenantId=tenant_id, returnCode=RES_NEW)
+            ret.update(res)
+            return ret
+    return None
+
+def get_res_location(data, res_type, node):
+    if res_type == RES_PORT:
+        return get_port_location(data, node)
+    return node["properties"]["location_info"]
+
+def find_tagged_res(data, inst_id):
+    """
+    Return the resources created on the vims for the VNF instance inst_id,
+    found by the tags of their names, in the form taken by delete_vim_res.
+    The flavors are named after their spec instead: the ones of the specs of
+    the VNF are returned, for the caller to keep those other VNFs use.
+    """
+    found, listed = {}, {}
+    for task_id, deps, args in plan_vim_res(data):
+        res_type = task_id[0]
+        location_info = get_res_location(data, res_type, args[-1])
+        try:
+            vim_id, tenant_id = location_info["vimid"], get_tenant_id(location_info["vimid"], location_info["tenant"])
+            key = (res_type, vim_id, tenant_id)
+            if key not in listed:
+                listed[key] = LIST_FUNS[res_type](vim_id, tenant_id).get(LIST_KEYS[res_type], [])
+        except VimException as e:
+            logger.error("Failed to list %s of vim(%s): %s:%s", res_type, location_info["vimid"],
+                         e.http_code, e.message)
+            continue
+        if res_type == RES_FLAVOR:
+            name = get_flavor_param(data, args[-1])["name"]
+            tagged = [res for res in listed[key] if res.get("name") == name]
+        else:
+            suffix = "-" + get_res_tag(inst_id, task_id)
+            tagged = [res for res in listed[key] if (res.get("name") or "").endswith(suffix)]
+        found_ids = [res["res_id"] for res in found.get(res_type, [])]
+        for res in tagged:
+            if res["id"] not in found_ids:
+                found.setdefault(res_type, []).append(
+                    {"vim_id": vim_id, "tenant_id": tenant_id, "res_id": res["id"], "is_predefined": 1})
+    return found
+
+def create_res(res_type, vim_id, tenant_id, param, res_tag, rename=True):
+    """
+    Create the resource. If res_tag is set, the resource is named after it
+    and a create failing without a clear answer from the vim is retried,
+    unless listing the resources shows the failed call created it anyway.
+    """
+    begin = time.time()
+    with tracer.span(OP_CREATE % res_type, vimId=vim_id, resName=param.get("name")):
+        try:
+            ret = do_create_res(res_type, vim_id, tenant_id, param, res_tag, rename)
+        except VimException as e:
+            if str(e.http_code) in STALE_META_HTTP_CODES:
+                # the tenant or image may have been recreated with another id
+                vim_meta_cache.invalidate(vim_id, "", META_TENANT)
+                vim_meta_cache.invalidate(vim_id, tenant_id, META_IMAGE)
+            raise
+    op_latencies.record(vim_id, OP_CREATE % res_type, time.time() - begin)
+    return ret
+
+def do_create_res(res_type, vim_id, tenant_id, param, res_tag, rename):
+    if not res_tag:
+        return CREATE_API_FUNS[res_type](vim_id, tenant_id, param)
+    if rename:
+        param["name"] = get_tagged_name(param["name"], res_tag)
+    for retry_times in range(VIM_CREATE_RETRIES + 1):
+        if retry_times:
+            ret = adopt_res(res_type, vim_id, tenant_id, param, LIST_FUNS[res_type](vim_id, tenant_id))
+            if ret:
+                return ret
+        try:
+            return CREATE_API_FUNS[res_type](vim_id, tenant_id, param)
+        except VimException as e:
+            if retry_times == VIM_CREATE_RETRIES or not is_retry_error(e):
+                raise
+            logger.warn("Retry to create %s(%s): %s:%s", res_type, param["name"], e.http_code, e.message)
+            time.sleep(get_retry_delay(retry_times))
+
+def get_vm_deps(data, vm):
+    deps = [(RES_FLAVOR, vm["vdu_id"])]
+    for vol_data in ignore_case_get(vm, "volume_storages"):
+        deps.append((RES_VOLUME, vol_data["volume_storage_id"]))
+    cp_ids = list(ignore_case_get(vm, "cps"))
+    for port in ignore_case_get(data, "cps"):
+        if ignore_case_get(port, "vdu_id") == vm["vdu_id"] and port["cp_id"] not in cp_ids:
+            cp_ids.append(port["cp_id"])
+    for cp_id in cp_ids:
+        deps.append((RES_PORT, cp_id))
+    return deps
+
+def plan_delete_res(data):
+    """
+    Return the resources of the VNF to delete as (res_type, index) task ids
+    with the task ids they depend on and the resource, in deletion order. A
+    resource waits for all the resources of the kinds it depends on, or of
+    the kinds these depend on when the VNF has none.
+    """
+    plan, layers = [], {}
+    for res_type in DELETE_ORDER:
+        deps, dep_types = [], list(DELETE_DEPS[res_type])
+        while dep_types:
+            dep_type = dep_types.pop()
+            if layers[dep_type]:
+                deps.extend(layers[dep_type])
+            else:
+                dep_types.extend(DELETE_DEPS[dep_type])
+        layers[res_type] = []
+        for index, res in enumerate(ignore_case_get(data, res_type)):
+            plan.append(((res_type, index), deps, (res,)))
+            layers[res_type].append((res_type, index))
+    return plan
+
+def delete_vim_res(data, do_notify, max_workers=VIM_RES_WORKERS):
+    """
+    Delete the resources of data in dependency order. Each resource is
+    notified once done with, with delete_failed set in it if it is not deleted.
+    """
+    executor = DagExecutor(max_workers, do_notify)
+    for task_id, deps, args in plan_delete_res(data):
+        executor.add_task(task_id, deps, delete_res, *args, res_type=task_id[0])
+    executor.run()
+
+def is_retry_error(e):
+    return str(e.http_code) in RETRY_HTTP_CODES
+
+def get_retry_delay(retry_times):
+    return random.uniform(0.5, 1) * VIM_RETRY_INTERVAL * (2 ** retry_times)
+
+def delete_res(res, do_notify, res_type):
+    try:
+        if 1 == res["is_predefined"]:
+            vim_id, tenant_id, res_id = res["vim_id"], res["tenant_id"], res["res_id"]
+            for retry_times in range(VIM_DELETE_RETRIES + 1):
+                try:
+                    DELETE_FUNS[res_type](vim_id, tenant_id, res_id)
+                    break
+                except VimException as e:
+                    if str(e.http_code) == "404":
+                        break
+                    if retry_times == VIM_DELETE_RETRIES or not is_retry_error(e):
+                        raise
+                    logger.warn("Retry to delete %s(%s): %s:%s", res_type, res_id, e.http_code, e.message)
+                    time.sleep(get_retry_delay(retry_times))
+            if res_type in DELETE_WAITS:
+                stop_status, timeout = DELETE_WAITS[res_type]
+                info = poller.wait(vim_id, tenant_id, LIST_FUNS[res_type], LIST_KEYS[res_type], res_id,
+                    [STATUS_GONE] + stop_status, timeout)
+                status = info["status"] if info else "Timeout"
+                if status != STATUS_GONE:
+                    raise VimException("%s(%s) is not deleted: %s." % (res_type, res_id, status), ERR_CODE)
+    except VimException as e:
+        logger.error("Failed to delete %s(%s)", res_type, res["res_id"])
+        logger.error("%s:%s", e.http_code, e.message)
+        res["delete_failed"] = True
+    do_notify(res_type, res["res_id"])
+
+def get_volume_param(vol):
     location_info = vol["properties"]["location_info"]
     param = {
         "name": vol["properties"]["volume_name"],
@@ -99,25 +343,29 @@ def create_volume(vim_cache, res_cache, vol, do_notify, res_type):
     set_opt_val(param, "imageName", ignore_case_get(vol, "image_file"))
     set_opt_val(param, "volumeType", ignore_case_get(vol["properties"], "custom_volume_type"))
     set_opt_val(param, "availabilityZone", ignore_case_get(location_info, "availability_zone"))
+    return param
+
+def create_volume(res_cache, vol, do_notify, res_type, res_tag=None):
+    location_info = vol["properties"]["location_info"]
+    param = get_volume_param(vol)
     vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
-    ret = api.create_volume(vim_id, tenant_id, param)
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    ret = create_res(res_type, vim_id, tenant_id, param, res_tag)
     ret["nodeId"] = vol["volume_storage_id"]
     do_notify(res_type, ret)
     vol_id, vol_name, return_code = ret["id"], ret["name"], ret["returnCode"]
     set_res_cache(res_cache, res_type, vol["volume_storage_id"], vol_id)
-    retry_count, max_retry_count = 0, 300
-    while retry_count < max_retry_count:
-        vol_info = api.get_volume(vim_id, tenant_id, vol_id)
-        if vol_info["status"].upper() == "AVAILABLE":
-            logger.debug("Volume(%s) is available", vol_id)
-            return
-        time.sleep(2)
-        retry_count = retry_count + 1
-    raise VimException("Failed to create Volume(%s): Timeout." % vol_name, ERR_CODE)
+    begin = time.time()
+    vol_info = poller.wait(vim_id, tenant_id, api.list_volume, "volumes", vol_id,
+        ["AVAILABLE", "ERROR"], VOLUME_WAIT_TIMEOUT)
+    opt_vol_status = vol_info["status"] if vol_info else "Timeout"
+    if opt_vol_status.upper() == "AVAILABLE":
+        logger.debug("Volume(%s) is available", vol_id)
+        op_latencies.record(vim_id, OP_WAIT % res_type, time.time() - begin)
+        return
+    raise VimException("Failed to create Volume(%s): %s." % (vol_name, opt_vol_status), ERR_CODE)
     
-def create_network(vim_cache, res_cache, network, do_notify, res_type):
-    location_info = network["properties"]["location_info"]
+def get_network_param(network):
     param = {
         "name": network["properties"]["network_name"],
         "shared": False,
@@ -127,16 +375,19 @@ def create_network(vim_cache, res_cache, network, do_notify, res_type):
     set_opt_val(param, "vlanTransparent", ignore_case_get(network["properties"], "vlan_transparent"))
     set_opt_val(param, "segmentationId", int(ignore_case_get(network["properties"], "segmentation_id", "0")))
     set_opt_val(param, "routerExternal", ignore_case_get(network, "route_external"))
+    return param
+
+def create_network(res_cache, network, do_notify, res_type, res_tag=None):
+    location_info = network["properties"]["location_info"]
+    param = get_network_param(network)
     vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
-    ret = api.create_network(vim_id, tenant_id, param)
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    ret = create_res(res_type, vim_id, tenant_id, param, res_tag)
     ret["nodeId"] = network["vl_id"]
     do_notify(res_type, ret)
     set_res_cache(res_cache, res_type, network["vl_id"], ret["id"])
     
-def create_subnet(vim_cache, res_cache, subnet, do_notify, res_type):
-    location_info = subnet["properties"]["location_info"]
-    network_id = get_res_id(res_cache, RES_NETWORK, subnet["vl_id"])
+def get_subnet_param(subnet, network_id):
     param = {
         "networkId": network_id,
         "name": subnet["properties"]["name"],
@@ -152,13 +403,19 @@ def create_subnet(vim_cache, res_cache, subnet, do_notify, res_type):
     if allocation_pool:
         param["allocationPools"] = [allocation_pool]
     set_opt_val(param, "hostRoutes", ignore_case_get(subnet["properties"], "host_routes"))
+    return param
+
+def create_subnet(res_cache, subnet, do_notify, res_type, res_tag=None):
+    location_info = subnet["properties"]["location_info"]
+    network_id = get_res_id(res_cache, RES_NETWORK, subnet["vl_id"])
+    param = get_subnet_param(subnet, network_id)
     vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
-    ret = api.create_subnet(vim_id, tenant_id, param)
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    ret = create_res(res_type, vim_id, tenant_id, param, res_tag)
     do_notify(res_type, ret)
     set_res_cache(res_cache, res_type, subnet["vl_id"], ret["id"])
     
-def create_port(vim_cache, res_cache, data, port, do_notify, res_type):
+def get_port_location(data, port):
     location_info = None
     port_ref_vdu_id = ignore_case_get(port, "vdu_id")
     for vdu in ignore_case_get(data, "vdus"):
@@ -170,6 +427,9 @@ def create_port(vim_cache, res_cache, data, port, do_notify, res_type):
     if not location_info:
         err_msg = "vdu_id(%s) for cp(%s) is not defined"
         raise VimException(err_msg % (port_ref_vdu_id, port["cp_id"]), ERR_CODE)
+    return location_info
+
+def get_port_param(res_cache, port):
     network_id = ignore_case_get(port, "networkId")
     subnet_id = ignore_case_get(port, "subnetId")
     if not network_id:
@@ -184,18 +444,21 @@ def create_port(vim_cache, res_cache, data, port, do_notify, res_type):
     set_opt_val(param, "ip", ignore_case_get(port["properties"], "ip_address"))
     set_opt_val(param, "vnicType", ignore_case_get(port["properties"], "vnic_type"))
     set_opt_val(param, "securityGroups", "") # TODO
+    return param
+
+def create_port(res_cache, data, port, do_notify, res_type, res_tag=None):
+    location_info = get_port_location(data, port)
+    param = get_port_param(res_cache, port)
     vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
-    ret = api.create_port(vim_id, tenant_id, param)
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    ret = create_res(res_type, vim_id, tenant_id, param, res_tag)
     ret["nodeId"] = port["cp_id"]
     do_notify(res_type, ret)
     set_res_cache(res_cache, res_type, port["cp_id"], ret["id"])
 
-def create_flavor(vim_cache, res_cache, data, flavor, do_notify, res_type):
-    location_info = flavor["properties"]["location_info"]
+def get_flavor_spec(data, flavor):
     local_storages = ignore_case_get(data, "local_storages")
     param = {
-        "name": "Flavor_%s" % flavor["vdu_id"],
         "vcpu": int(flavor["nfv_compute"]["num_cpus"]),
         "memory": int(flavor["nfv_compute"]["mem_size"].replace('GB', '').strip()),
         "isPublic": True
@@ -214,19 +477,65 @@ def create_flavor(vim_cache, res_cache, data, flavor, do_notify, res_type):
                 param["swap"] = disk_size
     flavor_extra_specs = ignore_case_get(flavor["nfv_compute"], "flavor_extra_specs")
     extra_specs = []
-    for es in flavor_extra_specs:
+    for es in sorted(flavor_extra_specs):
         extra_specs.append({"keyName": es, "value": flavor_extra_specs[es]})
     set_opt_val(param, "extraSpecs", extra_specs)
+    return param
+
+def get_flavor_hash(data, flavor):
+    """
+    Return the hash of the flavor spec, the same for all the VDUs which can
+    share a flavor.
+    """
+    return params_hash(get_flavor_spec(data, flavor))
+
+def get_flavor_param(data, flavor):
+    param = get_flavor_spec(data, flavor)
+    param["name"] = "Flavor_%s" % params_hash(param)[:16]
+    return param
+
+def get_shared_flavor(res_cache, flavor, flavor_key, param, vim_id, tenant_id):
+    """
+    Return the flavor the VDU reuses instead of creating one, None if there
+    is none: the flavor of another VNF set in the VDU by the caller as
+    flavor_id, or the flavor created in this run for a VDU with the same spec.
+    """
+    if ignore_case_get(flavor, "flavor_id"):
+        return dict(param, id=flavor["flavor_id"], vimId=vim_id, tenantId=tenant_id,
+                    returnCode=flavor.get("flavor_return_code", RES_EXIST))
+    with cache_lock:
+        ret = res_cache.get(RES_FLAVOR_SPEC, {}).get(flavor_key)
+    return dict(ret) if ret else None
+
+def create_flavor(res_cache, data, flavor, do_notify, res_type, res_tag=None):
+    location_info = flavor["properties"]["location_info"]
+    param = get_flavor_param(data, flavor)
     vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
-    ret = api.create_flavor(vim_id, tenant_id, param)
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    flavor_key = get_flavor_key(data, flavor)
+    ret = get_shared_flavor(res_cache, flavor, flavor_key, param, vim_id, tenant_id)
+    if not ret:
+        ret = create_res(res_type, vim_id, tenant_id, param, res_tag, rename=False)
+        set_res_cache(res_cache, RES_FLAVOR_SPEC, flavor_key, dict(ret))
+    ret["specHash"] = flavor_key[2]
     do_notify(res_type, ret)
     set_res_cache(res_cache, res_type, flavor["vdu_id"], ret["id"])
     
-def create_vm(vim_cache, res_cache, data, vm, do_notify, res_type):
+def get_vm_image_name(data, vm):
+    """
+    Return the name of the image the vm boots from, "" if it boots from a volume.
+    """
+    if "image_file" in vm and vm["image_file"]:
+        for img in ignore_case_get(data, "image_files"):
+            if vm["image_file"] == img["image_file_id"]:
+               return img["properties"]["name"]
+        raise VimException("Undefined image(%s)" % vm["image_file"], ERR_CODE)
+    elif vm["volume_storages"]:
+        return ""
+    raise VimException("No image and volume defined", ERR_CODE)
+
+def get_vm_param(res_cache, vm, image_id):
     location_info = vm["properties"]["location_info"]
-    vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
-    tenant_id = get_tenant_id(vim_cache, vim_id, tenant_name)
     param = {
         "name": vm["properties"].get("name","undefined"),
         "flavorId": get_res_id(res_cache, RES_FLAVOR, vm["vdu_id"]),
@@ -236,28 +545,13 @@ def create_vm(vim_cache, res_cache, data, vm, do_notify, res_type):
         "volumeArray": []
     }
     # set boot param
-    if "image_file" in vm and vm["image_file"]:
+    if image_id:
         param["boot"]["type"] = BOOT_FROM_IMAGE
-        img_name = ""
-        for img in ignore_case_get(data, "image_files"):
-            if vm["image_file"] == img["image_file_id"]:
-               img_name = img["properties"]["name"]
-               break
-        if not img_name:
-            raise VimException("Undefined image(%s)" % vm["image_file"], ERR_CODE)
-        images = api.list_image(vim_id, tenant_id)
-        for image in images["images"]:
-            if img_name == image["name"]:
-                param["boot"]["imageId"] = image["id"]
-                break
-        if "imageId" not in param["boot"]:
-            raise VimException("Image(%s) not found in Vim(%s)" % (img_name, vim_id), ERR_CODE)
-    elif vm["volume_storages"]:
+        param["boot"]["imageId"] = image_id
+    else:
         param["boot"]["type"] = BOOT_FROM_VOLUME
         vol_id = vm["volume_storages"][0]["volume_storage_id"]
         param["boot"]["volumeId"] = get_res_id(res_cache, RES_VOLUME, vol_id)
-    else:
-        raise VimException("No image and volume defined", ERR_CODE)
 
     for cp_id in ignore_case_get(vm, "cps"):
         param["nicArray"].append({
@@ -279,24 +573,41 @@ def create_vm(vim_cache, res_cache, data, vm, do_notify, res_type):
     set_opt_val(param, "metadata", "") # TODO [{"keyName": "foo", "value": "foo value"}]
     set_opt_val(param, "securityGroups", "") # TODO List of names of security group
     set_opt_val(param, "serverGroup", "") # TODO the ServerGroup for anti-affinity and affinity
-    
-    ret = api.create_vm(vim_id, tenant_id, param)
+    return param
+
+def create_vm(res_cache, data, vm, do_notify, res_type, res_tag=None):
+    location_info = vm["properties"]["location_info"]
+    vim_id, tenant_name = location_info["vimid"], location_info["tenant"]
+    tenant_id = get_tenant_id(vim_id, tenant_name)
+    img_name, image_id = get_vm_image_name(data, vm), ""
+    if img_name:
+        image_id = get_meta_id(vim_id, tenant_id, META_IMAGE, img_name)
+    param = get_vm_param(res_cache, vm, image_id)
+    ret = create_res(res_type, vim_id, tenant_id, param, res_tag)
+    ret["volumeIds"] = [vol["volumeId"] for vol in param["volumeArray"]]
     do_notify(res_type, ret)
     #vm_id, vm_name, return_code = ret["id"], ret["name"], ret["returnCode"]
     vm_id, return_code = ret["id"], ret["returnCode"]
     if ignore_case_get(ret, "name"):
         vm_name = vm["properties"].get("name", "undefined")
         logger.debug("vm_name:%s" % vm_name)
-    opt_vm_status = "Timeout"
-    retry_count, max_retry_count = 0, 100
-    while retry_count < max_retry_count:
-        vm_info = api.get_vm(vim_id, tenant_id, vm_id)
-        if vm_info["status"].upper() == "ACTIVE":
-            logger.debug("Vm(%s) is active", vim_id)
-            return
-        if vm_info["status"].upper() == "ERROR":
-            opt_vm_status = vm_info["status"]
-            break
-        time.sleep(2)
-        retry_count = retry_count + 1
+    begin = time.time()
+    vm_info = poller.wait(vim_id, tenant_id, api.list_vm, "servers", vm_id,
+        ["ACTIVE", "ERROR"], VM_WAIT_TIMEOUT)
+    opt_vm_status = vm_info["status"] if vm_info else "Timeout"
+    if opt_vm_status.upper() == "ACTIVE":
+        logger.debug("Vm(%s) is active", vm_id)
+        op_latencies.record(vim_id, OP_WAIT % res_type, time.time() - begin)
+        return
     raise VimException("Failed to create Vm(%s): %s." % (vm_name, opt_vm_status), ERR_CODE)
+
+CREATE_FUNS = {RES_VOLUME: create_volume, RES_NETWORK: create_network, RES_SUBNET: create_subnet,
+               RES_PORT: create_port, RES_FLAVOR: create_flavor, RES_VM: create_vm}
+DELETE_FUNS = {RES_VOLUME: api.delete_volume, RES_NETWORK: api.delete_network, RES_SUBNET: api.delete_subnet,
+               RES_PORT: api.delete_port, RES_FLAVOR: api.delete_flavor, RES_VM: api.delete_vm}
+CREATE_API_FUNS = {RES_VOLUME: api.create_volume, RES_NETWORK: api.create_network, RES_SUBNET: api.create_subnet,
+                   RES_PORT: api.create_port, RES_FLAVOR: api.create_flavor, RES_VM: api.create_vm}
+LIST_FUNS = {RES_VOLUME: api.list_volume, RES_NETWORK: api.list_network, RES_SUBNET: api.list_subnet,
+             RES_PORT: api.list_port, RES_FLAVOR: api.list_flavor, RES_VM: api.list_vm}
+META_LIST_FUNS = {META_TENANT: lambda vim_id, tenant_id: api.list_tenant(vim_id),
+                  META_IMAGE: api.list_image}
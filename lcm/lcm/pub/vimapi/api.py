@@ -14,22 +14,39 @@
 
 import json
 
+from lcm.pub.config.config import REST_CALL_TIMEOUT
 from lcm.pub.utils.restcall import req_by_msb
+from lcm.pub.utils.traceutil import tracer
 from .exceptions import VimException
+from .guard import vim_guards
 
 VIM_DRIVER_BASE_URL = "openoapi/multivim/v1"
 
-def call(vim_id, tenant_id, res, method, data=''):
-    if data and not isinstance(data, (str, unicode)):
-        data = json.JSONEncoder().encode(data)
-    url = "{base_url}/{vim_id}{tenant_id}/{res}".format(
+def get_url(vim_id, tenant_id, res):
+    return "{base_url}/{vim_id}{tenant_id}/{res}".format(
         base_url=VIM_DRIVER_BASE_URL, 
         vim_id=vim_id,
         tenant_id="/" + tenant_id if tenant_id else "",
         res=res)
-    ret = req_by_msb(url, method, data)
-    if ret[0] > 0:
-        raise VimException(ret[1], ret[2])
+
+def call(vim_id, tenant_id, res, method, data=''):
+    if data and not isinstance(data, (str, unicode)):
+        data = json.JSONEncoder().encode(data)
+    url = get_url(vim_id, tenant_id, res)
+    with tracer.span("%s %s" % (method, res.split("/")[0]), vimId=vim_id, res=res) as span:
+        guard = vim_guards.get(vim_id)
+        guard.enter()
+        try:
+            # only the reads time out, a create may outlast any timeout
+            ret = req_by_msb(url, method, data, REST_CALL_TIMEOUT if method == "GET" else None)
+        except:
+            guard.exit([4, "", ""])
+            raise
+        guard.exit(ret)
+        if span:
+            span["attrs"]["status"] = ret[2]
+        if ret[0] > 0:
+            raise VimException(ret[1], ret[2])
     return json.JSONDecoder().decode(ret[1]) if ret[1] else {}
 
 ######################################################################
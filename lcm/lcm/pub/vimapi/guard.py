@@ -0,0 +1,203 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from lcm.pub.config.config import VIM_RATE_LIMIT, VIM_RATE_BURST, VIM_MAX_CONCURRENCY, VIM_LIMIT_WAIT_TIMEOUT
+from lcm.pub.config.config import VIM_BREAKER_THRESHOLD, VIM_BREAKER_RESET_TIMEOUT
+from lcm.pub.utils.enumutil import enum
+from .exceptions import VimException
+
+logger = logging.getLogger(__name__)
+
+BREAKER_STATE = enum(CLOSED='closed', OPEN='open', HALF_OPEN='half_open')
+# http code of the calls rejected without being sent, retried by the deletes
+REJECT_HTTP_CODE = "503"
+
+
+def is_vim_failure(ret):
+    """
+    A call_req result counts against the breaker when the vim did not
+    answer or answered with a 5xx.
+    """
+    return ret[0] > 1 or str(ret[2]).startswith("5")
+
+
+class TokenBucket(object):
+    """
+    Allow rate calls per second on average and up to burst at once. A
+    rate of 0 does not limit the calls.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the seconds to wait before using it.
+        """
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CircuitBreaker(object):
+    """
+    Open after threshold consecutive failures, then let one trial call
+    through every reset_timeout seconds: the breaker closes again if the
+    trial succeeds.
+    """
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = BREAKER_STATE.CLOSED
+        self.failures = 0
+        self.opened_time = 0
+        self.opens = 0
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == BREAKER_STATE.OPEN and time.time() - self.opened_time >= self.reset_timeout:
+                self.state = BREAKER_STATE.HALF_OPEN
+            if self.state == BREAKER_STATE.HALF_OPEN:
+                if self.trial:
+                    return False
+                self.trial = True
+            return self.state != BREAKER_STATE.OPEN
+
+    def record(self, failed):
+        with self.lock:
+            self.trial = False
+            if not failed:
+                self.failures = 0
+                self.state = BREAKER_STATE.CLOSED
+                return
+            self.failures += 1
+            if self.state == BREAKER_STATE.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != BREAKER_STATE.OPEN:
+                    self.opens += 1
+                self.state = BREAKER_STATE.OPEN
+                self.opened_time = time.time()
+
+    def cancel(self):
+        """
+        Release the trial of a call which was not sent.
+        """
+        with self.lock:
+            self.trial = False
+
+
+class VimGuard(object):
+    """
+    Rate limit, concurrency cap and circuit breaker of the calls to one vim,
+    shared by all the threads of the process.
+    """
+    def __init__(self, vim_id, rate=VIM_RATE_LIMIT, burst=VIM_RATE_BURST, max_concurrency=VIM_MAX_CONCURRENCY,
+                 wait_timeout=VIM_LIMIT_WAIT_TIMEOUT, threshold=VIM_BREAKER_THRESHOLD,
+                 reset_timeout=VIM_BREAKER_RESET_TIMEOUT):
+        self.vim_id = vim_id
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(threshold, reset_timeout)
+        self.max_concurrency = max(1, max_concurrency)
+        self.wait_timeout = wait_timeout
+        self.inflight = 0
+        self.cond = threading.Condition()
+        self.stats = {"calls": 0, "rejected": 0, "throttled": 0, "wait_timeouts": 0,
+                      "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def check_breaker(self):
+        if not self.breaker.allow():
+            with self.cond:
+                self.stats["rejected"] += 1
+            raise VimException("Vim(%s) is unavailable, calls are rejected for %ss after %s failures." % (
+                self.vim_id, self.breaker.reset_timeout, self.breaker.threshold), REJECT_HTTP_CODE)
+
+    def enter(self):
+        """
+        Block until the call may be sent, or raise VimException if the
+        breaker is open or no slot is free within wait_timeout.
+        """
+        self.check_breaker()
+        begin = time.time()
+        delay = self.bucket.reserve()
+        if delay:
+            time.sleep(delay)
+        with self.cond:
+            while self.inflight >= self.max_concurrency:
+                remaining = begin + self.wait_timeout - time.time()
+                if remaining <= 0:
+                    self.reject_wait()
+                self.cond.wait(remaining)
+            self.inflight += 1
+            self.add_wait(time.time() - begin)
+
+    def reject_wait(self):
+        self.stats["wait_timeouts"] += 1
+        self.breaker.cancel()
+        raise VimException("Too many calls in flight to vim(%s)." % self.vim_id, REJECT_HTTP_CODE)
+
+    def add_wait(self, wait):
+        self.stats["calls"] += 1
+        if wait > 0.001:
+            self.stats["throttled"] += 1
+            self.stats["wait_seconds"] += wait
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], wait)
+
+    def exit(self, ret):
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify()
+        self.breaker.record(is_vim_failure(ret))
+
+    def get_stats(self):
+        with self.cond:
+            stats = dict(self.stats, inflight=self.inflight)
+        stats.update(state=self.breaker.state, failures=self.breaker.failures, opens=self.breaker.opens)
+        return stats
+
+
+class VimGuards(object):
+    def __init__(self):
+        self.guards = {}
+        self.lock = threading.Lock()
+
+    def get(self, vim_id):
+        with self.lock:
+            if vim_id not in self.guards:
+                self.guards[vim_id] = VimGuard(vim_id)
+            return self.guards[vim_id]
+
+    def get_stats(self):
+        with self.lock:
+            guards = self.guards.items()
+        return dict((vim_id, guard.get_stats()) for vim_id, guard in guards)
+
+    def clear(self):
+        with self.lock:
+            self.guards.clear()
+
+
+vim_guards = VimGuards()
@@ -0,0 +1,141 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import logging
+import threading
+import time
+import traceback
+
+from lcm.pub.config.config import VIM_LATENCY_SAMPLES, VIM_LATENCY_LOAD_INTERVAL
+from lcm.pub.database.models import OpLatencyModel
+from lcm.pub.utils.dbutil import locking_atomic
+
+logger = logging.getLogger(__name__)
+
+# operations timed by the adaptor, formatted with the resource type
+OP_CREATE = "create_%s"
+OP_WAIT = "wait_%s"
+
+
+def get_percentile(values, percent):
+    """
+    Return the nearest-rank percentile of the sorted values.
+    """
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class OpLatencies(object):
+    """
+    Durations of the last samples successful runs of each operation on each
+    vim, used to estimate the duration of the next ones. The process running
+    the operations saves their durations to the DB, and the other processes,
+    e.g. the REST one when the operations run in lcm_worker processes, load
+    them every load_interval seconds.
+    """
+    def __init__(self, samples=VIM_LATENCY_SAMPLES, load_interval=VIM_LATENCY_LOAD_INTERVAL):
+        self.samples = samples
+        self.load_interval = load_interval
+        self.durations = {}
+        self.unsaved = {}
+        self.load_time = 0
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+    def record(self, vim_id, op, seconds):
+        key = (vim_id, op)
+        with self.lock:
+            if key not in self.durations:
+                self.durations[key] = collections.deque(maxlen=self.samples)
+            self.durations[key].append(seconds)
+            self.unsaved.setdefault(key, []).append(round(seconds, 3))
+
+    def estimate(self, vim_id, op, default, percent=50):
+        """
+        Return the percentile of the recorded durations of op on the vim, or
+        on all the vims if none is recorded on it, default if none at all.
+        """
+        self.load()
+        with self.lock:
+            values = list(self.durations.get((vim_id, op), []))
+            if not values:
+                values = [value for key, durations in self.durations.items() if key[1] == op
+                          for value in durations]
+        values.sort()
+        return get_percentile(values, percent) if values else default
+
+    def save(self):
+        """
+        Add the durations recorded since the last save to the ones in the DB.
+        The durations failing to be saved are kept for the next save.
+        """
+        with self.save_lock:
+            with self.lock:
+                unsaved, self.unsaved = self.unsaved, {}
+            for key, values in unsaved.items():
+                try:
+                    self.save_durations(key[0], key[1], values)
+                except:
+                    logger.error(traceback.format_exc())
+                    logger.error("Failed to save the latencies of %s on vim(%s)", key[1], key[0])
+                    with self.lock:
+                        self.unsaved[key] = (values + self.unsaved.get(key, []))[-self.samples:]
+
+    def save_durations(self, vim_id, op, values):
+        with locking_atomic():
+            latency = OpLatencyModel.objects.select_for_update().filter(vimid=vim_id, op=op).first()
+            if not latency:
+                latency = OpLatencyModel(vimid=vim_id, op=op, durations="[]")
+            latency.durations = json.dumps((json.loads(latency.durations) + values)[-self.samples:])
+            latency.save()
+
+    def load(self):
+        with self.lock:
+            if time.time() - self.load_time < self.load_interval:
+                return
+            self.load_time = time.time()
+        try:
+            latencies = list(OpLatencyModel.objects.all())
+        except:
+            logger.error(traceback.format_exc())
+            logger.error("Failed to load the latencies of the vim operations")
+            return
+        with self.lock:
+            for latency in latencies:
+                key = (latency.vimid, latency.op)
+                durations = json.loads(latency.durations) + self.unsaved.get(key, [])
+                self.durations[key] = collections.deque(durations, maxlen=self.samples)
+
+    def get_stats(self):
+        """
+        Return the stats of the recorded durations by vim and operation.
+        """
+        with self.lock:
+            durations = dict((key, sorted(values)) for key, values in self.durations.items())
+        stats = {}
+        for (vim_id, op), values in durations.items():
+            stats.setdefault(vim_id, {})[op] = {"count": len(values), "p50": get_percentile(values, 50),
+                                                "p95": get_percentile(values, 95), "max": values[-1]}
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.durations.clear()
+            self.unsaved.clear()
+            self.load_time = 0
+
+
+op_latencies = OpLatencies()
@@ -0,0 +1,198 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import logging
+import random
+import threading
+import time
+import traceback
+
+from lcm.pub.config.config import VIM_POLL_INTERVAL, VIM_POLL_MAX_INTERVAL
+from lcm.pub.utils.traceutil import tracer
+
+logger = logging.getLogger(__name__)
+
+# stop status of a resource which is no longer listed, to wait for a delete
+STATUS_GONE = "GONE"
+
+
+def get_stop_info(found, res_id, stop_status):
+    """
+    Return the info of the resource if its status is one of stop_status in
+    the listed resources found, None otherwise. found is None when the list
+    call failed, so that a failure is not taken for a deleted resource.
+    """
+    if found is None:
+        return None
+    info = found.get(res_id)
+    if not info:
+        return {"id": res_id, "status": STATUS_GONE} if STATUS_GONE in stop_status else None
+    return info if str(info.get("status", "")).upper() in stop_status else None
+
+
+class Waiter(object):
+    def __init__(self, res_id, stop_status, deadline):
+        self.res_id = res_id
+        self.stop_status = [s.upper() for s in stop_status]
+        self.deadline = deadline
+        self.info = None
+        self.polls = 0
+        self.event = threading.Event()
+
+
+class ResPoller(object):
+    """
+    Track the pending resources of all running jobs and poll them in batches:
+    one list call per (vim, tenant, resource kind) instead of one get call per
+    resource. The poll interval of a batch backs off exponentially, with jitter,
+    while none of its resources changes state. The batches of a vim are polled
+    on a thread of their own, so that a slow vim does not delay the others.
+    The poller thread exits once no wait is pending or stop() is called, and
+    is started again by the next wait.
+    """
+    def __init__(self, interval=VIM_POLL_INTERVAL, max_interval=VIM_POLL_MAX_INTERVAL):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.groups = {}
+        self.busy_vims = set()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stop_event = None
+
+    def wait(self, vim_id, tenant_id, list_fun, list_key, res_id, stop_status, timeout):
+        """
+        Block until the status of the resource is one of stop_status and
+        return its info, or return None once timeout seconds have passed.
+        Put STATUS_GONE in stop_status to wait for the resource to be deleted.
+        The wait is traced with the list calls it took, which the poller
+        makes on its own thread for all the waiting jobs.
+        """
+        with tracer.span("wait %s" % list_key, vimId=vim_id, resId=res_id) as span:
+            info = self.do_wait(vim_id, tenant_id, list_fun, list_key, res_id, stop_status, timeout, span)
+        return info
+
+    def do_wait(self, vim_id, tenant_id, list_fun, list_key, res_id, stop_status, timeout, span):
+        now = time.time()
+        waiter = Waiter(res_id, stop_status, now + timeout)
+        with self.cond:
+            key = (vim_id, tenant_id, list_key)
+            group = self.groups.get(key)
+            if not group:
+                group = self.groups[key] = {"list_fun": list_fun, "waiters": [], "next_time": now}
+            group["interval"] = self.interval
+            group["next_time"] = min(group["next_time"], now + self.interval)
+            group["waiters"].append(waiter)
+            if not self.thread or not self.thread.is_alive():
+                self.stop_event = threading.Event()
+                self.thread = threading.Thread(target=self.run, args=(self.stop_event,))
+                self.thread.setDaemon(True)
+                self.thread.start()
+            self.cond.notify()
+        if not waiter.event.wait(timeout + self.max_interval):
+            with self.cond:
+                if waiter in group["waiters"]:
+                    group["waiters"].remove(waiter)
+                if not group["waiters"] and self.groups.get(key) is group:
+                    del self.groups[key]
+        if span:
+            span["attrs"].update(polls=waiter.polls, status=waiter.info.get("status") if waiter.info else None)
+        return waiter.info
+
+    def stop(self):
+        """
+        Stop the poller thread. The pending waits are not polled any more,
+        until the next wait starts a new thread.
+        """
+        with self.cond:
+            if self.stop_event:
+                self.stop_event.set()
+            self.thread, self.stop_event = None, None
+            self.cond.notify_all()
+
+    def run(self, stop_event):
+        while True:
+            with self.cond:
+                if stop_event.is_set():
+                    return
+                if not self.groups and not self.busy_vims:
+                    self.thread, self.stop_event = None, None
+                    return
+                now = time.time()
+                groups = dict((key, group) for key, group in self.groups.items() if key[0] not in self.busy_vims)
+                due = {}
+                for key, group in groups.items():
+                    if group["next_time"] <= now:
+                        due.setdefault(key[0], []).append(key)
+                if not due:
+                    next_time = min([group["next_time"] for group in groups.values()] or
+                                    [now + self.max_interval])
+                    self.cond.wait(max(next_time - now, 0.01))
+                    continue
+                for vim_id, keys in due.items():
+                    self.busy_vims.add(vim_id)
+                    thread = threading.Thread(target=self.poll_vim, args=(vim_id, keys))
+                    thread.setDaemon(True)
+                    thread.start()
+
+    def poll_vim(self, vim_id, keys):
+        try:
+            for key in keys:
+                self.poll(key)
+        finally:
+            with self.cond:
+                self.busy_vims.discard(vim_id)
+                self.cond.notify()
+
+    def poll(self, key):
+        vim_id, tenant_id, list_key = key
+        with self.cond:
+            group = self.groups.get(key)
+        if not group:
+            return
+        found = {}
+        try:
+            for res in group["list_fun"](vim_id, tenant_id).get(list_key, []):
+                found[res["id"]] = res
+        except:
+            found = None
+            logger.error(traceback.format_exc())
+            logger.error("Failed to list %s of vim(%s) tenant(%s)", list_key, vim_id, tenant_id)
+        with self.cond:
+            now, done = time.time(), []
+            for waiter in group["waiters"]:
+                waiter.polls += 1
+                info = get_stop_info(found, waiter.res_id, waiter.stop_status)
+                if info:
+                    waiter.info = info
+                    done.append(waiter)
+                elif now >= waiter.deadline:
+                    logger.warn("Wait for %s(%s) timeout", list_key, waiter.res_id)
+                    done.append(waiter)
+            for waiter in done:
+                group["waiters"].remove(waiter)
+                waiter.event.set()
+            if not group["waiters"]:
+                if self.groups.get(key) is group:
+                    del self.groups[key]
+                return
+            if done:
+                group["interval"] = self.interval
+            else:
+                group["interval"] = min(group["interval"] * 2, self.max_interval)
+            group["next_time"] = now + random.uniform(group["interval"] / 2.0, group["interval"])
+
+
+poller = ResPoller()
+atexit.register(poller.stop)
@@ -0,0 +1,373 @@
+# Copyright 2017 ZTE Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import json
+import threading
+import time
+import unittest
+
+import mock
+
+from lcm.pub.exceptions import NFLCMException
+from lcm.pub.utils.cacheutil import vim_meta_cache
+from lcm.pub.utils.dagutil import DagExecutor
+from lcm.pub.utils.traceutil import tracer
+from lcm.pub.vimapi import adaptor, api
+from lcm.pub.vimapi.exceptions import VimException
+from lcm.pub.vimapi.guard import BREAKER_STATE, TokenBucket, VimGuard, vim_guards
+from lcm.pub.vimapi.poller import ResPoller
+from lcm.samples.tests import inst_res_data
+
+
+def vim_call(vim_id, tenant_id, res, method, data=''):
+    if res == "tenants":
+        return {"tenants": [{"id": "tenant_1", "name": "vnfm"}]}
+    if res == "images":
+        return {"images": [{"id": "image_1", "name": "cirros.img"}]}
+    if res == "volumes" and method == "GET":
+        return {"volumes": [{"id": "volumes_1", "status": "available"}]}
+    if res == "servers" and method == "GET":
+        return {"servers": [{"id": "servers_1", "status": "ACTIVE"}]}
+    return {"id": "%s_1" % res, "name": data.get("name", ""), "returnCode": 1}
+
+
+class DagExecutorTest(unittest.TestCase):
+    def test_run_in_dependency_order(self):
+        done, notified = [], []
+
+        def task(name, do_notify):
+            done.append(name)
+            do_notify(name)
+
+        executor = DagExecutor(4, notified.append)
+        executor.add_task("c", ["a", "b"], task, "c")
+        executor.add_task("a", [], task, "a")
+        executor.add_task("b", ["a"], task, "b")
+        executor.run()
+        self.assertEqual(["a", "b", "c"], done)
+        self.assertEqual(["a", "b", "c"], notified)
+
+    def test_raise_first_task_error(self):
+        def fail(do_notify):
+            raise VimException("boom", "500")
+
+        executor = DagExecutor(2, lambda *args: None)
+        executor.add_task("a", [], fail)
+        executor.add_task("b", ["a"], lambda do_notify: None)
+        self.assertRaises(VimException, executor.run)
+
+    def test_cyclic_dependency(self):
+        executor = DagExecutor(2, lambda *args: None)
+        executor.add_task("a", ["b"], lambda do_notify: None)
+        executor.add_task("b", ["a"], lambda do_notify: None)
+        self.assertRaises(NFLCMException, executor.run)
+
+
+class CreateVimResTest(unittest.TestCase):
+    def setUp(self):
+        vim_meta_cache.clear()
+
+    @mock.patch.object(api, 'call')
+    def test_create_vim_res(self, mock_call):
+        mock_call.side_effect = vim_call
+        notified = []
+        adaptor.create_vim_res(copy.deepcopy(inst_res_data), lambda res_type, ret: notified.append(res_type))
+        self.assertEqual(sorted([adaptor.RES_VOLUME, adaptor.RES_NETWORK, adaptor.RES_SUBNET,
+                                 adaptor.RES_PORT, adaptor.RES_FLAVOR, adaptor.RES_VM]), sorted(notified))
+        self.assertEqual(adaptor.RES_VM, notified[-1])
+        self.assertLess(notified.index(adaptor.RES_NETWORK), notified.index(adaptor.RES_SUBNET))
+        self.assertLess(notified.index(adaptor.RES_SUBNET), notified.index(adaptor.RES_PORT))
+
+    @mock.patch.object(api, 'req_by_msb')
+    def test_trace_create_vim_res(self, mock_req_by_msb):
+        def req_by_msb(url, method, data='', timeout=None):
+            ret = vim_call("", "", url.split("/")[-1], method, json.loads(data) if data else {})
+            return [0, json.dumps(ret), "200"]
+        mock_req_by_msb.side_effect = req_by_msb
+        with tracer.span("create_res", trace_id="job_trace_1"):
+            adaptor.create_vim_res(copy.deepcopy(inst_res_data), lambda res_type, ret: None)
+        spans = dict((span["spanId"], span) for span in tracer.get_spans("job_trace_1"))
+
+        def get_path(name):
+            span = [s for s in spans.values() if s["name"] == name][0]
+            path = [name]
+            while span["parentId"]:
+                span = spans[span["parentId"]]
+                path.append(span["name"])
+            return path
+        self.assertEqual(["POST servers", "create_vm", "vm:vdu_vNat", "create_res"], get_path("POST servers"))
+        self.assertEqual(["wait servers", "vm:vdu_vNat", "create_res"], get_path("wait servers"))
+        wait = [s for s in spans.values() if s["name"] == "wait servers"][0]
+        self.assertEqual("ACTIVE", wait["attrs"]["status"])
+        self.assertLessEqual(1, wait["attrs"]["polls"])
+        # the list calls of the poller are shared by the jobs and not traced
+        self.assertNotIn("GET servers", [s["name"] for s in spans.values()])
+
+    @mock.patch.object(adaptor, 'VIM_RETRY_INTERVAL', 0.01)
+    @mock.patch.object(api, 'call')
+    def test_adopt_res_created_by_failed_call(self, mock_call):
+        networks = []
+
+        def call(vim_id, tenant_id, res, method, data=''):
+            if res == "networks" and method == "POST":
+                networks.append({"id": "networks_1", "name": data["name"]})
+                raise VimException("timeout", "")
+            if res == "networks" and method == "GET":
+                return {"networks": networks}
+            return vim_call(vim_id, tenant_id, res, method, data)
+        mock_call.side_effect = call
+        rets = []
+        adaptor.create_vim_res(copy.deepcopy(inst_res_data), lambda res_type, ret: rets.append(ret)
+                               if res_type == adaptor.RES_NETWORK else None, inst_id="nf_inst_1")
+        self.assertEqual(1, len([c for c in mock_call.call_args_list if c[0][2:4] == ("networks", "POST")]))
+        tag = adaptor.get_res_tag("nf_inst_1", (adaptor.RES_NETWORK, "vl_vNat"))
+        self.assertEqual("networks_1", rets[0]["id"])
+        self.assertTrue(rets[0]["name"].endswith("-" + tag))
+
+    @mock.patch.object(api, 'call')
+    def test_share_vim_meta_across_runs(self, mock_call):
+        mock_call.side_effect = vim_call
+        adaptor.create_vim_res(copy.deepcopy(inst_res_data), lambda res_type, ret: None)
+        adaptor.create_vim_res(copy.deepcopy(inst_res_data), lambda res_type, ret: None)
+        self.assertEqual(1, len([c for c in mock_call.call_args_list if c[0][2] == "tenants"]))
+        self.assertEqual(1, len([c for c in mock_call.call_args_list if c[0][2] == "images"]))
+
+    @mock.patch.object(api, 'call')
+    def test_invalidate_vim_meta_when_create_fails(self, mock_call):
+        def create_vm_fails(vim_id, tenant_id, res, method, data=''):
+            if res == "servers" and method == "POST":
+                raise VimException("Image not found", "404")
+            return vim_call(vim_id, tenant_id, res, method, data)
+
+        mock_call.side_effect = create_vm_fails
+        self.assertRaises(VimException, adaptor.create_vim_res, copy.deepcopy(inst_res_data),
+                          lambda res_type, ret: None)
+        vim_id = inst_res_data["vdus"][0]["properties"]["location_info"]["vimid"]
+        self.assertEqual(None, vim_meta_cache.peek((vim_id, "", adaptor.META_TENANT)))
+        self.assertEqual(None, vim_meta_cache.peek((vim_id, "tenant_1", adaptor.META_IMAGE)))
+
+    @mock.patch.object(api, 'call')
+    def test_share_flavor_of_same_spec(self, mock_call):
+        mock_call.side_effect = vim_call
+        data = copy.deepcopy(inst_res_data)
+        vdu = copy.deepcopy(data["vdus"][0])
+        vdu["vdu_id"], vdu["cps"], vdu["volume_storages"] = "vdu_copy", [], []
+        data["vdus"].append(vdu)
+        deps = dict((task_id, deps) for task_id, deps, args in adaptor.plan_vim_res(data))
+        self.assertEqual([(adaptor.RES_FLAVOR, "vdu_vNat")], deps[(adaptor.RES_FLAVOR, "vdu_copy")])
+        flavors = []
+        adaptor.create_vim_res(data, lambda res_type, ret: flavors.append(ret) if res_type == adaptor.RES_FLAVOR else None)
+        self.assertEqual(1, len([c for c in mock_call.call_args_list if c[0][2:4] == ("flavors", "POST")]))
+        self.assertEqual(["flavors_1", "flavors_1"], [ret["id"] for ret in flavors])
+        self.assertEqual(flavors[0]["specHash"], flavors[1]["specHash"])
+
+    @mock.patch.object(api, 'call')
+    def test_reuse_flavor_of_other_vnf(self, mock_call):
+        mock_call.side_effect = vim_call
+        data = copy.deepcopy(inst_res_data)
+        data["vdus"][0]["flavor_id"], data["vdus"][0]["flavor_return_code"] = "flavor_x", 1
+        flavors = []
+        adaptor.create_vim_res(data, lambda res_type, ret: flavors.append(ret) if res_type == adaptor.RES_FLAVOR else None)
+        self.assertEqual(0, len([c for c in mock_call.call_args_list if c[0][2] == "flavors"]))
+        self.assertEqual(("flavor_x", 1), (flavors[0]["id"], flavors[0]["returnCode"]))
+        self.assertEqual("flavor_x", [c for c in mock_call.call_args_list if c[0][2] == "servers"][0][0][4]["flavorId"])
+
+
+def delete_data():
+    res = {"vim_id": "vim_1", "tenant_id": "tenant_1", "is_predefined": 1}
+    return {adaptor.RES_VM: [dict(res, res_id="vm_1"), dict(res, res_id="vm_2")],
+            adaptor.RES_PORT: [dict(res, res_id="port_1")],
+            adaptor.RES_SUBNET: [dict(res, res_id="subnet_1")],
+            adaptor.RES_NETWORK: [dict(res, res_id="network_1", is_predefined=0)]}
+
+
+class DeleteVimResTest(unittest.TestCase):
+    def test_plan_delete_res(self):
+        data = delete_data()
+        del data[adaptor.RES_PORT]
+        deps = dict((task_id, deps) for task_id, deps, args in adaptor.plan_delete_res(data))
+        self.assertEqual([], deps[(adaptor.RES_VM, 0)])
+        self.assertEqual([(adaptor.RES_VM, 0), (adaptor.RES_VM, 1)], deps[(adaptor.RES_SUBNET, 0)])
+        self.assertEqual([(adaptor.RES_SUBNET, 0)], deps[(adaptor.RES_NETWORK, 0)])
+
+    @mock.patch.object(adaptor, 'VIM_RETRY_INTERVAL', 0.01)
+    @mock.patch.object(api, 'call')
+    def test_delete_vim_res(self, mock_call):
+        calls, servers = [], [{"id": "vm_1", "status": "ACTIVE"}, {"id": "vm_2", "status": "ACTIVE"}]
+
+        def delete_call(vim_id, tenant_id, res, method, data=''):
+            calls.append((method, res))
+            if method == "GET":
+                found = list(servers) if res == "servers" else []
+                del servers[:]
+                return {res: found}
+            if res == "subnets/subnet_1" and calls.count((method, res)) == 1:
+                raise VimException("in use", "409")
+            if res == "ports/port_1":
+                raise VimException("not found", "404")
+            return {}
+        mock_call.side_effect = delete_call
+        deleted = []
+        adaptor.delete_vim_res(delete_data(), lambda res_type, res_id: deleted.append(res_id))
+        self.assertEqual(["network_1", "port_1", "subnet_1", "vm_1", "vm_2"], sorted(deleted))
+        self.assertLess(deleted.index("vm_2"), deleted.index("port_1"))
+        self.assertLess(deleted.index("port_1"), deleted.index("subnet_1"))
+        self.assertEqual(2, calls.count(("GET", "servers")))
+        self.assertLess(calls.index(("GET", "servers")), calls.index(("DELETE", "ports/port_1")))
+        self.assertEqual(2, calls.count(("DELETE", "subnets/subnet_1")))
+        self.assertNotIn(("DELETE", "networks/network_1"), calls)
+
+    @mock.patch.object(api, 'call')
+    def test_delete_failed(self, mock_call):
+        mock_call.side_effect = VimException("forbidden", "403")
+        deleted = []
+        adaptor.delete_vim_res(delete_data(), lambda res_type, res_id: deleted.append(res_id))
+        self.assertEqual(5, len(deleted))
+        self.assertEqual(4, mock_call.call_count)
+
+
+class ResPollerTest(unittest.TestCase):
+    def setUp(self):
+        self.poller = ResPoller(0.01, 0.05)
+
+    def tearDown(self):
+        self.poller.stop()
+
+    def test_wait_in_batch(self):
+        list_fun = mock.Mock(return_value={"volumes": [
+            {"id": "vol_1", "status": "available"}, {"id": "vol_2", "status": "available"}]})
+        poller = self.poller
+        infos = {}
+
+        def wait(res_id):
+            infos[res_id] = poller.wait("vim_1", "tenant_1", list_fun, "volumes", res_id, ["available"], 1)
+
+        waiters = [threading.Thread(target=wait, args=(res_id,)) for res_id in ("vol_1", "vol_2")]
+        [waiter.start() for waiter in waiters]
+        [waiter.join() for waiter in waiters]
+        self.assertEqual("vol_1", infos["vol_1"]["id"])
+        self.assertEqual("vol_2", infos["vol_2"]["id"])
+        list_fun.assert_called_with("vim_1", "tenant_1")
+
+    def test_wait_timeout(self):
+        list_fun = mock.Mock(return_value={"volumes": [{"id": "vol_1", "status": "creating"}]})
+        poller = self.poller
+        self.assertEqual(None, poller.wait("vim_1", "tenant_1", list_fun, "volumes", "vol_1", ["available"], 0.1))
+
+    def test_remove_timeout_waiter(self):
+        list_fun = mock.Mock(side_effect=lambda vim_id, tenant_id: time.sleep(0.5) or {"volumes": []})
+        poller = self.poller
+        self.assertEqual(None, poller.wait("vim_1", "tenant_1", list_fun, "volumes", "vol_1", ["available"], 0.01))
+        self.assertEqual({}, poller.groups)
+
+    def test_slow_vim_not_delay_others(self):
+        def list_volumes(vim_id, tenant_id):
+            if vim_id == "vim_1":
+                time.sleep(1)
+            return {"volumes": [{"id": "vol_1", "status": "available"}]}
+
+        poller = self.poller
+        slow = threading.Thread(target=poller.wait,
+                                args=("vim_1", "tenant_1", list_volumes, "volumes", "vol_1", ["available"], 2))
+        slow.start()
+        time.sleep(0.05)
+        start = time.time()
+        info = poller.wait("vim_2", "tenant_1", list_volumes, "volumes", "vol_1", ["available"], 2)
+        self.assertEqual("available", info["status"])
+        self.assertLess(time.time() - start, 0.5)
+        slow.join()
+
+    def test_exit_when_idle(self):
+        list_fun = mock.Mock(return_value={"volumes": [{"id": "vol_1", "status": "available"}]})
+        self.poller.wait("vim_1", "tenant_1", list_fun, "volumes", "vol_1", ["available"], 1)
+        thread = self.poller.thread
+        if thread:
+            thread.join(1)
+        self.assertIsNone(self.poller.thread)
+        self.assertEqual("vol_1", self.poller.wait("vim_1", "tenant_1", list_fun, "volumes", "vol_1",
+                                                   ["available"], 1)["id"])
+
+    def test_stop(self):
+        list_fun = mock.Mock(return_value={"volumes": [{"id": "vol_1", "status": "creating"}]})
+        waiter = threading.Thread(target=self.poller.wait,
+                                  args=("vim_1", "tenant_1", list_fun, "volumes", "vol_1", ["available"], 0.5))
+        waiter.start()
+        time.sleep(0.05)
+        thread = self.poller.thread
+        self.poller.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        time.sleep(0.1)
+        polls = list_fun.call_count
+        waiter.join()
+        self.assertEqual(polls, list_fun.call_count)
+
+
+class VimGuardTest(unittest.TestCase):
+    def setUp(self):
+        vim_guards.clear()
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(10, 2)
+        self.assertEqual([0, 0], [bucket.reserve(), bucket.reserve()])
+        self.assertAlmostEqual(0.1, bucket.reserve(), delta=0.02)
+        self.assertAlmostEqual(0.2, bucket.reserve(), delta=0.02)
+        self.assertEqual(0, TokenBucket(0, 1).reserve())
+
+    def test_concurrency_cap(self):
+        guard = VimGuard("vim_1", rate=0, max_concurrency=1, wait_timeout=0.05)
+        guard.enter()
+        self.assertRaises(VimException, guard.enter)
+        threading.Timer(0.02, guard.exit, args=([0, "", "200"],)).start()
+        guard.wait_timeout = 1
+        guard.enter()
+        stats = guard.get_stats()
+        self.assertEqual((1, 1, 1), (stats["inflight"], stats["wait_timeouts"], stats["throttled"]))
+
+    def test_breaker(self):
+        guard = VimGuard("vim_1", rate=0, threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            guard.enter()
+            guard.exit([3, "timeout", ""])
+        self.assertEqual(BREAKER_STATE.OPEN, guard.get_stats()["state"])
+        self.assertRaises(VimException, guard.enter)
+        time.sleep(0.06)
+        guard.enter()
+        self.assertRaises(VimException, guard.enter)
+        guard.exit([1, "", "404"])
+        stats = guard.get_stats()
+        self.assertEqual((BREAKER_STATE.CLOSED, 2, 1), (stats["state"], stats["rejected"], stats["opens"]))
+
+    @mock.patch.object(api, 'req_by_msb')
+    def test_fail_fast(self, mock_req_by_msb):
+        mock_req_by_msb.return_value = [1, "error", "503"]
+        for _ in range(5):
+            self.assertRaises(VimException, api.list_vm, "vim_1", "tenant_1")
+        try:
+            api.list_vm("vim_1", "tenant_1")
+        except VimException as e:
+            self.assertIn("unavailable", e.message)
+        self.assertEqual(5, mock_req_by_msb.call_count)
+        mock_req_by_msb.return_value = [0, '{"servers": []}', "200"]
+        self.assertEqual({"servers": []}, api.list_vm("vim_2", "tenant_1"))
+
+    @mock.patch.object(api, 'req_by_msb')
+    def test_timeout_reads_only(self, mock_req_by_msb):
+        mock_req_by_msb.return_value = [0, '{"servers": []}', "200"]
+        api.list_vm("vim_1", "tenant_1")
+        self.assertEqual(api.REST_CALL_TIMEOUT, mock_req_by_msb.call_args[0][3])
+        mock_req_by_msb.return_value = [0, '{"id": "vm_1"}', "200"]
+        api.create_vm("vim_1", "tenant_1", {"name": "vm_1"})
+        self.assertEqual(None, mock_req_by_msb.call_args[0][3])
@@ -17,6 +17,14 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from lcm.pub.config.config import RECOVER_LCM_OPS_WHEN_START, LCM_WORKER_MODE
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lcm.settings")
 
 application = get_wsgi_application()
+
+# take over the LCM operations left unfinished by stopped processes when
+# serving, the lcm_worker processes do it in the 'process' mode
+if RECOVER_LCM_OPS_WHEN_START and LCM_WORKER_MODE == 'thread':
+    from lcm.pub.utils.oputil import op_journal
+    op_journal.recover()
@@ -13,3 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 nohup python manage.py runserver 127.0.0.1:8801 > /dev/null &
+# with LCM_WORKER_MODE = 'process' in config.py, start the workers, e.g. LCM_WORKERS=4 ./run.sh
+for i in $(seq 1 ${LCM_WORKERS:-0}); do
+    nohup python manage.py lcm_worker > /dev/null &
+done